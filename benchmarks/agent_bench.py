@@ -0,0 +1,318 @@
+"""
+End-to-end agent benchmark on a real Xvfb display.
+
+Leases an Xvfb display from `computer_use_demo.displays.DisplayPool`, opens xterm
+(and gedit when installed) as scripted targets, and measures:
+
+* per-action latency of `ComputerTool`, `BashTool` and `EditTool`
+* the screenshot pipeline: settle, capture, resize and encode (from tracing spans)
+* `sampling_loop` turn latency against the replay server
+* peak RSS of the benchmark process and its children
+
+Results are JSON so they can be stored as baselines and compared between versions:
+
+    python -m benchmarks.agent_bench --iterations 20 --save-baseline
+    python -m benchmarks.agent_bench --baseline benchmarks/baselines/agent.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Any, cast
+
+from computer_use_demo import tracing
+from computer_use_demo.displays import DisplayPool
+from computer_use_demo.loop import APIProvider, sampling_loop
+from computer_use_demo.replay import (
+    Cassette,
+    Exchange,
+    ReplayConfig,
+    request_key,
+    serve_in_thread,
+)
+from computer_use_demo.tools import BashTool, ComputerTool, EditTool, ToolCollection
+
+from .common import Timings, compare, peak_rss_kb, report, save_baseline
+
+BENCH_DISPLAY_NUM = 90
+SCRIPTED_PROMPT = "Take a screenshot and tell me what you see."
+
+
+@asynccontextmanager
+async def scripted_apps(display_num: int) -> AsyncIterator[None]:
+    """Open the desktop apps the computer actions are aimed at."""
+    env = {**os.environ, "DISPLAY": f":{display_num}"}
+    commands = [["xterm", "-geometry", "80x24+0+0"]]
+    if shutil.which("gedit"):
+        commands.append(["gedit", "--new-window"])
+    processes = [
+        await asyncio.create_subprocess_exec(
+            *command,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        for command in commands
+    ]
+    await asyncio.sleep(1.0)
+    try:
+        yield
+    finally:
+        for process in processes:
+            process.terminate()
+            await process.wait()
+
+
+SCREENSHOT_SPANS = {
+    "computer.settle": "settle",
+    "computer.capture": "capture",
+    "computer.resize": "resize",
+    "computer.encode": "encode",
+}
+
+
+def record_screenshot_spans(timings: Timings) -> None:
+    """Collect the screenshot pipeline stages from the tracing spans."""
+
+    def sink(span: tracing.Span) -> None:
+        if stage := SCREENSHOT_SPANS.get(span.name):
+            timings.add(f"screenshot.{stage}", span.duration_ns / 1e9)
+
+    tracing.configure(sink=sink)
+
+
+async def bench_computer(tool: ComputerTool, timings: Timings, iterations: int) -> None:
+    width, height = tool.options["display_width_px"], tool.options["display_height_px"]
+    actions: list[dict[str, Any]] = [
+        {"action": "mouse_move", "coordinate": [width // 4, height // 8]},
+        {"action": "left_click"},
+        {"action": "type", "text": "echo benchmark"},
+        {"action": "key", "text": "Return"},
+        {"action": "cursor_position"},
+        {"action": "screenshot"},
+    ]
+    for _ in range(iterations):
+        for action in actions:
+            with timings.measure(f"computer.{action['action']}"):
+                await tool(**action)
+
+
+async def bench_bash(tool: BashTool, timings: Timings, iterations: int) -> None:
+    commands = {
+        "echo": "echo benchmark",
+        "ls": "ls /usr/bin | head -200",
+        "large_output": "seq 1 10000",
+    }
+    with timings.measure("bash.start"):
+        await tool(restart=True)
+    for _ in range(iterations):
+        for name, command in commands.items():
+            with timings.measure(f"bash.{name}"):
+                await tool(command=command)
+
+
+async def bench_edit(tool: EditTool, timings: Timings, iterations: int) -> None:
+    with tempfile.TemporaryDirectory() as workdir:
+        body = "".join(f"line {i}\tvalue = {i * 7}\n" for i in range(20000))
+        for iteration in range(iterations):
+            path = f"{workdir}/file_{iteration}.txt"
+            steps: list[tuple[str, dict[str, Any]]] = [
+                ("create", {"command": "create", "file_text": body}),
+                ("view", {"command": "view"}),
+                ("view_range", {"command": "view", "view_range": [10000, 10040]}),
+                (
+                    "str_replace",
+                    {
+                        "command": "str_replace",
+                        "old_str": "line 12345\t",
+                        "new_str": "line 12345 edited\t",
+                    },
+                ),
+                ("insert", {"command": "insert", "insert_line": 500, "new_str": "new"}),
+                ("undo_edit", {"command": "undo_edit"}),
+            ]
+            for name, params in steps:
+                with timings.measure(f"edit.{name}"):
+                    await tool(path=path, **params)
+            with timings.measure("edit.view_directory"):
+                await tool(command="view", path=workdir)
+
+
+def scripted_cassette(path: Path) -> Cassette:
+    """A two-request conversation: one screenshot tool call, then a final answer."""
+    cassette = Cassette(path)
+    user = {"role": "user", "content": [{"type": "text", "text": SCRIPTED_PROMPT}]}
+    tool_use = {
+        "type": "tool_use",
+        "id": "toolu_bench",
+        "name": "computer",
+        "input": {"action": "screenshot"},
+    }
+    message = {
+        "type": "message",
+        "role": "assistant",
+        "model": "replay",
+        "stop_sequence": None,
+        "usage": {"input_tokens": 1500, "output_tokens": 40},
+    }
+    cassette.add(
+        Exchange(
+            key=request_key([user]),
+            turn=1,
+            latency=0.0,
+            status=200,
+            response={
+                **message,
+                "id": "msg_1",
+                "content": [tool_use],
+                "stop_reason": "tool_use",
+            },
+        )
+    )
+    cassette.add(
+        Exchange(
+            key=request_key(
+                [
+                    user,
+                    {"role": "assistant", "content": [tool_use]},
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "tool_result", "tool_use_id": "toolu_bench"}
+                        ],
+                    },
+                ]
+            ),
+            turn=3,
+            latency=0.0,
+            status=200,
+            response={
+                **message,
+                "id": "msg_2",
+                "content": [{"type": "text", "text": "A terminal window."}],
+                "stop_reason": "end_turn",
+            },
+        )
+    )
+    return cassette
+
+
+async def bench_loop(
+    timings: Timings, iterations: int, api_latency: float, tools: ToolCollection
+) -> None:
+    with tempfile.TemporaryDirectory() as workdir:
+        cassette = scripted_cassette(Path(workdir) / "cassette.jsonl")
+        with serve_in_thread(cassette, ReplayConfig(latency=api_latency)) as server:
+            for _ in range(iterations):
+                with timings.measure("loop.turn"):
+                    await sampling_loop(
+                        model="replay",
+                        provider=APIProvider.ANTHROPIC,
+                        system_prompt_suffix="",
+                        messages=[
+                            {
+                                "role": "user",
+                                "content": [{"type": "text", "text": SCRIPTED_PROMPT}],
+                            }
+                        ],
+                        output_callback=lambda block: None,
+                        tool_output_callback=lambda result, tool_id: None,
+                        api_response_callback=lambda request, response, error: None,
+                        api_key="replay",
+                        base_url=server.base_url,
+                        tool_collection=tools,
+                    )
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict[str, Any]:
+    timings = Timings()
+    pool = DisplayPool(
+        1,
+        args.width,
+        args.height,
+        first_display_num=BENCH_DISPLAY_NUM,
+        window_manager=False,
+    )
+    await pool.start()
+    try:
+        async with pool.lease() as display, scripted_apps(display.display_num):
+            tools = display.tool_collection()
+            computer = cast(ComputerTool, tools.tool_map["computer"])
+            computer._screenshot_delay = args.settle
+            record_screenshot_spans(timings)
+            await bench_computer(computer, timings, args.iterations)
+            tracing.disable()
+            bash = cast(BashTool, tools.tool_map["bash"])
+            await bench_bash(bash, timings, args.iterations)
+            await bench_edit(EditTool(), timings, args.iterations)
+            await bench_loop(timings, args.iterations, args.api_latency, tools)
+    finally:
+        await pool.close()
+
+    metrics: dict[str, Any] = {}
+    for name, summary in timings.summary().items():
+        group, _, action = name.partition(".")
+        metrics.setdefault(group, {})[action] = summary
+    metrics["peak_rss_kb"] = peak_rss_kb()
+    metrics["settings"] = {
+        "width": args.width,
+        "height": args.height,
+        "settle_s": args.settle,
+        "api_latency_s": args.api_latency,
+        "iterations": args.iterations,
+    }
+    return report("agent", metrics)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--height", type=int, default=768)
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=ComputerTool._screenshot_delay,
+        help="Seconds to wait after an action before its screenshot",
+    )
+    parser.add_argument(
+        "--api-latency", type=float, default=0.0, help="Replayed API latency in seconds"
+    )
+    parser.add_argument(
+        "--baseline", type=Path, help="Baseline JSON to compare against"
+    )
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument(
+        "--save-baseline",
+        nargs="?",
+        const=True,
+        help="Write results as the new baseline (optionally to a given path)",
+    )
+    args = parser.parse_args()
+
+    result = asyncio.run(run_benchmark(args))
+    print(json.dumps(result, indent=2))  # noqa: T201
+
+    if args.save_baseline:
+        path = None if args.save_baseline is True else Path(args.save_baseline)
+        print(f"Saved baseline to {save_baseline(result, path)}", file=sys.stderr)  # noqa: T201
+    if args.baseline:
+        regressions = compare(
+            result, json.loads(args.baseline.read_text()), args.tolerance
+        )
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)  # noqa: T201
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
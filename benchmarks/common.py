@@ -0,0 +1,118 @@
+"""Shared helpers for the benchmark scripts: timing, percentiles and JSON baselines."""
+
+import json
+import math
+import platform
+import resource
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+BASELINE_DIR = Path(__file__).parent / "baselines"
+DEFAULT_TOLERANCE = 0.2
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    """Nearest-rank percentile of `samples`."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def summarize(samples: list[float]) -> dict[str, float]:
+    """Summarize latency samples (seconds) as milliseconds."""
+    summary = {
+        f"p{pct}": round(percentile(samples, pct) * 1000, 3) for pct in PERCENTILES
+    }
+    summary["mean"] = round(sum(samples) / len(samples) * 1000, 3) if samples else 0.0
+    summary["n"] = len(samples)
+    return summary
+
+
+def peak_rss_kb() -> dict[str, int]:
+    """Peak resident set size of this process and its reaped children, in KiB."""
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    }
+
+
+class Timings:
+    """Named buckets of latency samples."""
+
+    def __init__(self):
+        self.samples: dict[str, list[float]] = defaultdict(list)
+
+    @contextmanager
+    def measure(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[name].append(time.perf_counter() - started)
+
+    def add(self, name: str, seconds: float) -> None:
+        self.samples[name].append(seconds)
+
+    def summary(self) -> dict[str, dict[str, float]]:
+        return {
+            name: summarize(values) for name, values in sorted(self.samples.items())
+        }
+
+
+def report(name: str, metrics: dict[str, Any]) -> dict[str, Any]:
+    """Wrap benchmark metrics with enough context to compare runs."""
+    return {
+        "benchmark": name,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "metrics": metrics,
+    }
+
+
+def save_baseline(result: dict[str, Any], path: Path | None = None) -> Path:
+    path = path or BASELINE_DIR / f"{result['benchmark']}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(result, indent=2, sort_keys=True) + "\n")
+    return path
+
+
+def compare(
+    result: dict[str, Any],
+    baseline: dict[str, Any],
+    tolerance: float = DEFAULT_TOLERANCE,
+    key: str = "p50",
+) -> list[str]:
+    """
+    Return a line per latency metric that got slower than `baseline` by more than
+    `tolerance` (a fraction) at the `key` percentile.
+    """
+    regressions = []
+    for name, current in _flatten(result["metrics"]).items():
+        previous = _flatten(baseline["metrics"]).get(name)
+        if not previous or key not in current or not previous.get(key):
+            continue
+        if current[key] > previous[key] * (1 + tolerance):
+            regressions.append(
+                f"{name}: {key} {previous[key]:.3f}ms -> {current[key]:.3f}ms "
+                f"(+{(current[key] / previous[key] - 1) * 100:.0f}%)"
+            )
+    return regressions
+
+
+def _flatten(metrics: dict[str, Any], prefix: str = "") -> dict[str, dict[str, float]]:
+    flat = {}
+    for name, value in metrics.items():
+        if not isinstance(value, dict):
+            continue
+        if "n" in value:
+            flat[f"{prefix}{name}"] = value
+        else:
+            flat.update(_flatten(value, f"{prefix}{name}."))
+    return flat
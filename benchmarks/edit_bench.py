@@ -0,0 +1,92 @@
+"""
+EditTool latency and peak memory on large files.
+
+Writes a `--size-mb` file of numbered lines, then times `str_replace` near the start,
+middle and end, `insert` at the same places and a `view` range in the middle. Peak
+memory is the largest amount traced by tracemalloc during an edit, as a multiple of
+the file size; an edit should stay close to one file's worth:
+
+    python -m benchmarks.edit_bench --size-mb 100
+"""
+
+import argparse
+import asyncio
+import json
+import tempfile
+import tracemalloc
+from pathlib import Path
+from typing import Any
+
+from computer_use_demo.tools import EditTool
+
+from .common import Timings, report
+
+LINE = "{:>10} the quick brown fox jumps over the lazy dog\n"
+
+
+def write_file(path: Path, size: int) -> int:
+    """Fill `path` with numbered lines up to about `size` bytes; returns the line count."""
+    lines = size // len(LINE.format(0))
+    with path.open("w") as f:
+        for start in range(0, lines, 10_000):
+            f.write(
+                "".join(
+                    LINE.format(n) for n in range(start, min(start + 10_000, lines))
+                )
+            )
+    return lines
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict[str, Any]:
+    timings = Timings()
+    peaks: dict[str, float] = {}
+    tool = EditTool()
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "large.txt"
+        lines = write_file(path, args.size_mb * 1024 * 1024)
+        size = path.stat().st_size
+        for where, line in (("start", 10), ("middle", lines // 2), ("end", lines - 10)):
+            commands = {
+                "str_replace": dict(
+                    command="str_replace",
+                    old_str=LINE.format(line).rstrip(),
+                    new_str=f"replaced {line}",
+                ),
+                "insert": dict(command="insert", insert_line=line, new_str="inserted"),
+                "view": dict(command="view", view_range=[line, line + 5]),
+            }
+            for name, kwargs in commands.items():
+                key = f"{name}.{where}"
+                for _ in range(args.repeat):
+                    with timings.measure(key):
+                        await tool(path=str(path), **kwargs)
+                    if name != "view":
+                        await tool(command="undo_edit", path=str(path))
+                # once more for memory; tracemalloc slows down small allocations
+                tracemalloc.start()
+                await tool(path=str(path), **kwargs)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                peaks[key] = round(peak / size, 2)
+                if name != "view":
+                    await tool(command="undo_edit", path=str(path))
+    return report(
+        "edit",
+        {
+            "file_bytes": size,
+            "edit": timings.summary(),
+            "peak_memory_file_multiple": peaks,
+        },
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--size-mb", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run_benchmark(args)), indent=2))  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
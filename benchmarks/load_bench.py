@@ -0,0 +1,199 @@
+"""
+Websocket server throughput under concurrent sessions, by number of worker processes.
+
+For each `--workers` setting, starts `image/http_server.py` against the replay server
+and has `--sessions` websocket clients send a prompt, wait for the answer and clear
+the conversation, as fast as they can for `--duration` seconds. Turns per second
+should grow roughly linearly with workers until the cores run out:
+
+    python -m benchmarks.load_bench --workers 0,1,2,4 --sessions 32
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+import aiohttp
+
+from computer_use_demo.replay import (
+    Cassette,
+    Exchange,
+    ReplayConfig,
+    request_key,
+    serve_in_thread,
+)
+
+from .common import Timings, report
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+SERVER = REPO_ROOT / "image" / "http_server.py"
+PROMPT = "Say hello."
+SERVER_READY_TIMEOUT = 30.0  # seconds
+
+
+def text_cassette(path: Path) -> Cassette:
+    """Answers PROMPT with a long-ish text reply and no tool calls."""
+    cassette = Cassette(path)
+    user = {"role": "user", "content": [{"type": "text", "text": PROMPT}]}
+    cassette.add(
+        Exchange(
+            key=request_key([user]),
+            turn=1,
+            latency=0.0,
+            status=200,
+            response={
+                "id": "msg_load",
+                "type": "message",
+                "role": "assistant",
+                "model": "replay",
+                "content": [{"type": "text", "text": "Hello! " * 200}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": {"input_tokens": 1500, "output_tokens": 400},
+            },
+        )
+    )
+    return cassette
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_for_server(port: int) -> None:
+    deadline = time.monotonic() + SERVER_READY_TIMEOUT
+    async with aiohttp.ClientSession() as client:
+        while True:
+            try:
+                async with client.get(f"http://127.0.0.1:{port}/metrics"):
+                    return
+            except aiohttp.ClientConnectionError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("http_server did not start") from None
+                await asyncio.sleep(0.2)
+
+
+async def _receive_until(ws: aiohttp.ClientWebSocketResponse, key: str) -> None:
+    async for msg in ws:
+        data = json.loads(msg.data)
+        if "error" in data:
+            raise RuntimeError(data["error"])
+        if key in data:
+            return
+    raise RuntimeError("websocket closed")
+
+
+async def _turn(ws: aiohttp.ClientWebSocketResponse, timings: Timings | None) -> None:
+    started = time.perf_counter()
+    await ws.send_json({"message": PROMPT})
+    await _receive_until(ws, "response")
+    if timings:
+        timings.add("turn", time.perf_counter() - started)
+    await ws.send_json({"message": "!clear"})
+    await _receive_until(ws, "status")
+
+
+async def client_session(
+    port: int, duration: float, timings: Timings, warmed_up: asyncio.Barrier
+) -> int:
+    turns = 0
+    async with (
+        aiohttp.ClientSession() as client,
+        client.ws_connect(f"http://127.0.0.1:{port}/websocket") as ws,
+    ):
+        # the first turn in each process pays for imports and client setup
+        await _turn(ws, None)
+        await warmed_up.wait()
+        deadline = time.monotonic() + duration
+        while time.monotonic() < deadline:
+            await _turn(ws, timings)
+            turns += 1
+        await ws.send_json({"end": True})
+    return turns
+
+
+async def run_load(
+    workers: int, sessions: int, duration: float, base_url: str
+) -> dict[str, Any]:
+    port = _free_port()
+    server = await asyncio.create_subprocess_exec(
+        sys.executable,
+        str(SERVER),
+        env={
+            "WIDTH": "1024",
+            "HEIGHT": "768",
+            **os.environ,
+            "PORT": str(port),
+            "WORKERS": str(workers),
+            "ANTHROPIC_API_KEY": "replay",
+            "ANTHROPIC_BASE_URL": base_url,
+            "PYTHONPATH": str(REPO_ROOT),
+        },
+        stdout=asyncio.subprocess.DEVNULL,
+    )
+    try:
+        await _wait_for_server(port)
+        timings = Timings()
+        warmed_up = asyncio.Barrier(sessions)
+        turns = await asyncio.gather(
+            *(
+                client_session(port, duration, timings, warmed_up)
+                for _ in range(sessions)
+            )
+        )
+    finally:
+        server.terminate()
+        await server.wait()
+    return {
+        "turns_per_s": round(sum(turns) / duration, 2),
+        "turn": timings.summary().get("turn", {}),
+    }
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict[str, Any]:
+    metrics: dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        cassette = text_cassette(Path(workdir) / "cassette.jsonl")
+        config = ReplayConfig(latency=args.api_latency)
+        with serve_in_thread(cassette, config) as replay:
+            for workers in args.workers:
+                metrics[f"workers_{workers}"] = await run_load(
+                    workers, args.sessions, args.duration, replay.base_url
+                )
+    metrics["settings"] = {
+        "sessions": args.sessions,
+        "duration_s": args.duration,
+        "api_latency_s": args.api_latency,
+        "cpus": os.cpu_count(),
+    }
+    return report("load", metrics)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--workers",
+        type=lambda value: [int(n) for n in value.split(",")],
+        default=[0, 1, 2, 4],
+        help="Comma-separated WORKERS settings to compare; 0 runs sessions in-process",
+    )
+    parser.add_argument("--sessions", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--api-latency", type=float, default=0.0, help="Replayed API latency in seconds"
+    )
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run_benchmark(args)), indent=2))  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Latency of running a short command, through a shell and through the fork server.
+
+Times `--command` run by `run`, which starts it through `/bin/sh` from this process,
+and by a `ForkServer`, which runs it without a shell from its helper process. The
+floor is `posix_spawn` and `waitpid` called directly, which is what the command
+itself costs. Overheads are p50 latencies minus the floor's. `--ballast-mb` grows
+this process first, like an agent holding screenshots and a long conversation:
+
+    python -m benchmarks.spawn_bench --repeat 500 --ballast-mb 500
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shlex
+import shutil
+import time
+from typing import Any
+
+from computer_use_demo.tools.forkserver import ForkServer
+from computer_use_demo.tools.run import run
+
+from .common import Timings, percentile, report
+
+WARMUP = 20
+
+
+def spawn_directly(argv: list[str]) -> None:
+    program = shutil.which(argv[0])
+    assert program, f"{argv[0]} not found"
+    pid = os.posix_spawn(program, argv, os.environ)
+    os.waitpid(pid, 0)
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict[str, Any]:
+    ballast = bytearray(args.ballast_mb * 1024 * 1024)
+    for i in range(0, len(ballast), 4096):
+        ballast[i] = 1  # touch every page, so it's resident
+    argv = shlex.split(args.command)
+    server = ForkServer()
+    server.start()
+    timings = Timings()
+    variants = {
+        "floor": lambda: asyncio.to_thread(spawn_directly, argv),
+        "shell": lambda: run(args.command),
+        "forkserver": lambda: server.run(argv),
+    }
+    for _ in range(WARMUP):
+        for call in variants.values():
+            await call()
+    # interleaved, so each variant sees the same noise
+    for _ in range(args.repeat):
+        for name, call in variants.items():
+            started = time.perf_counter()
+            await call()
+            timings.add(name, time.perf_counter() - started)
+    server.close()
+    floor = percentile(timings.samples["floor"], 50)
+    return report(
+        "spawn",
+        {
+            "command": args.command,
+            "ballast_mb": args.ballast_mb,
+            "spawn": timings.summary(),
+            "overhead_p50_ms": {
+                name: round((percentile(timings.samples[name], 50) - floor) * 1000, 3)
+                for name in ("shell", "forkserver")
+            },
+        },
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--command", default="true")
+    parser.add_argument("--repeat", type=int, default=500)
+    parser.add_argument("--ballast-mb", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run_benchmark(args)), indent=2))  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""
+Run a file of tasks headlessly, several at a time.
+
+Tasks are JSON lines with a prompt and optional per-task limits:
+
+    {"id": "firefox-1", "prompt": "Open Firefox", "max_seconds": 300, "max_tokens": 100000}
+
+Each of the `--workers` workers runs one task at a time with its own tools, so tasks
+don't share a bash shell. With `--displays`, each worker also gets its own virtual
+display from a `DisplayPool`, which is reset between tasks. Otherwise the computer
+tool uses the shared DISPLAY_NUM.
+
+A task ends when the model stops calling tools, or when it exceeds its wall-clock or
+token budget. Token usage counts input, output and cache tokens over all API calls.
+Results are appended to `--output` as JSON lines as tasks finish:
+
+    {"id": "firefox-1", "status": "completed", "seconds": 41.2, "api_calls": 6,
+     "tool_calls": 5, "usage": {"input_tokens": ..., ...}, "final_text": "..."}
+
+`status` is one of ``completed``, ``timeout``, ``token_budget`` and ``error``. A
+summary with tasks per hour is printed at the end, so pointing `--base-url` at the
+replay server in `computer_use_demo.replay` measures runner throughput:
+
+    python -m computer_use_demo.batch tasks.jsonl --workers 8 --output results.jsonl
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from contextlib import AsyncExitStack
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+import httpx
+
+from .displays import DisplayPool
+from .loop import PROVIDER_TO_DEFAULT_MODEL_NAME, APIProvider, sampling_loop
+from .tools import (
+    BashTool,
+    ComputerTool,
+    EditTool,
+    SearchTool,
+    ToolCollection,
+    ToolResult,
+)
+
+DEFAULT_MAX_SECONDS = 15 * 60.0
+DEFAULT_MAX_TOKENS = 1_000_000
+USAGE_FIELDS = (
+    "input_tokens",
+    "output_tokens",
+    "cache_creation_input_tokens",
+    "cache_read_input_tokens",
+)
+
+
+@dataclass
+class Task:
+    id: str
+    prompt: str
+    max_seconds: float = DEFAULT_MAX_SECONDS
+    max_tokens: int = DEFAULT_MAX_TOKENS
+
+
+@dataclass
+class TaskResult:
+    id: str
+    status: str = "completed"
+    error: str | None = None
+    seconds: float = 0.0
+    api_calls: int = 0
+    tool_calls: int = 0
+    usage: dict[str, int] = field(
+        default_factory=lambda: dict.fromkeys(USAGE_FIELDS, 0)
+    )
+    final_text: str = ""
+
+    @property
+    def tokens(self) -> int:
+        return sum(self.usage.values())
+
+
+def read_tasks(
+    path: Path,
+    max_seconds: float = DEFAULT_MAX_SECONDS,
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+) -> list[Task]:
+    """Parse a JSONL task file. Tasks without an id are numbered by line."""
+    tasks = []
+    with path.open() as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            data = json.loads(line)
+            tasks.append(
+                Task(
+                    id=str(data.get("id", number)),
+                    prompt=data["prompt"],
+                    max_seconds=data.get("max_seconds", max_seconds),
+                    max_tokens=data.get("max_tokens", max_tokens),
+                )
+            )
+    return tasks
+
+
+class BatchRunner:
+    """Runs tasks on `workers` concurrent workers and writes their results."""
+
+    def __init__(
+        self,
+        *,
+        model: str,
+        provider: APIProvider,
+        api_key: str,
+        output: Path,
+        workers: int = 4,
+        base_url: str | None = None,
+        display_pool: DisplayPool | None = None,
+        system_prompt_suffix: str = "",
+        only_n_most_recent_images: int | None = 3,
+    ):
+        self.model = model
+        self.provider = provider
+        self.api_key = api_key
+        self.output = output
+        self.workers = workers
+        self.base_url = base_url
+        self.display_pool = display_pool
+        self.system_prompt_suffix = system_prompt_suffix
+        self.only_n_most_recent_images = only_n_most_recent_images
+        self.results: list[TaskResult] = []
+
+    async def run(self, tasks: list[Task]) -> dict[str, Any]:
+        """Run every task and return a summary."""
+        queue: asyncio.Queue[Task] = asyncio.Queue()
+        for task in tasks:
+            queue.put_nowait(task)
+        started = time.perf_counter()
+        with self.output.open("a") as output:
+            # if a worker fails, the others are cancelled and awaited before the
+            # output closes
+            async with asyncio.TaskGroup() as workers:
+                for _ in range(min(self.workers, len(tasks))):
+                    workers.create_task(self._work(queue, output))
+        return self.summary(time.perf_counter() - started)
+
+    async def _work(self, queue: asyncio.Queue[Task], output) -> None:
+        while not queue.empty():
+            task = queue.get_nowait()
+            try:
+                result = await self._run_with_tools(task)
+            except Exception as e:
+                # e.g. no display could be leased; the other tasks still run
+                result = TaskResult(task.id, "error", f"{type(e).__name__}: {e}")
+            self.results.append(result)
+            output.write(json.dumps(asdict(result)) + "\n")
+            output.flush()
+
+    async def _run_with_tools(self, task: Task) -> TaskResult:
+        """Run `task` with tools of its own, which are closed when it's done."""
+        async with AsyncExitStack() as stack:
+            if self.display_pool:
+                display = await stack.enter_async_context(self.display_pool.lease())
+                tools = display.tool_collection()
+            else:
+                tools = ToolCollection(
+                    ComputerTool(), BashTool(), EditTool(), SearchTool()
+                )
+            # closed before the display is released
+            await stack.enter_async_context(tools)
+            return await self.run_task(task, tools)
+
+    async def run_task(self, task: Task, tools: ToolCollection) -> TaskResult:
+        result = TaskResult(task.id)
+        turn = asyncio.current_task()
+        assert turn
+
+        def on_output(block: Any) -> None:
+            if isinstance(block, dict) and block.get("type") == "text":
+                result.final_text = block["text"]
+
+        def on_tool_output(tool_result: ToolResult, tool_id: str) -> None:
+            result.tool_calls += 1
+
+        def on_api_response(
+            request: httpx.Request, response: Any, error: Exception | None
+        ) -> None:
+            result.api_calls += 1
+            if error:
+                result.status, result.error = "error", str(error)
+                return
+            # without an error, `response` is the HTTP response of a message
+            usage = response.json().get("usage") or {}
+            for name in USAGE_FIELDS:
+                result.usage[name] += usage.get(name) or 0
+            if result.tokens > task.max_tokens and result.status == "completed":
+                result.status = "token_budget"
+                turn.cancel()
+
+        started = time.perf_counter()
+        try:
+            async with asyncio.timeout(task.max_seconds):
+                await sampling_loop(
+                    model=self.model,
+                    provider=self.provider,
+                    system_prompt_suffix=self.system_prompt_suffix,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": [{"type": "text", "text": task.prompt}],
+                        }
+                    ],
+                    output_callback=on_output,
+                    tool_output_callback=on_tool_output,
+                    api_response_callback=on_api_response,
+                    api_key=self.api_key,
+                    only_n_most_recent_images=self.only_n_most_recent_images,
+                    base_url=self.base_url,
+                    tool_collection=tools,
+                )
+        except TimeoutError:
+            result.status = "timeout"
+        except asyncio.CancelledError:
+            if result.status != "token_budget":
+                raise
+            # the budget check cancelled the loop; this task is done, not the runner
+            turn.uncancel()
+        except Exception as e:
+            result.status, result.error = "error", f"{type(e).__name__}: {e}"
+        result.seconds = round(time.perf_counter() - started, 3)
+        return result
+
+    def summary(self, elapsed: float) -> dict[str, Any]:
+        statuses: dict[str, int] = {}
+        for result in self.results:
+            statuses[result.status] = statuses.get(result.status, 0) + 1
+        completed = statuses.get("completed", 0)
+        return {
+            "tasks": len(self.results),
+            "statuses": statuses,
+            "seconds": round(elapsed, 3),
+            "tasks_per_hour": round(completed * 3600 / elapsed, 1) if elapsed else 0.0,
+            "tokens": sum(result.tokens for result in self.results),
+        }
+
+
+async def run_batch(args: argparse.Namespace) -> dict[str, Any]:
+    tasks = read_tasks(args.tasks, args.max_seconds, args.max_tokens)
+    display_pool = None
+    if args.displays:
+        display_pool = DisplayPool(
+            args.workers,
+            int(os.getenv("WIDTH") or 1024),
+            int(os.getenv("HEIGHT") or 768),
+        )
+        await display_pool.start()
+    provider = APIProvider(args.provider)
+    runner = BatchRunner(
+        model=args.model or PROVIDER_TO_DEFAULT_MODEL_NAME[provider],
+        provider=provider,
+        api_key=args.api_key or os.getenv("ANTHROPIC_API_KEY", ""),
+        output=args.output,
+        workers=args.workers,
+        base_url=args.base_url,
+        display_pool=display_pool,
+    )
+    try:
+        return await runner.run(tasks)
+    finally:
+        if display_pool:
+            await display_pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL file of tasks headlessly")
+    parser.add_argument("tasks", type=Path, help="JSONL file with one task per line")
+    parser.add_argument("--output", type=Path, default=Path("results.jsonl"))
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--displays",
+        action="store_true",
+        help="Give each worker its own Xvfb display (needs Xvfb)",
+    )
+    parser.add_argument(
+        "--max-seconds",
+        type=float,
+        default=DEFAULT_MAX_SECONDS,
+        help="Default wall-clock budget per task",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=DEFAULT_MAX_TOKENS,
+        help="Default token budget per task, over all API calls",
+    )
+    parser.add_argument("--api-key", help="Anthropic API key")
+    parser.add_argument(
+        "--provider", default="anthropic", choices=[p.value for p in APIProvider]
+    )
+    parser.add_argument("--model", help="Model to use (defaults to provider's default)")
+    parser.add_argument(
+        "--base-url", help="Messages API base URL, e.g. a replay server"
+    )
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(run_batch(args)), indent=2))  # noqa: T201
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+A pool of isolated virtual displays, so one container can serve many sessions.
+
+Each display runs Xvfb plus the window manager and panel that `image/start_all.sh`
+starts for the main display. The pool starts them up front, health-checks a display
+before leasing it, and after release tears the stack down and starts a fresh one in
+the background, so the next session never sees the previous session's windows.
+
+    pool = DisplayPool(size=4, width=1024, height=768)
+    await pool.start()
+    async with pool.lease() as display:
+        tools = display.tool_collection()
+"""
+
+import asyncio
+import os
+import shutil
+import subprocess
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from . import metrics
+from .tools import BashTool, ComputerTool, EditTool, SearchTool, ToolCollection
+
+DPI = 96
+FIRST_DISPLAY_NUM = 10
+READY_TIMEOUT = 10.0  # seconds
+RESTART_RETRY_DELAY = 5.0  # seconds
+TINT2_CONFIG = Path("~/.config/tint2/tint2rc").expanduser()
+
+
+@dataclass
+class Display:
+    """A running Xvfb server and the processes drawing on it."""
+
+    display_num: int
+    width: int
+    height: int
+    processes: list[asyncio.subprocess.Process] = field(default_factory=list)
+
+    @property
+    def env(self) -> dict[str, str]:
+        return {
+            "DISPLAY": f":{self.display_num}",
+            "DISPLAY_NUM": str(self.display_num),
+            "WIDTH": str(self.width),
+            "HEIGHT": str(self.height),
+        }
+
+    def tool_collection(self) -> ToolCollection:
+        """The computer use tools, pointed at this display."""
+        return ToolCollection(
+            ComputerTool(
+                display_num=self.display_num, width=self.width, height=self.height
+            ),
+            BashTool(env=self.env),
+            EditTool(),
+            SearchTool(),
+        )
+
+    async def stop(self) -> None:
+        for process in reversed(self.processes):
+            if process.returncode is None:
+                process.terminate()
+                await process.wait()
+        self.processes.clear()
+
+
+async def _spawn(*command: str, env: dict[str, str]) -> asyncio.subprocess.Process:
+    return await asyncio.create_subprocess_exec(
+        *command,
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def _succeeds(*command: str, env: dict[str, str]) -> bool:
+    return await (await _spawn(*command, env=env)).wait() == 0
+
+
+async def _wait_until(*command: str, env: dict[str, str]) -> None:
+    """Poll `command` until it exits successfully, like the startup scripts do."""
+    async with asyncio.timeout(READY_TIMEOUT):
+        while True:
+            if await _succeeds(*command, env=env):
+                return
+            await asyncio.sleep(0.1)
+
+
+class DisplayPool:
+    """Leases pre-started displays to sessions and recycles them on release."""
+
+    def __init__(
+        self,
+        size: int,
+        width: int,
+        height: int,
+        *,
+        first_display_num: int = FIRST_DISPLAY_NUM,
+        window_manager: bool = True,
+    ):
+        self.size = size
+        self.width = width
+        self.height = height
+        self.first_display_num = first_display_num
+        self.window_manager = window_manager
+        self._idle: asyncio.Queue[Display] = asyncio.Queue()
+        self._displays: dict[int, Display] = {}
+        self._leased: set[int] = set()
+        self._restarts: set[asyncio.Task] = set()
+
+    def _free_display_nums(self) -> list[int]:
+        free = []
+        display_num = self.first_display_num
+        while len(free) < self.size:
+            if not Path(f"/tmp/.X{display_num}-lock").exists():
+                free.append(display_num)
+            display_num += 1
+        return free
+
+    async def start(self) -> None:
+        """Start every display, concurrently."""
+        displays = await asyncio.gather(
+            *(self._start_display(n) for n in self._free_display_nums())
+        )
+        for display in displays:
+            self._idle.put_nowait(display)
+
+    async def _start_display(self, display_num: int) -> Display:
+        display = Display(display_num, self.width, self.height)
+        self._displays[display_num] = display
+        env = display.env
+        try:
+            display.processes.append(
+                await _spawn(
+                    "Xvfb",
+                    f":{display_num}",
+                    "-ac",
+                    "-screen",
+                    "0",
+                    f"{self.width}x{self.height}x24",
+                    "-retro",
+                    "-dpi",
+                    str(DPI),
+                    "-nolisten",
+                    "tcp",
+                    "-nolisten",
+                    "unix",
+                    env=env,
+                )
+            )
+            await _wait_until("xdpyinfo", env=env)
+            if self.window_manager and shutil.which("mutter"):
+                display.processes.append(
+                    await _spawn(
+                        "mutter",
+                        "--replace",
+                        "--sm-disable",
+                        env={**env, "XDG_SESSION_TYPE": "x11"},
+                    )
+                )
+                await _wait_until("xdotool", "search", "--class", "mutter", env=env)
+            if self.window_manager and shutil.which("tint2") and TINT2_CONFIG.exists():
+                display.processes.append(
+                    await _spawn("tint2", "-c", str(TINT2_CONFIG), env=env)
+                )
+                await _wait_until("xdotool", "search", "--class", "tint2", env=env)
+        except BaseException:
+            await display.stop()
+            raise
+        return display
+
+    async def _healthy(self, display: Display) -> bool:
+        if any(process.returncode is not None for process in display.processes):
+            return False
+        return await _succeeds("xdpyinfo", env=display.env)
+
+    async def acquire(self) -> Display:
+        """Lease an idle, healthy display, waiting for one if all are leased."""
+        while True:
+            display = await self._idle.get()
+            if await self._healthy(display):
+                self._leased.add(display.display_num)
+                metrics.DISPLAYS_LEASED.set(len(self._leased))
+                return display
+            self._recycle(display)
+
+    def release(self, display: Display) -> None:
+        """Return a leased display. It's reset in the background before reuse."""
+        self._leased.discard(display.display_num)
+        metrics.DISPLAYS_LEASED.set(len(self._leased))
+        self._recycle(display)
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncIterator[Display]:
+        display = await self.acquire()
+        try:
+            yield display
+        finally:
+            self.release(display)
+
+    def _recycle(self, display: Display) -> None:
+        task = asyncio.create_task(self._restart(display))
+        self._restarts.add(task)
+        task.add_done_callback(self._restarts.discard)
+
+    async def _restart(self, display: Display) -> None:
+        await display.stop()
+        while True:
+            try:
+                fresh = await self._start_display(display.display_num)
+            except Exception as e:
+                asyncio.get_running_loop().call_exception_handler(
+                    {
+                        "message": f"Display :{display.display_num} failed to "
+                        f"restart, retrying in {RESTART_RETRY_DELAY}s",
+                        "exception": e,
+                    }
+                )
+                await asyncio.sleep(RESTART_RETRY_DELAY)
+            else:
+                self._idle.put_nowait(fresh)
+                return
+
+    async def close(self) -> None:
+        """Stop every display, leased or not."""
+        for task in list(self._restarts):
+            task.cancel()
+        await asyncio.gather(*self._restarts, return_exceptions=True)
+        await asyncio.gather(*(display.stop() for display in self._displays.values()))
+        self._displays.clear()
+        self._leased.clear()
+        metrics.DISPLAYS_LEASED.set(0)
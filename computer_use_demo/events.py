@@ -0,0 +1,221 @@
+"""
+Bounded delivery of sampling loop events to UI callbacks.
+
+`sampling_loop` publishes every callback invocation into an `EventQueue` instead of
+calling the callback inline. A consumer task delivers the events in order and awaits
+callbacks that are coroutine functions, so sync and async subscribers both work and
+a slow one never holds up the API calls or tool execution.
+
+The queue is bounded by the approximate bytes it holds, which screenshots dominate.
+When publishing would exceed the bound, the `overflow` policy decides what gives:
+
+* ``drop_screenshots``: strip the images from queued tool results, oldest first, so a
+  slow client skips intermediate screenshots but still gets every message. Falls back
+  to ``drop_oldest`` if that doesn't free enough space.
+* ``drop_oldest``: discard the oldest queued events.
+* ``block``: make the publisher wait for the consumer to catch up.
+
+Streamed `TextDelta`s are coalesced instead: a delta published while the previous
+delta for the same content block is still queued is appended to it, so a slow
+subscriber gets fewer, larger deltas.
+"""
+
+import asyncio
+import inspect
+from collections import deque
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any, Literal
+
+from . import metrics, tracing
+from .tools import ToolResult
+
+OverflowPolicy = Literal["drop_screenshots", "drop_oldest", "block"]
+
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+EVENT_OVERHEAD_BYTES = 1024
+
+
+@dataclass
+class TextDelta:
+    """
+    A piece of streamed assistant text. `seq` increases with every delta of a
+    sampling loop; a coalesced delta has the `seq` of the last one it contains.
+    """
+
+    block: int
+    text: str
+    seq: int
+
+
+@dataclass
+class Event:
+    """A pending callback invocation."""
+
+    callback: Callable[..., Any]
+    args: tuple[Any, ...]
+    size: int
+
+
+def _event_size(args: tuple[Any, ...]) -> int:
+    size = EVENT_OVERHEAD_BYTES
+    for arg in args:
+        if isinstance(arg, ToolResult):
+            size += sum(
+                len(value)
+                for value in (arg.output, arg.error, arg.base64_image, arg.system)
+                if value
+            )
+        elif isinstance(arg, dict | list | str):
+            size += metrics.estimate_messages_bytes([arg])
+    return size
+
+
+def _strip_screenshot(event: Event) -> bool:
+    """Drop the images from the tool results `event` carries. Returns whether any."""
+    args = tuple(
+        arg.replace(base64_image=None)
+        if isinstance(arg, ToolResult) and arg.base64_image
+        else arg
+        for arg in event.args
+    )
+    if args == event.args:
+        return False
+    event.args = args
+    event.size = _event_size(args)
+    return True
+
+
+class EventQueue:
+    """Delivers callback invocations in order from a background consumer task."""
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        overflow: OverflowPolicy = "drop_screenshots",
+    ):
+        self.max_bytes = max_bytes
+        self.overflow = overflow
+        self._events: deque[Event] = deque()
+        self._bytes = 0
+        self._delivering = False
+        self._closed = False
+        self._changed = asyncio.Condition()
+        self._consumer: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    @property
+    def queued_bytes(self) -> int:
+        return self._bytes
+
+    async def publish(self, callback: Callable[..., Any], *args: Any) -> None:
+        """
+        Queue a call of `callback(*args)`. Only waits when the queue is full and the
+        overflow policy is ``block``.
+        """
+        if self._closed:
+            raise RuntimeError("EventQueue is closed")
+        if self._consumer is None:
+            self._consumer = asyncio.create_task(self._consume())
+        event = Event(callback, args, _event_size(args))
+        async with self._changed:
+            if self._coalesce(event):
+                return
+            if self.overflow == "block":
+                await self._changed.wait_for(
+                    lambda: not self._events
+                    or self._bytes + event.size <= self.max_bytes
+                )
+            else:
+                self._make_room(event.size)
+            self._events.append(event)
+            self._bytes += event.size
+            self._changed.notify_all()
+
+    def _coalesce(self, event: Event) -> bool:
+        """Merge a text delta into the queued delta it continues, if there is one."""
+        if not self._events or len(event.args) != 1:
+            return False
+        last = self._events[-1]
+        delta, queued = event.args[0], last.args[0] if len(last.args) == 1 else None
+        if not (
+            isinstance(delta, TextDelta)
+            and isinstance(queued, TextDelta)
+            and last.callback == event.callback
+            and queued.block == delta.block
+        ):
+            return False
+        last.args = (TextDelta(delta.block, queued.text + delta.text, delta.seq),)
+        self._bytes += len(delta.text)
+        last.size += len(delta.text)
+        return True
+
+    def _make_room(self, size: int) -> None:
+        if self.overflow == "drop_screenshots":
+            for queued in self._events:
+                if self._bytes + size <= self.max_bytes:
+                    return
+                before = queued.size
+                if _strip_screenshot(queued):
+                    self._bytes -= before - queued.size
+                    metrics.EVENTS_DROPPED.inc(dropped="screenshot")
+        while self._events and self._bytes + size > self.max_bytes:
+            self._bytes -= self._events.popleft().size
+            metrics.EVENTS_DROPPED.inc(dropped="event")
+
+    async def join(self) -> None:
+        """Wait until every published event has been delivered."""
+        async with self._changed:
+            await self._changed.wait_for(
+                lambda: not self._events and not self._delivering
+            )
+
+    async def aclose(self, drain: bool = True) -> None:
+        """Stop accepting events, delivering the queued ones first if `drain`."""
+        self._closed = True
+        if self._consumer is None:
+            return
+        try:
+            if drain:
+                await self.join()
+        finally:
+            # also when cancelled while draining, e.g. by one of the callbacks
+            self._consumer.cancel()
+            await asyncio.gather(self._consumer, return_exceptions=True)
+
+    async def __aenter__(self) -> "EventQueue":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        # a cancelled or failed turn has no reason to wait for a slow subscriber
+        await self.aclose(drain=exc_type is None)
+
+    async def _consume(self) -> None:
+        while True:
+            async with self._changed:
+                await self._changed.wait_for(lambda: bool(self._events))
+                event = self._events.popleft()
+                self._bytes -= event.size
+                self._delivering = True
+                self._changed.notify_all()
+            try:
+                name = getattr(
+                    event.callback, "__name__", type(event.callback).__name__
+                )
+                with tracing.span("event.deliver", callback=name):
+                    result = event.callback(*event.args)
+                    if inspect.isawaitable(result):
+                        await result
+            except Exception as e:
+                asyncio.get_running_loop().call_exception_handler(
+                    {
+                        "message": f"Event callback {event.callback!r} failed",
+                        "exception": e,
+                    }
+                )
+            finally:
+                async with self._changed:
+                    self._delivering = False
+                    self._changed.notify_all()
@@ -0,0 +1,489 @@
+"""
+Run the computer use tools in a separate executor daemon.
+
+`ExecutorServer` exposes `ComputerTool`, `BashTool`, `EditTool` and `SearchTool` on a
+TCP socket.
+`RemoteToolCollection` is a drop-in `ToolCollection` for `sampling_loop` that calls
+them there. One agent process can then drive tools on many machines, each of which
+only runs the daemon:
+
+    EXECUTOR_TOKEN=<secret> python -m computer_use_demo.executor --host 10.0.0.5
+
+The tools can run any command, so a connection's first frame must carry that shared
+token, which the client reads from `EXECUTOR_TOKEN` too. The daemon refuses to
+listen beyond loopback without one, and the protocol isn't encrypted, so across
+untrusted networks reach a loopback daemon through an SSH tunnel instead.
+
+Every frame is a JSON header plus an optional binary payload, each preceded by its
+length. Screenshots travel as raw PNG bytes in the payload rather than as base64 in
+the JSON, which makes them a third smaller on the wire.
+
+    request:  {"id": 1, "op": "run", "session": "s1", "tool": "bash", "input": {...}}
+    response: {"id": 1, "result": {"type": "CLIResult", "output": "..."}}, PNG bytes
+
+Requests carry ids, so a connection can have many requests in flight and
+responses come back as they finish. Each executor session has its own tools, and
+hence its own bash shell. Calls within a session run one at a time, and different
+sessions run concurrently. `ExecutorClient` keeps a small pool of connections
+that all sessions share. A session that was never closed is closed once
+`session_grace` seconds pass with no connection left that used it.
+"""
+
+import argparse
+import asyncio
+import base64
+import hmac
+import ipaddress
+import itertools
+import json
+import os
+import struct
+from collections.abc import Callable
+from typing import Any
+
+from anthropic.types.beta import BetaToolUnionParam
+
+from .tools import (
+    BashTool,
+    CLIResult,
+    ComputerTool,
+    EditTool,
+    SearchTool,
+    ToolCollection,
+    ToolResult,
+)
+from .tools.base import ToolFailure
+
+DEFAULT_PORT = 8766
+DEFAULT_SESSION_GRACE = 60.0  # seconds
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+FRAME_HEADER = struct.Struct("!II")  # JSON header length, payload length
+RESULT_TYPES: dict[str, type[ToolResult]] = {
+    cls.__name__: cls for cls in (ToolResult, CLIResult, ToolFailure)
+}
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple[dict[str, Any], bytes]:
+    header_len, payload_len = FRAME_HEADER.unpack(
+        await reader.readexactly(FRAME_HEADER.size)
+    )
+    if header_len + payload_len > MAX_FRAME_BYTES:
+        raise ValueError(f"Frame of {header_len + payload_len} bytes is too large")
+    header = json.loads(await reader.readexactly(header_len))
+    payload = await reader.readexactly(payload_len) if payload_len else b""
+    return header, payload
+
+
+def encode_frame(header: dict[str, Any], payload: bytes = b"") -> bytes:
+    encoded = json.dumps(header).encode()
+    return FRAME_HEADER.pack(len(encoded), len(payload)) + encoded + payload
+
+
+def decode_frame(data: bytes) -> tuple[dict[str, Any], bytes]:
+    header_len, payload_len = FRAME_HEADER.unpack_from(data)
+    start = FRAME_HEADER.size
+    header = json.loads(data[start : start + header_len])
+    return header, data[start + header_len : start + header_len + payload_len]
+
+
+def encode_result(result: ToolResult) -> tuple[dict[str, Any], bytes]:
+    """Split a result into its JSON fields and its decoded screenshot."""
+    fields = {
+        "type": type(result).__name__,
+        "output": result.output,
+        "error": result.error,
+        "system": result.system,
+    }
+    payload = base64.b64decode(result.base64_image) if result.base64_image else b""
+    return fields, payload
+
+
+def decode_result(fields: dict[str, Any], payload: bytes) -> ToolResult:
+    cls = RESULT_TYPES.get(fields.get("type", ""), ToolResult)
+    return cls(
+        output=fields.get("output"),
+        error=fields.get("error"),
+        system=fields.get("system"),
+        base64_image=base64.b64encode(payload).decode() if payload else None,
+    )
+
+
+def check_request(request: Any) -> None:
+    """Raise ValueError unless `request` has the fields its op needs."""
+    if not isinstance(request, dict):
+        raise ValueError("A request must be a JSON object")
+    if not isinstance(request.get("id"), int):
+        raise ValueError("A request needs an integer id")
+    if request.get("op") == "cancel":
+        return
+    if not isinstance(request.get("session"), str):
+        raise ValueError("A request needs a session")
+    if request.get("op") == "run" and not (
+        isinstance(request.get("tool"), str) and isinstance(request.get("input"), dict)
+    ):
+        raise ValueError("A run request needs a tool and its input")
+
+
+def default_tools() -> ToolCollection:
+    return ToolCollection(ComputerTool(), BashTool(), EditTool(), SearchTool())
+
+
+def is_loopback(host: str) -> bool:
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class ExecutorServer:
+    """
+    Serves tool calls to `ExecutorClient`s. With a `token`, connections that don't
+    start by presenting it are refused.
+    """
+
+    def __init__(
+        self,
+        tool_factory: Callable[[], ToolCollection] = default_tools,
+        token: str | None = None,
+        session_grace: float = DEFAULT_SESSION_GRACE,
+    ):
+        self.tool_factory = tool_factory
+        self.token = token
+        self.session_grace = session_grace
+        self._sessions: dict[str, ToolCollection] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+        # the connections that have used each session, and the expiry of those
+        # no connection is using any more
+        self._users: dict[str, set[asyncio.StreamWriter]] = {}
+        self._expiry: dict[str, asyncio.TimerHandle] = {}
+        self._closing: set[asyncio.Task] = set()
+        self._server: asyncio.Server | None = None
+
+    @property
+    def port(self) -> int:
+        assert self._server
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self._server = await asyncio.start_server(
+            self._handle_connection, host, port, limit=MAX_FRAME_BYTES
+        )
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        for session_id in list(self._sessions):
+            self._close_session(session_id)
+        await asyncio.gather(*self._closing, return_exceptions=True)
+
+    def _tools(self, session_id: str) -> ToolCollection:
+        if session_id not in self._sessions:
+            self._sessions[session_id] = self.tool_factory()
+            self._locks[session_id] = asyncio.Lock()
+        return self._sessions[session_id]
+
+    def _close_session(self, session_id: str) -> None:
+        self._locks.pop(session_id, None)
+        self._users.pop(session_id, None)
+        if expiry := self._expiry.pop(session_id, None):
+            expiry.cancel()
+        if tools := self._sessions.pop(session_id, None):
+            task = asyncio.create_task(tools.close())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    def _use(self, session_id: str, writer: asyncio.StreamWriter) -> None:
+        self._users.setdefault(session_id, set()).add(writer)
+        if expiry := self._expiry.pop(session_id, None):
+            expiry.cancel()
+
+    def _release(self, session_id: str, writer: asyncio.StreamWriter) -> None:
+        users = self._users.get(session_id)
+        if users is None:
+            return
+        users.discard(writer)
+        if not users and session_id not in self._expiry:
+            self._expiry[session_id] = asyncio.get_running_loop().call_later(
+                self.session_grace, self._close_session, session_id
+            )
+
+    async def _authenticate(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> bool:
+        if self.token is None:
+            return True
+        try:
+            request, _ = await read_frame(reader)
+        except asyncio.IncompleteReadError:
+            return False
+        response: dict[str, Any] = {"id": request.get("id"), "result": {}}
+        token = request.get("token")
+        if request.get("op") != "auth" or not isinstance(token, str):
+            response["unauthorized"] = "The executor requires a token"
+        elif not hmac.compare_digest(token.encode(), self.token.encode()):
+            response["unauthorized"] = "Invalid executor token"
+        writer.write(encode_frame(response))
+        await writer.drain()
+        return "unauthorized" not in response
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        in_flight: dict[int, asyncio.Task] = {}
+        used: set[str] = set()
+        try:
+            if not await self._authenticate(reader, writer):
+                return
+            while True:
+                try:
+                    request, _ = await read_frame(reader)
+                except asyncio.IncompleteReadError:
+                    break
+                try:
+                    check_request(request)
+                except ValueError as e:
+                    # answered like a failed op, so the connection stays usable
+                    request_id = (
+                        request.get("id") if isinstance(request, dict) else None
+                    )
+                    response = {"id": request_id, "error": f"{type(e).__name__}: {e}"}
+                    writer.write(encode_frame(response))
+                    await writer.drain()
+                    continue
+                if request["op"] == "cancel":
+                    if task := in_flight.get(request["id"]):
+                        task.cancel()
+                    continue
+                if request["op"] != "close":
+                    used.add(request["session"])
+                    self._use(request["session"], writer)
+                task = asyncio.create_task(self._respond(request, writer))
+                in_flight[request["id"]] = task
+                task.add_done_callback(
+                    lambda _, request_id=request["id"]: in_flight.pop(request_id, None)
+                )
+        finally:
+            for task in in_flight.values():
+                task.cancel()
+            for session_id in used:
+                self._release(session_id, writer)
+            writer.close()
+
+    async def _respond(
+        self, request: dict[str, Any], writer: asyncio.StreamWriter
+    ) -> None:
+        response: dict[str, Any] = {"id": request["id"]}
+        payload = b""
+        try:
+            response["result"], payload = await self._dispatch(request)
+        except asyncio.CancelledError:
+            response["result"], payload = encode_result(
+                ToolFailure(error="Tool call was cancelled")
+            )
+        except Exception as e:
+            response["error"] = f"{type(e).__name__}: {e}"
+        if not writer.is_closing():
+            writer.write(encode_frame(response, payload))
+            await writer.drain()
+
+    async def _dispatch(self, request: dict[str, Any]) -> tuple[dict[str, Any], bytes]:
+        op, session_id = request["op"], request["session"]
+        if op == "describe":
+            return {"tools": self._tools(session_id).to_params()}, b""
+        if op == "close":
+            self._close_session(session_id)
+            return {}, b""
+        if op == "run":
+            tools = self._tools(session_id)
+            async with self._locks[session_id]:
+                result = await tools.run(
+                    name=request["tool"], tool_input=request["input"]
+                )
+            return encode_result(result)
+        raise ValueError(f"Unknown op {op}")
+
+
+class _Connection:
+    """A client connection that matches pipelined responses to their requests."""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.pending: dict[int, asyncio.Future[tuple[dict[str, Any], bytes]]] = {}
+        self._reader_task = asyncio.create_task(self._read(reader))
+
+    @property
+    def closed(self) -> bool:
+        return self._reader_task.done()
+
+    async def _read(self, reader: asyncio.StreamReader) -> None:
+        error = ConnectionError("Executor connection closed")
+        try:
+            while True:
+                response, payload = await read_frame(reader)
+                if future := self.pending.pop(response["id"], None):
+                    if not future.done():
+                        future.set_result((response, payload))
+        except Exception as e:
+            error = ConnectionError(f"Executor connection lost: {e!r}")
+        finally:
+            # whatever stopped the reader, nothing will answer these any more
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.pending.clear()
+            self.writer.close()
+
+    async def request(
+        self, request_id: int, header: dict[str, Any]
+    ) -> tuple[dict[str, Any], bytes]:
+        if self.closed:
+            raise ConnectionError("Executor connection closed")
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write(encode_frame({"id": request_id, **header}))
+        try:
+            await self.writer.drain()
+            return await future
+        except asyncio.CancelledError:
+            self.pending.pop(request_id, None)
+            if not self.writer.is_closing():
+                self.writer.write(encode_frame({"id": request_id, "op": "cancel"}))
+            raise
+
+    async def close(self) -> None:
+        self.writer.close()
+        self._reader_task.cancel()
+        await asyncio.gather(self._reader_task, return_exceptions=True)
+
+
+class ExecutorClient:
+    """
+    A pool of up to `max_connections` pipelined connections to one executor, which
+    present `token`, `EXECUTOR_TOKEN` by default.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = DEFAULT_PORT,
+        max_connections: int = 4,
+        token: str | None = None,
+    ):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self.token = token if token is not None else os.getenv("EXECUTOR_TOKEN")
+        self._connections: list[_Connection] = []
+        self._ids = itertools.count(1)
+        self._connecting = asyncio.Lock()
+
+    async def _connection(self) -> _Connection:
+        """An idle connection, a new one, or failing those the least busy one."""
+        async with self._connecting:
+            self._connections = [c for c in self._connections if not c.closed]
+            idle = [c for c in self._connections if not c.pending]
+            if idle or len(self._connections) >= self.max_connections:
+                return min(idle or self._connections, key=lambda c: len(c.pending))
+            reader, writer = await asyncio.open_connection(
+                self.host, self.port, limit=MAX_FRAME_BYTES
+            )
+            connection = _Connection(reader, writer)
+            if self.token is not None:
+                response, _ = await connection.request(
+                    next(self._ids), {"op": "auth", "token": self.token}
+                )
+                await self._check_authorized(connection, response)
+            self._connections.append(connection)
+            return connection
+
+    async def request(self, header: dict[str, Any]) -> tuple[dict[str, Any], bytes]:
+        connection = await self._connection()
+        response, payload = await connection.request(next(self._ids), header)
+        await self._check_authorized(connection, response)
+        if "error" in response:
+            raise RuntimeError(response["error"])
+        return response["result"], payload
+
+    @staticmethod
+    async def _check_authorized(
+        connection: _Connection, response: dict[str, Any]
+    ) -> None:
+        if "unauthorized" in response:
+            await connection.close()
+            raise PermissionError(response["unauthorized"])
+
+    async def close(self) -> None:
+        await asyncio.gather(*(c.close() for c in self._connections))
+        self._connections.clear()
+
+
+class RemoteToolCollection(ToolCollection):
+    """A `ToolCollection` whose tools run in an executor daemon."""
+
+    def __init__(
+        self, client: ExecutorClient, session_id: str, params: list[BetaToolUnionParam]
+    ):
+        super().__init__()
+        self.client = client
+        self.session_id = session_id
+        self.params = params
+
+    @classmethod
+    async def connect(
+        cls, client: ExecutorClient, session_id: str
+    ) -> "RemoteToolCollection":
+        """Open `session_id` on the executor and fetch its tool definitions."""
+        result, _ = await client.request({"op": "describe", "session": session_id})
+        return cls(client, session_id, result["tools"])
+
+    def to_params(self) -> list[BetaToolUnionParam]:
+        return self.params
+
+    async def run(self, *, name: str, tool_input: dict[str, Any]) -> ToolResult:
+        try:
+            result, payload = await self.client.request(
+                {
+                    "op": "run",
+                    "session": self.session_id,
+                    "tool": name,
+                    "input": tool_input,
+                }
+            )
+        except (ConnectionError, OSError) as e:
+            return ToolFailure(error=f"Tool executor is unavailable: {e}")
+        except RuntimeError as e:
+            # the executor answered with an error rather than a result
+            return ToolFailure(error=f"Tool executor failed: {e}")
+        return decode_result(result, payload)
+
+    async def close(self) -> None:
+        """End the session on the executor, stopping its bash shell."""
+        await self.client.request({"op": "close", "session": self.session_id})
+
+
+async def _serve(host: str, port: int, token: str | None) -> None:
+    server = ExecutorServer(token=token)
+    await server.start(host, port)
+    print(f"Tool executor listening on {host}:{server.port}")  # noqa: T201
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the computer use tools")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    token = os.getenv("EXECUTOR_TOKEN") or None
+    if token is None and not is_loopback(args.host):
+        parser.error(f"set EXECUTOR_TOKEN to listen on {args.host}")
+    asyncio.run(_serve(args.host, args.port, token))
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,12 @@
 Agentic sampling loop that calls the Anthropic API and local implementation of anthropic-defined computer use tools.
 """
 
+import asyncio
 import platform
-from collections.abc import Callable
+import threading
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import nullcontext
 from datetime import datetime
 from enum import StrEnum
 from typing import Any, cast
@@ -29,11 +33,23 @@ from anthropic.types.beta import (
     BetaToolUseBlockParam,
 )
 
-from .tools import BashTool, ComputerTool, EditTool, ToolCollection, ToolResult
+from . import metrics, tracing
+from .events import EventQueue, TextDelta
+from .tools import (
+    BashTool,
+    ComputerTool,
+    EditTool,
+    SearchTool,
+    ToolCollection,
+    ToolResult,
+)
 
 COMPUTER_USE_BETA_FLAG = "computer-use-2024-10-22"
 PROMPT_CACHING_BETA_FLAG = "prompt-caching-2024-07-31"
 
+INTERRUPT_TEXT = "(user stopped or interrupted and wrote the following)"
+INTERRUPT_TOOL_ERROR = "human stopped or interrupted tool execution"
+
 
 class APIProvider(StrEnum):
     ANTHROPIC = "anthropic"
@@ -53,14 +69,24 @@ PROVIDER_TO_DEFAULT_MODEL_NAME: dict[APIProvider, str] = {
 # We encourage modifying this system prompt to ensure the model has context for the
 # environment it is running in, and to provide any additional information that may be
 # helpful for the task at hand.
-SYSTEM_PROMPT = f"""<SYSTEM_CAPABILITY>
+def system_prompt(display_num: int | None = None) -> str:
+    """
+    The system prompt for tools on X display `display_num`. Without one, GUI apps
+    rely on the DISPLAY the bash tool inherits.
+    """
+    if display_num is None:
+        gui_apps = 'Using bash tool you can start GUI applications in a subshell, DISPLAY is already set. For example "(xterm &)".'
+    else:
+        gui_apps = f'Using bash tool you can start GUI applications, but you need to set export DISPLAY=:{display_num} and use a subshell. For example "(DISPLAY=:{display_num} xterm &)".'
+    return f"""<SYSTEM_CAPABILITY>
 * You are utilising an Ubuntu virtual machine using {platform.machine()} architecture with internet access.
 * You can feel free to install Ubuntu applications with your bash tool. Use curl instead of wget.
 * To open firefox, please just click on the firefox icon.  Note, firefox-esr is what is installed on your system.
-* Using bash tool you can start GUI applications, but you need to set export DISPLAY=:1 and use a subshell. For example "(DISPLAY=:1 xterm &)". GUI apps run with bash tool will appear within your desktop environment, but they may take some time to appear. Take a screenshot to confirm it did.
+* {gui_apps} GUI apps run with bash tool will appear within your desktop environment, but they may take some time to appear. Take a screenshot to confirm it did.
 * When using your bash tool with commands that are expected to output very large quantities of text, redirect into a tmp file and use str_replace_editor or `grep -n -B <lines before> -A <lines after> <query> <filename>` to confirm output.
 * When viewing a page it can be helpful to zoom out so that you can see everything on the page.  Either that, or make sure you scroll down to see everything before deciding something isn't available.
 * When using your computer function calls, they take a while to run and send back to you.  Where possible/feasible, try to chain multiple of these calls all into one function calls request.
+* To make several edits at once, use the `multi_edit` command of str_replace_editor with `path` and `edits`, a list of edits that are each either `old_str` and `new_str`, as in str_replace, or `insert_line` and `new_str`, as in insert. An edit can have its own `path`. All edits refer to the files as they were before the command, and none is made if any of them is invalid. One undo_edit per file undoes the whole command.
 * The current date is {datetime.today().strftime('%A, %B %-d, %Y')}.
 </SYSTEM_CAPABILITY>
 
@@ -70,112 +96,279 @@ SYSTEM_PROMPT = f"""<SYSTEM_CAPABILITY>
 </IMPORTANT>"""
 
 
+SYSTEM_PROMPT = system_prompt(1)
+
+
+def _display_num(tool_collection: ToolCollection) -> int | None:
+    """The X display the computer tool of `tool_collection` works on, if known."""
+    for params in tool_collection.to_params():
+        if params["name"] == "computer":
+            return cast(dict[str, Any], params).get("display_number")
+    return None
+
+
 async def sampling_loop(
     *,
     model: str,
     provider: APIProvider,
     system_prompt_suffix: str,
     messages: list[BetaMessageParam],
-    output_callback: Callable[[BetaContentBlockParam], None],
-    tool_output_callback: Callable[[ToolResult, str], None],
+    output_callback: Callable[[BetaContentBlockParam], None | Awaitable[None]],
+    tool_output_callback: Callable[[ToolResult, str], None | Awaitable[None]],
     api_response_callback: Callable[
-        [httpx.Request, httpx.Response | object | None, Exception | None], None
+        [httpx.Request, httpx.Response | object | None, Exception | None],
+        None | Awaitable[None],
     ],
     api_key: str,
     only_n_most_recent_images: int | None = None,
     max_tokens: int = 4096,
+    base_url: str | None = None,
+    event_queue: EventQueue | None = None,
+    tool_collection: ToolCollection | None = None,
+    text_delta_callback: Callable[[TextDelta], None | Awaitable[None]] | None = None,
 ):
     """
     Agentic sampling loop for the assistant/tool interaction of computer use.
+
+    `base_url` points any provider at a different Messages API host, such as the
+    record/replay server in `computer_use_demo.replay`.
+
+    The callbacks may be sync or async. They are delivered in order through
+    `event_queue`, see `computer_use_demo.events`. Without one, the loop uses its own
+    and waits for it to drain before returning.
+
+    Pass `tool_collection` to keep tool state such as the bash session across calls,
+    or to point the tools at another display, see `computer_use_demo.displays`. The
+    caller closes it. Without one, the loop makes its own and closes it on return.
+
+    With `text_delta_callback`, responses are streamed and the callback gets the
+    assistant's text as it arrives. `output_callback` still gets every complete block.
     """
-    tool_collection = ToolCollection(
+    own_tools = tool_collection is None
+    tool_collection = tool_collection or ToolCollection(
         ComputerTool(),
         BashTool(),
         EditTool(),
+        SearchTool(),
     )
     system = BetaTextBlockParam(
         type="text",
-        text=f"{SYSTEM_PROMPT}{' ' + system_prompt_suffix if system_prompt_suffix else ''}",
+        text=f"{system_prompt(_display_num(tool_collection))}{' ' + system_prompt_suffix if system_prompt_suffix else ''}",
     )
 
-    while True:
-        enable_prompt_caching = False
-        betas = [COMPUTER_USE_BETA_FLAG]
-        image_truncation_threshold = only_n_most_recent_images or 0
-        if provider == APIProvider.ANTHROPIC:
-            client = Anthropic(api_key=api_key, max_retries=4)
-            enable_prompt_caching = True
-        elif provider == APIProvider.VERTEX:
-            client = AnthropicVertex()
-        elif provider == APIProvider.BEDROCK:
-            client = AnthropicBedrock()
-
-        if enable_prompt_caching:
-            betas.append(PROMPT_CACHING_BETA_FLAG)
-            _inject_prompt_caching(messages)
-            # Because cached reads are 10% of the price, we don't think it's
-            # ever sensible to break the cache by truncating images
-            only_n_most_recent_images = 0
-            system["cache_control"] = {"type": "ephemeral"}
-
-        if only_n_most_recent_images:
-            _maybe_filter_to_n_most_recent_images(
-                messages,
-                only_n_most_recent_images,
-                min_removal_threshold=image_truncation_threshold,
-            )
-
-        # Call the API
-        # we use raw_response to provide debug information to streamlit. Your
-        # implementation may be able call the SDK directly with:
-        # `response = client.messages.create(...)` instead.
-        try:
-            raw_response = client.beta.messages.with_raw_response.create(
-                max_tokens=max_tokens,
-                messages=messages,
-                model=model,
-                system=[system],
-                tools=tool_collection.to_params(),
-                betas=betas,
-            )
-        except (APIStatusError, APIResponseValidationError) as e:
-            api_response_callback(e.request, e.response, e)
-            return messages
-        except APIError as e:
-            api_response_callback(e.request, e.body, e)
-            return messages
-
-        api_response_callback(
-            raw_response.http_response.request, raw_response.http_response, None
-        )
+    delta_seq = 0
 
-        response = raw_response.parse()
+    async def publish_delta(block: int, text: str) -> None:
+        nonlocal delta_seq
+        delta_seq += 1
+        assert text_delta_callback
+        await events.publish(text_delta_callback, TextDelta(block, text, delta_seq))
 
-        response_params = _response_to_params(response)
-        messages.append(
-            {
-                "role": "assistant",
-                "content": response_params,
-            }
-        )
+    with metrics.TURNS_IN_FLIGHT.track_inprogress():
+        async with (
+            tool_collection if own_tools else nullcontext(),
+            nullcontext(event_queue)
+            if event_queue is not None
+            else EventQueue() as events,
+        ):
+            while True:
+                with tracing.span("loop.prepare"):
+                    enable_prompt_caching = False
+                    betas = [COMPUTER_USE_BETA_FLAG]
+                    image_truncation_threshold = only_n_most_recent_images or 0
+                    if provider == APIProvider.ANTHROPIC:
+                        client = Anthropic(
+                            api_key=api_key, max_retries=4, base_url=base_url
+                        )
+                        enable_prompt_caching = True
+                    elif provider == APIProvider.VERTEX:
+                        client = AnthropicVertex(base_url=base_url)
+                    elif provider == APIProvider.BEDROCK:
+                        client = AnthropicBedrock(base_url=base_url)
+
+                    if enable_prompt_caching:
+                        betas.append(PROMPT_CACHING_BETA_FLAG)
+                        _inject_prompt_caching(messages)
+                        # Because cached reads are 10% of the price, we don't think it's
+                        # ever sensible to break the cache by truncating images
+                        only_n_most_recent_images = 0
+                        system["cache_control"] = {"type": "ephemeral"}
+
+                    if only_n_most_recent_images:
+                        _maybe_filter_to_n_most_recent_images(
+                            messages,
+                            only_n_most_recent_images,
+                            min_removal_threshold=image_truncation_threshold,
+                        )
+
+                # Call the API
+                # we use raw_response to provide debug information to streamlit. Your
+                # implementation may be able call the SDK directly with:
+                # `response = client.messages.create(...)` instead.
+                try:
+                    with (
+                        tracing.span("loop.api_call", model=model, provider=provider),
+                        metrics.API_CALL_SECONDS.time(provider=provider),
+                    ):
+                        params = dict(
+                            max_tokens=max_tokens,
+                            messages=messages,
+                            model=model,
+                            system=[system],
+                            tools=tool_collection.to_params(),
+                            betas=betas,
+                        )
+                        if text_delta_callback:
+                            http_response, response = await _stream_response(
+                                client, params, publish_delta, provider
+                            )
+                        else:
+                            # the clients are synchronous, so call them off the event
+                            # loop to keep other sessions running and this one
+                            # cancellable
+                            raw_response = await asyncio.to_thread(
+                                client.beta.messages.with_raw_response.create,
+                                **params,
+                            )
+                            http_response = raw_response.http_response
+                except (APIStatusError, APIResponseValidationError) as e:
+                    metrics.API_ERRORS.inc(provider=provider, error=type(e).__name__)
+                    await events.publish(
+                        api_response_callback, e.request, e.response, e
+                    )
+                    return messages
+                except APIError as e:
+                    metrics.API_ERRORS.inc(provider=provider, error=type(e).__name__)
+                    await events.publish(api_response_callback, e.request, e.body, e)
+                    return messages
+
+                await events.publish(
+                    api_response_callback, http_response.request, http_response, None
+                )
 
-        tool_result_content: list[BetaToolResultBlockParam] = []
-        for content_block in response_params:
-            output_callback(content_block)
-            if content_block["type"] == "tool_use":
-                result = await tool_collection.run(
-                    name=content_block["name"],
-                    tool_input=cast(dict[str, Any], content_block["input"]),
+                with tracing.span("loop.parse"):
+                    if not text_delta_callback:
+                        response = raw_response.parse()
+                    response_params = _response_to_params(response)
+                messages.append(
+                    {
+                        "role": "assistant",
+                        "content": response_params,
+                    }
                 )
-                tool_result_content.append(
-                    _make_api_tool_result(result, content_block["id"])
+
+                tool_result_content: list[BetaToolResultBlockParam] = []
+                for content_block in response_params:
+                    await events.publish(output_callback, content_block)
+                    if content_block["type"] == "tool_use":
+                        result = await tool_collection.run(
+                            name=content_block["name"],
+                            tool_input=cast(dict[str, Any], content_block["input"]),
+                        )
+                        tool_result_content.append(
+                            _make_api_tool_result(result, content_block["id"])
+                        )
+                        await events.publish(
+                            tool_output_callback, result, content_block["id"]
+                        )
+
+                if not tool_result_content:
+                    return messages
+
+                messages.append({"content": tool_result_content, "role": "user"})
+
+
+async def _stream_response(
+    client: Anthropic | AnthropicVertex | AnthropicBedrock,
+    params: dict[str, Any],
+    publish_delta: Callable[[int, str], Awaitable[None]],
+    provider: APIProvider,
+) -> tuple[httpx.Response, BetaMessage]:
+    """
+    Stream a response in a thread, publishing its text deltas as they arrive.
+    Cancelling closes the stream.
+    """
+    loop = asyncio.get_running_loop()
+    deltas: asyncio.Queue[tuple[int, str] | None] = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def stream() -> tuple[httpx.Response, BetaMessage]:
+        with client.beta.messages.stream(**params) as message_stream:
+            for event in message_stream:
+                if cancelled.is_set():
+                    # nobody is waiting for the result; leaving the block closes the
+                    # connection
+                    raise InterruptedError("stream cancelled")
+                if event.type == "content_block_delta" and event.delta.type == (
+                    "text_delta"
+                ):
+                    loop.call_soon_threadsafe(
+                        deltas.put_nowait, (event.index, event.delta.text)
+                    )
+            return message_stream.response, message_stream.get_final_message()
+
+    started = time.perf_counter()
+    call = asyncio.ensure_future(asyncio.to_thread(stream))
+    call.add_done_callback(lambda _: deltas.put_nowait(None))
+    try:
+        first = True
+        while (delta := await deltas.get()) is not None:
+            if first:
+                metrics.TIME_TO_FIRST_TOKEN_SECONDS.observe(
+                    time.perf_counter() - started, provider=provider
                 )
-                tool_output_callback(result, content_block["id"])
+                first = False
+            await publish_delta(*delta)
+        return await call
+    except asyncio.CancelledError:
+        cancelled.set()
+        call.cancel()
+        raise
 
-        if not tool_result_content:
-            return messages
 
-        messages.append({"content": tool_result_content, "role": "user"})
+def heal_interrupted_messages(messages: list[BetaMessageParam]) -> list[str]:
+    """
+    Make a conversation whose sampling loop was cancelled mid-turn valid to continue.
+    Tool calls left without results are closed with error results, and the model is
+    told that the user interrupted. Returns the ids of the closed tool calls.
+    """
+    if not messages:
+        return []
+    last_message = messages[-1]
+    content = last_message["content"]
+    if last_message["role"] == "user":
+        # cancelled while waiting for the API
+        if isinstance(content, str):
+            content = last_message["content"] = [
+                BetaTextBlockParam(type="text", text=content)
+            ]
+        cast(list, content).append(BetaTextBlockParam(type="text", text=INTERRUPT_TEXT))
+        return []
+
+    tool_use_ids = [
+        block["id"]
+        for block in (content if isinstance(content, list) else [])
+        if isinstance(block, dict) and block["type"] == "tool_use"
+    ]
+    if tool_use_ids:
+        messages.append(
+            {
+                "role": "user",
+                "content": [
+                    *(
+                        BetaToolResultBlockParam(
+                            tool_use_id=tool_use_id,
+                            type="tool_result",
+                            content=INTERRUPT_TOOL_ERROR,
+                            is_error=True,
+                        )
+                        for tool_use_id in tool_use_ids
+                    ),
+                    BetaTextBlockParam(type="text", text=INTERRUPT_TEXT),
+                ],
+            }
+        )
+    return tool_use_ids
 
 
 def _maybe_filter_to_n_most_recent_images(
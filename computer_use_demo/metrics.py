@@ -0,0 +1,338 @@
+"""
+Process-wide metrics in the Prometheus text exposition format.
+
+The sampling loop and tools record into the module-level metrics below, and
+`image/http_server.py` serves `REGISTRY.expose()` on `/metrics`. Only the metric
+types this project needs are implemented, to avoid a client library dependency.
+"""
+
+import asyncio
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from typing import Any, TypeVar
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (16_384, 65_536, 262_144, 524_288, 1_048_576, 2_097_152, 4_194_304)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+LabelValues = tuple[str, ...]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[Any]) -> str:
+    pairs = [
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values, strict=True)
+    ]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict[str, Any]) -> LabelValues:
+        if set(labels) != set(self.label_names):
+            raise ValueError(
+                f"{self.name} expects labels {self.label_names}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def expose(self) -> str:
+        header = (
+            f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        )
+        return header + "".join(f"{line}\n" for line in self.samples())
+
+
+class Counter(_Metric):
+    """A monotonically increasing count."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: dict[LabelValues, float] = {} if self.label_names else {(): 0}
+
+    def inc(self, amount: float = 1, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: Any) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            labels = _format_labels(self.label_names, key)
+            yield f"{self.name}{labels} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    """A value that can go up and down."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels: Any) -> None:
+        self.inc(-amount, **labels)
+
+    def remove(self, **labels: Any) -> None:
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    @contextmanager
+    def track_inprogress(self, **labels: Any) -> Iterator[None]:
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+
+class Histogram(_Metric):
+    """Observations counted into cumulative buckets."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = (*sorted(buckets), float("inf"))
+        self._counts: dict[LabelValues, list[int]] = {}
+        self._sums: dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * len(self.buckets))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    @contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Observe the wall-clock duration of the enclosed block in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def count(self, **labels: Any) -> int:
+        return sum(self._counts.get(self._key(labels), []))
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            series = [
+                (key, list(counts), self._sums[key])
+                for key, counts in self._counts.items()
+            ]
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts, strict=True):
+                cumulative += count
+                labels = _format_labels(
+                    (*self.label_names, "le"), (*key, _format_value(bound))
+                )
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.label_names, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+MetricT = TypeVar("MetricT", bound=_Metric)
+
+
+class Registry:
+    """An ordered collection of metrics exposed together."""
+
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: MetricT) -> MetricT:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def expose(self) -> str:
+        return "".join(metric.expose() for metric in self._metrics.values())
+
+
+REGISTRY = Registry()
+
+ACTIVE_SESSIONS = REGISTRY.register(
+    Gauge("computer_use_active_sessions", "Connected agent sessions.")
+)
+TURNS_IN_FLIGHT = REGISTRY.register(
+    Gauge("computer_use_turns_in_flight", "Sampling loops currently running.")
+)
+API_CALL_SECONDS = REGISTRY.register(
+    Histogram(
+        "computer_use_api_call_seconds",
+        "Latency of Messages API calls.",
+        labels=("provider",),
+    )
+)
+TIME_TO_FIRST_TOKEN_SECONDS = REGISTRY.register(
+    Histogram(
+        "computer_use_time_to_first_token_seconds",
+        "Time from sending a streamed Messages API request to its first text delta.",
+        labels=("provider",),
+    )
+)
+API_ERRORS = REGISTRY.register(
+    Counter(
+        "computer_use_api_errors_total",
+        "Messages API calls that raised, by exception type.",
+        labels=("provider", "error"),
+    )
+)
+TOOL_SECONDS = REGISTRY.register(
+    Histogram(
+        "computer_use_tool_seconds",
+        "Latency of tool executions.",
+        labels=("tool", "action"),
+    )
+)
+STOP_SECONDS = REGISTRY.register(
+    Histogram(
+        "computer_use_stop_seconds",
+        "Time from a stop request until the session's turn has wound down.",
+    )
+)
+SCREENSHOT_BYTES = REGISTRY.register(
+    Histogram(
+        "computer_use_screenshot_bytes",
+        "Size of encoded screenshot PNGs.",
+        buckets=SIZE_BUCKETS,
+    )
+)
+SCREENSHOT_FRAMES = REGISTRY.register(
+    Counter(
+        "computer_use_screenshot_frames_total",
+        "Screenshots sent to websocket clients as thumbnail or full frames, or as "
+        "references to a frame the client already has.",
+        labels=("sent",),
+    )
+)
+EVENT_LOOP_LAG_SECONDS = REGISTRY.register(
+    Histogram(
+        "computer_use_event_loop_lag_seconds",
+        "Delay of a periodic event loop wakeup past its deadline.",
+        buckets=LAG_BUCKETS,
+    )
+)
+EVENTS_DROPPED = REGISTRY.register(
+    Counter(
+        "computer_use_events_dropped_total",
+        "Screenshots or whole events dropped from full callback event queues.",
+        labels=("dropped",),
+    )
+)
+DISPLAYS_LEASED = REGISTRY.register(
+    Gauge("computer_use_displays_leased", "Pooled virtual displays leased to sessions.")
+)
+WORKER_SESSIONS = REGISTRY.register(
+    Gauge(
+        "computer_use_worker_sessions",
+        "Sessions routed to each worker process.",
+        labels=("worker",),
+    )
+)
+WORKER_RESTARTS = REGISTRY.register(
+    Counter("computer_use_worker_restarts_total", "Worker processes restarted.")
+)
+SESSION_RESUMES = REGISTRY.register(
+    Counter(
+        "computer_use_session_resumes_total",
+        "Websocket reconnects that resumed an existing session.",
+    )
+)
+SESSION_EVICTIONS = REGISTRY.register(
+    Counter(
+        "computer_use_session_evictions_total",
+        "Sessions ended by the client or evicted for being idle or least recently used.",
+        labels=("reason",),
+    )
+)
+SESSION_MEMORY_BYTES = REGISTRY.register(
+    Gauge(
+        "computer_use_session_memory_bytes",
+        "Approximate size of a session's conversation history.",
+        labels=("session",),
+    )
+)
+WEBSOCKET_SEND_QUEUE_BYTES = REGISTRY.register(
+    Gauge(
+        "computer_use_websocket_send_queue_bytes",
+        "Bytes buffered for sending on a session's websocket.",
+        labels=("session",),
+    )
+)
+
+FILE_CACHE_LOOKUPS = REGISTRY.register(
+    Counter(
+        "computer_use_file_cache_lookups_total",
+        "Edit tool reads of file text or line indexes, by whether they were cached.",
+        labels=("result",),
+    )
+)
+
+
+def estimate_messages_bytes(messages: list[Any]) -> int:
+    """Approximate the memory held by a conversation from its text and image payloads."""
+    total = 0
+    pending: list[Any] = list(messages)
+    while pending:
+        item = pending.pop()
+        if isinstance(item, str):
+            total += len(item)
+        elif isinstance(item, dict):
+            pending.extend(item.values())
+        elif isinstance(item, list):
+            pending.extend(item)
+    return total
+
+
+async def monitor_event_loop_lag(interval: float = 0.5) -> None:
+    """Observe how late the running event loop wakes up from a fixed sleep, forever."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - started - interval))
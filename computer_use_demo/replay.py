@@ -0,0 +1,542 @@
+"""
+Record/replay stand-in for the Anthropic Messages API.
+
+The server answers the Messages API routes used by all three `APIProvider` paths
+(first-party `/v1/messages`, Bedrock `/model/{model}/invoke[-with-response-stream]`
+and Vertex `...:rawPredict` / `...:streamRawPredict`) from a cassette of recorded
+exchanges, so `sampling_loop` can be driven end to end without network access:
+
+    python -m computer_use_demo.replay --cassette run.jsonl --port 8765
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8765 ./run_terminal.sh
+
+In record mode the server proxies to a real upstream and appends every exchange to
+the cassette. Images are never written to disk: they are reduced to their sha256.
+
+    python -m computer_use_demo.replay --record --upstream https://api.anthropic.com \\
+        --cassette run.jsonl
+"""
+
+import argparse
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import struct
+import threading
+import time
+import zlib
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+import httpx
+from aiohttp import web
+
+DEFAULT_PORT = 8765
+HOP_BY_HOP_HEADERS = {"host", "content-length", "connection", "accept-encoding"}
+
+
+@dataclass(kw_only=True)
+class ReplayConfig:
+    """
+    Knobs for shaping replayed traffic. `latency` overrides the recorded time to
+    first byte, `rate_limit_every` answers every Nth request with a 429.
+    """
+
+    latency: float | None = None  # seconds
+    chunk_delay: float = 0.0  # seconds between streamed events
+    chunk_size: int = 16  # characters per streamed delta
+    rate_limit_every: int = 0
+    retry_after: float = 1.0  # seconds
+
+
+@dataclass(kw_only=True)
+class Exchange:
+    """One recorded request/response pair, keyed by the conversation skeleton."""
+
+    key: str
+    turn: int
+    latency: float
+    status: int
+    response: dict[str, Any]
+    request: list[Any] = field(default_factory=list)
+
+
+def redact_images(value: Any) -> Any:
+    """Return a copy of `value` with base64 image payloads replaced by their sha256."""
+    if isinstance(value, list):
+        return [redact_images(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    if value.get("type") == "image" and isinstance(source := value.get("source"), dict):
+        data = source.get("data", "")
+        return {"type": "image", "sha256": hashlib.sha256(data.encode()).hexdigest()}
+    return {k: redact_images(v) for k, v in value.items() if k != "cache_control"}
+
+
+def request_key(messages: list[dict[str, Any]]) -> str:
+    """
+    Key a request by the shape of its conversation.
+
+    Screenshots and tool outputs differ between runs, so only user text, the
+    assistant blocks (which come from the cassette itself) and the tool_use ids the
+    results answer are hashed.
+    """
+    skeleton = []
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        blocks = []
+        for block in content:
+            block_type = block.get("type")
+            if block_type == "text":
+                blocks.append([block_type, block["text"]])
+            elif block_type == "tool_use":
+                blocks.append([block_type, block["id"], block["name"], block["input"]])
+            elif block_type == "tool_result":
+                blocks.append([block_type, block["tool_use_id"]])
+            else:
+                blocks.append([block_type])
+        skeleton.append([message["role"], blocks])
+    encoded = json.dumps(skeleton, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class Cassette:
+    """An append-only JSONL (optionally gzipped) file of recorded exchanges."""
+
+    def __init__(self, path: Path | str):
+        self.path = Path(path)
+        self.exchanges: dict[str, Exchange] = {}
+        self._lock = threading.Lock()
+        if self.path.exists():
+            with self._open("rt") as f:
+                for line in f:
+                    if line.strip():
+                        exchange = Exchange(**json.loads(line))
+                        self.exchanges[exchange.key] = exchange
+
+    def _open(self, mode: str):
+        if self.path.suffix == ".gz":
+            return gzip.open(self.path, mode)
+        return self.path.open(mode[0])
+
+    def get(self, key: str) -> Exchange | None:
+        return self.exchanges.get(key)
+
+    def add(self, exchange: Exchange) -> None:
+        with self._lock:
+            self.exchanges[exchange.key] = exchange
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self._open("at") as f:
+                f.write(json.dumps(asdict(exchange), separators=(",", ":")) + "\n")
+
+
+def message_events(
+    message: dict[str, Any], chunk_size: int
+) -> Iterator[tuple[str, dict[str, Any]]]:
+    """Yield the Messages API streaming events that reassemble into `message`."""
+    usage = message.get("usage") or {}
+    start = {**message, "content": [], "stop_reason": None, "stop_sequence": None}
+    start["usage"] = {**usage, "output_tokens": min(usage.get("output_tokens", 0), 1)}
+    yield "message_start", {"type": "message_start", "message": start}
+    for index, block in enumerate(message.get("content", [])):
+        if block["type"] == "text":
+            empty_block, delta_type, delta_field = (
+                {"type": "text", "text": ""},
+                "text_delta",
+                "text",
+            )
+            body = block["text"]
+        else:
+            empty_block = {**block, "input": {}}
+            delta_type, delta_field = "input_json_delta", "partial_json"
+            body = json.dumps(block.get("input", {}))
+        yield (
+            "content_block_start",
+            {
+                "type": "content_block_start",
+                "index": index,
+                "content_block": empty_block,
+            },
+        )
+        for offset in range(0, len(body), max(chunk_size, 1)):
+            yield (
+                "content_block_delta",
+                {
+                    "type": "content_block_delta",
+                    "index": index,
+                    "delta": {
+                        "type": delta_type,
+                        delta_field: body[offset : offset + chunk_size],
+                    },
+                },
+            )
+        yield "content_block_stop", {"type": "content_block_stop", "index": index}
+    yield (
+        "message_delta",
+        {
+            "type": "message_delta",
+            "delta": {
+                "stop_reason": message.get("stop_reason"),
+                "stop_sequence": message.get("stop_sequence"),
+            },
+            "usage": {"output_tokens": usage.get("output_tokens", 0)},
+        },
+    )
+    yield "message_stop", {"type": "message_stop"}
+
+
+def assemble_message(events: list[dict[str, Any]]) -> dict[str, Any]:
+    """Rebuild the final message from recorded streaming events."""
+    message: dict[str, Any] = {}
+    partial_json: dict[int, str] = {}
+    for event in events:
+        event_type = event.get("type")
+        if event_type == "message_start":
+            message = event["message"]
+        elif event_type == "content_block_start":
+            message["content"].append(event["content_block"])
+        elif event_type == "content_block_delta":
+            delta = event["delta"]
+            if delta["type"] == "text_delta":
+                message["content"][event["index"]]["text"] += delta["text"]
+            elif delta["type"] == "input_json_delta":
+                partial_json[event["index"]] = (
+                    partial_json.get(event["index"], "") + delta["partial_json"]
+                )
+        elif event_type == "message_delta":
+            message.update(event["delta"])
+            message.setdefault("usage", {}).update(event.get("usage", {}))
+    for index, raw in partial_json.items():
+        message["content"][index]["input"] = json.loads(raw) if raw else {}
+    return message
+
+
+def _sse_frame(event: str, data: dict[str, Any]) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+def _aws_event_frame(data: dict[str, Any]) -> bytes:
+    """Encode one event the way Bedrock's `invoke-with-response-stream` does."""
+    payload = json.dumps(
+        {"bytes": base64.b64encode(json.dumps(data).encode()).decode()}
+    ).encode()
+    headers = b""
+    for name, value in (
+        (":event-type", "chunk"),
+        (":content-type", "application/json"),
+        (":message-type", "event"),
+    ):
+        headers += struct.pack("B", len(name)) + name.encode()
+        headers += struct.pack("!BH", 7, len(value)) + value.encode()
+    total_length = 12 + len(headers) + len(payload) + 4
+    prelude = struct.pack("!II", total_length, len(headers))
+    prelude += struct.pack("!I", zlib.crc32(prelude))
+    message = prelude + headers + payload
+    return message + struct.pack("!I", zlib.crc32(message))
+
+
+def _parse_aws_events(raw: bytes) -> list[dict[str, Any]]:
+    """
+    Decode the events of a Bedrock `invoke-with-response-stream` body, the reverse
+    of `_aws_event_frame`. An exception frame raises ValueError.
+    """
+    events = []
+    offset = 0
+    while offset < len(raw):
+        total_length, headers_length = struct.unpack_from("!II", raw, offset)
+        if total_length < 16 or offset + total_length > len(raw):
+            raise ValueError("Truncated AWS event stream frame")
+        message = raw[offset : offset + total_length - 4]
+        if (
+            zlib.crc32(message)
+            != struct.unpack_from("!I", raw, offset + len(message))[0]
+        ):
+            raise ValueError("Corrupt AWS event stream frame")
+        headers = _parse_aws_headers(message[12 : 12 + headers_length])
+        payload = message[12 + headers_length :]
+        if headers.get(":message-type") != "event":
+            raise ValueError(
+                f"Upstream stream failed: {payload.decode(errors='replace')}"
+            )
+        if headers.get(":event-type") == "chunk":
+            events.append(json.loads(base64.b64decode(json.loads(payload)["bytes"])))
+        offset += total_length
+    return events
+
+
+def _parse_aws_headers(raw: bytes) -> dict[str, Any]:
+    """The string-valued headers of an AWS event stream frame."""
+    # value sizes of the fixed-width header types; 6 (bytes) and 7 (string)
+    # are prefixed with their length
+    fixed_sizes = {0: 0, 1: 0, 2: 1, 3: 2, 4: 4, 5: 8, 8: 8, 9: 16}
+    headers: dict[str, Any] = {}
+    offset = 0
+    while offset < len(raw):
+        name_length = raw[offset]
+        name = raw[offset + 1 : offset + 1 + name_length].decode()
+        value_type = raw[offset + 1 + name_length]
+        offset += 2 + name_length
+        if value_type in (6, 7):
+            (value_length,) = struct.unpack_from("!H", raw, offset)
+            value = raw[offset + 2 : offset + 2 + value_length]
+            if value_type == 7:
+                headers[name] = value.decode()
+            offset += 2 + value_length
+        else:
+            offset += fixed_sizes[value_type]
+    return headers
+
+
+def _parse_sse(raw: bytes) -> list[dict[str, Any]]:
+    events = []
+    for line in raw.decode().splitlines():
+        if line.startswith("data:"):
+            events.append(json.loads(line[len("data:") :].strip()))
+    return events
+
+
+class ReplayServer:
+    """aiohttp application serving (and optionally recording) a `Cassette`."""
+
+    def __init__(
+        self,
+        cassette: Cassette,
+        config: ReplayConfig | None = None,
+        upstream: str | None = None,
+    ):
+        self.cassette = cassette
+        self.config = config or ReplayConfig()
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.request_count = 0
+        self._runner: web.AppRunner | None = None
+        self.port: int | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=1024**3)
+        app.router.add_post("/v1/messages", self.handle_messages)
+        app.router.add_post("/model/{model}/invoke", self.handle_messages)
+        app.router.add_post(
+            "/model/{model}/invoke-with-response-stream", self.handle_messages
+        )
+        app.router.add_post("/{vertex:projects/.*}", self.handle_messages)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle_messages(self, request: web.Request) -> web.StreamResponse:
+        self.request_count += 1
+        every = self.config.rate_limit_every
+        if every and self.request_count % every == 0:
+            return web.json_response(
+                {
+                    "type": "error",
+                    "error": {
+                        "type": "rate_limit_error",
+                        "message": "Replayed rate limit",
+                    },
+                },
+                status=429,
+                headers={
+                    "retry-after": str(max(1, round(self.config.retry_after))),
+                    "retry-after-ms": str(int(self.config.retry_after * 1000)),
+                },
+            )
+
+        raw = await request.read()
+        body = json.loads(raw)
+        key = request_key(body["messages"])
+        stream = body.get("stream", False) or request.path.endswith(
+            ("invoke-with-response-stream", ":streamRawPredict")
+        )
+        if self.upstream:
+            return await self._record(request, raw, body, key, stream)
+
+        exchange = self.cassette.get(key)
+        if exchange is None:
+            return web.json_response(
+                {
+                    "type": "error",
+                    "error": {
+                        "type": "not_found_error",
+                        "message": f"No recorded exchange for request {key}",
+                    },
+                },
+                status=404,
+            )
+        latency = (
+            exchange.latency if self.config.latency is None else self.config.latency
+        )
+        await asyncio.sleep(latency)
+        if exchange.status != 200 or not stream:
+            return web.json_response(exchange.response, status=exchange.status)
+        return await self._stream(request, exchange.response)
+
+    async def _stream(
+        self, request: web.Request, message: dict[str, Any]
+    ) -> web.StreamResponse:
+        bedrock = request.path.startswith("/model/")
+        response = web.StreamResponse(
+            headers={
+                "content-type": "application/vnd.amazon.eventstream"
+                if bedrock
+                else "text/event-stream"
+            }
+        )
+        await response.prepare(request)
+        for event, data in message_events(message, self.config.chunk_size):
+            await response.write(
+                _aws_event_frame(data) if bedrock else _sse_frame(event, data)
+            )
+            if self.config.chunk_delay:
+                await asyncio.sleep(self.config.chunk_delay)
+        await response.write_eof()
+        return response
+
+    async def _record(
+        self,
+        request: web.Request,
+        raw: bytes,
+        body: dict[str, Any],
+        key: str,
+        stream: bool,
+    ) -> web.StreamResponse:
+        assert self.upstream
+        headers = {
+            k: v
+            for k, v in request.headers.items()
+            if k.lower() not in HOP_BY_HOP_HEADERS
+        }
+        started = time.monotonic()
+        async with httpx.AsyncClient(timeout=600) as client:
+            upstream = await client.post(
+                f"{self.upstream}{request.path_qs}", content=raw, headers=headers
+            )
+        latency = time.monotonic() - started
+        content_type = upstream.headers.get("content-type", "")
+        recorded: dict[str, Any] | None = None
+        if upstream.status_code == 200 and stream:
+            # Bedrock streams binary AWS event frames, the others SSE
+            parse = (
+                _parse_aws_events
+                if content_type.startswith("application/vnd.amazon.eventstream")
+                else _parse_sse
+            )
+            try:
+                recorded = assemble_message(parse(upstream.content))
+            except ValueError:
+                # a stream that failed part way isn't worth replaying; the client
+                # still gets it as it was
+                pass
+        else:
+            recorded = upstream.json()
+        if recorded is not None and upstream.status_code != 429:
+            self.cassette.add(
+                Exchange(
+                    key=key,
+                    turn=len(body["messages"]),
+                    latency=round(latency, 4),
+                    status=upstream.status_code,
+                    response=recorded,
+                    request=redact_images(body["messages"][-1:]),
+                )
+            )
+        passthrough = {
+            k: v
+            for k, v in upstream.headers.items()
+            if k.lower()
+            not in HOP_BY_HOP_HEADERS | {"content-encoding", "transfer-encoding"}
+        }
+        return web.Response(
+            body=upstream.content, status=upstream.status_code, headers=passthrough
+        )
+
+
+@contextmanager
+def serve_in_thread(
+    cassette: Cassette, config: ReplayConfig | None = None, upstream: str | None = None
+) -> Iterator[ReplayServer]:
+    """Run a `ReplayServer` on its own event loop thread, for blocking API clients."""
+    server = ReplayServer(cassette, config, upstream)
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+
+    def _run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start())
+        ready.set()
+        loop.run_forever()
+
+    thread = threading.Thread(target=_run, daemon=True)
+    thread.start()
+    ready.wait()
+    try:
+        yield server
+    finally:
+        asyncio.run_coroutine_threadsafe(server.stop(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Messages API record/replay server")
+    parser.add_argument(
+        "--cassette", required=True, help="Cassette file (.jsonl or .jsonl.gz)"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--record", action="store_true", help="Proxy to --upstream and record"
+    )
+    parser.add_argument("--upstream", default="https://api.anthropic.com")
+    parser.add_argument(
+        "--latency", type=float, help="Fixed per-request latency in seconds"
+    )
+    parser.add_argument("--chunk-delay", type=float, default=0.0)
+    parser.add_argument("--chunk-size", type=int, default=16)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    args = parser.parse_args()
+
+    server = ReplayServer(
+        Cassette(args.cassette),
+        ReplayConfig(
+            latency=args.latency,
+            chunk_delay=args.chunk_delay,
+            chunk_size=args.chunk_size,
+            rate_limit_every=args.rate_limit_every,
+            retry_after=args.retry_after,
+        ),
+        upstream=args.upstream if args.record else None,
+    )
+
+    async def _serve():
+        await server.start(args.host, args.port)
+        print(f"Replay server listening on http://{args.host}:{server.port}")  # noqa: T201
+        await asyncio.Event().wait()
+
+    asyncio.run(_serve())
+
+
+if __name__ == "__main__":
+    main()
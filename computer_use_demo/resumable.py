@@ -0,0 +1,232 @@
+"""
+Websocket sessions that outlive their connection.
+
+A `ResumableConnection` stands in for a session's websocket. It numbers every JSON
+message it sends with a `seq` field and keeps recent messages in a bounded replay
+buffer. When the websocket drops, the session keeps running and its messages are
+buffered. A client that reconnects with the session's token and the last `seq` it
+received gets only the messages it missed. Binary frames are buffered with the
+JSON message that follows them, which is the one that refers to them.
+
+Clients acknowledge messages with `{"ack": seq}`, which frees them from the buffer.
+`SessionStore` holds the connections. It evicts sessions that have had no websocket
+for `idle_timeout`, and when full, the least recently used detached session.
+"""
+
+import asyncio
+import json
+import secrets
+import time
+from collections import OrderedDict, deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Any, Protocol
+
+from . import metrics
+
+REPLAY_BUFFER_BYTES = 8 * 1024 * 1024
+DEFAULT_MAX_SESSIONS = 100
+DEFAULT_IDLE_TIMEOUT = 15 * 60.0  # seconds
+EVICTION_INTERVAL = 30.0  # seconds
+
+
+class WebSocket(Protocol):
+    @property
+    def closed(self) -> bool: ...
+
+    async def send_str(self, data: str) -> None: ...
+
+    async def send_bytes(self, data: bytes) -> None: ...
+
+
+@dataclass
+class Sent:
+    """A sequenced message and the binary frames that went out just before it."""
+
+    seq: int
+    text: str
+    frames: list[bytes] = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        return len(self.text) + sum(len(frame) for frame in self.frames)
+
+
+def parse_ack(value: str | None) -> int:
+    """
+    The `ack` query parameter of a reconnect: the last seq the client received, 0
+    if it's missing. Raises ValueError unless it's a non-negative integer.
+    """
+    if not value:
+        return 0
+    if not (value.isascii() and value.isdigit()):
+        raise ValueError(f"ack must be a non-negative integer, not {value!r}")
+    return int(value)
+
+
+class ResumableConnection:
+    """A session's outgoing messages, sent to whichever websocket is attached."""
+
+    def __init__(self, session_id: str, max_buffer_bytes: int = REPLAY_BUFFER_BYTES):
+        self.session_id = session_id
+        self.token = secrets.token_urlsafe(24)
+        self.max_buffer_bytes = max_buffer_bytes
+        self.closed = False
+        self.last_active = time.monotonic()
+        self._ws: WebSocket | None = None
+        self._attachments = 0
+        self._seq = 0
+        self._buffer: deque[Sent] = deque()
+        self._buffer_bytes = 0
+        self._frames: list[bytes] = []
+        self._lock = asyncio.Lock()
+
+    @property
+    def attached(self) -> bool:
+        return self._ws is not None
+
+    async def attach(self, ws: WebSocket, ack: int = 0) -> None:
+        """
+        Send to `ws` from now on, after the session greeting and the buffered
+        messages after `ack`. A websocket that was attached before is dropped.
+        """
+        async with self._lock:
+            self._ws = ws
+            self._attachments += 1
+            self.last_active = time.monotonic()
+            self._trim(ack)
+            missed = self._buffer[0].seq - ack - 1 if self._buffer else self._seq - ack
+            greeting = {
+                "token": self.token,
+                "resumed": self._attachments > 1,
+                "seq": self._seq,
+                # messages the client missed that are no longer buffered
+                "lost": max(0, missed),
+            }
+            try:
+                await ws.send_str(json.dumps({"session": greeting}))
+                for sent in self._buffer:
+                    for frame in sent.frames:
+                        await ws.send_bytes(frame)
+                    await ws.send_str(sent.text)
+            except ConnectionError:
+                self._detach(ws)
+
+    def detach(self, ws: WebSocket) -> None:
+        """Stop sending to `ws`, if it's still the attached websocket."""
+        self._detach(ws)
+
+    def _detach(self, ws: WebSocket) -> None:
+        if self._ws is ws:
+            self._ws = None
+            self.last_active = time.monotonic()
+
+    def ack(self, seq: int) -> None:
+        """The client has every message up to `seq`."""
+        self._trim(seq)
+
+    def _trim(self, seq: int) -> None:
+        while self._buffer and self._buffer[0].seq <= seq:
+            self._buffer_bytes -= self._buffer.popleft().size
+
+    async def send_json(self, data: dict[str, Any]) -> None:
+        async with self._lock:
+            self._seq += 1
+            sent = Sent(self._seq, json.dumps({**data, "seq": self._seq}), self._frames)
+            self._frames = []
+            self._buffer.append(sent)
+            self._buffer_bytes += sent.size
+            while self._buffer_bytes > self.max_buffer_bytes and len(self._buffer) > 1:
+                self._buffer_bytes -= self._buffer.popleft().size
+            await self._send(self._ws, sent.text)
+
+    async def send_bytes(self, data: bytes) -> None:
+        async with self._lock:
+            self._frames.append(data)
+            await self._send(self._ws, data)
+
+    async def _send(self, ws: WebSocket | None, data: str | bytes) -> None:
+        if ws is None:
+            return
+        if ws.closed:
+            self._detach(ws)
+            return
+        try:
+            if isinstance(data, bytes):
+                await ws.send_bytes(data)
+            else:
+                await ws.send_str(data)
+        except ConnectionError:
+            # the client can reconnect and get this message from the buffer
+            self._detach(ws)
+
+
+class SessionStore:
+    """Keeps resumable sessions, evicting idle and least recently used ones."""
+
+    def __init__(
+        self,
+        on_evict: Callable[[str], Awaitable[None]],
+        max_sessions: int = DEFAULT_MAX_SESSIONS,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+    ):
+        self.on_evict = on_evict
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self._connections: OrderedDict[str, ResumableConnection] = OrderedDict()
+        self._tokens: dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._connections)
+
+    def get(self, session_id: str) -> ResumableConnection | None:
+        return self._connections.get(session_id)
+
+    def find(self, token: str) -> ResumableConnection | None:
+        """The session `token` belongs to, marked as recently used."""
+        session_id = self._tokens.get(token)
+        if session_id is None:
+            return None
+        self._connections.move_to_end(session_id)
+        return self._connections[session_id]
+
+    async def add(self, connection: ResumableConnection) -> None:
+        """Keep `connection`, making room by evicting detached sessions if full."""
+        self._connections[connection.session_id] = connection
+        self._tokens[connection.token] = connection.session_id
+        for candidate in list(self._connections.values()):
+            if len(self._connections) <= self.max_sessions:
+                break
+            if not candidate.attached and candidate is not connection:
+                await self.evict(candidate.session_id, reason="lru")
+
+    async def evict(self, session_id: str, reason: str = "closed") -> None:
+        if connection := self._connections.pop(session_id, None):
+            del self._tokens[connection.token]
+            connection.closed = True
+            metrics.SESSION_EVICTIONS.inc(reason=reason)
+            await self.on_evict(session_id)
+
+    async def evict_idle(self) -> None:
+        now = time.monotonic()
+        for connection in list(self._connections.values()):
+            if (
+                not connection.attached
+                and now - connection.last_active > self.idle_timeout
+            ):
+                await self.evict(connection.session_id, reason="idle")
+
+    async def run_evictions(self, interval: float = EVICTION_INTERVAL) -> None:
+        """Evict idle sessions every `interval` seconds, forever."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                asyncio.get_running_loop().call_exception_handler(
+                    {"message": "Failed to evict idle sessions", "exception": e}
+                )
+
+    async def close_all(self) -> None:
+        for session_id in list(self._connections):
+            await self.evict(session_id)
@@ -0,0 +1,106 @@
+"""
+Screenshots for websocket clients, sent as binary frames instead of base64 JSON.
+
+Each session keeps the screenshots its tools took, identified by the sha256 of the
+PNG. The first time a screenshot is shown, the client gets a downscaled thumbnail in
+a binary frame. After that, messages only refer to it by hash. A client can ask for
+the full resolution image by hash.
+
+Frames use the executor's encoding, a JSON header followed by the image bytes:
+
+    {"sha256": "...", "size": "thumbnail" | "full", "mime_type": "image/png"}
+"""
+
+import asyncio
+import base64
+import hashlib
+import shutil
+import subprocess
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Literal
+
+from . import metrics
+from .executor import encode_frame
+
+FrameSize = Literal["thumbnail", "full"]
+
+THUMBNAIL_GEOMETRY = "400x300"  # ImageMagick geometry; keeps the aspect ratio
+MAX_SCREENSHOTS = 32  # per session, for full resolution requests
+
+
+@dataclass
+class Screenshot:
+    png: bytes
+    thumbnail: bytes | None = None
+
+
+async def make_thumbnail(
+    png: bytes, geometry: str = THUMBNAIL_GEOMETRY
+) -> bytes | None:
+    """Downscale `png` with ImageMagick. Returns None if that's not possible."""
+    if not shutil.which("convert"):
+        return None
+    process = await asyncio.create_subprocess_exec(
+        "convert",
+        "png:-",
+        "-thumbnail",
+        geometry,
+        "png:-",
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    thumbnail, _ = await process.communicate(png)
+    return thumbnail if process.returncode == 0 and thumbnail else None
+
+
+class ScreenshotStore:
+    """A session's recent screenshots, and which frames its client already has."""
+
+    def __init__(self, max_screenshots: int = MAX_SCREENSHOTS):
+        self.max_screenshots = max_screenshots
+        self._screenshots: OrderedDict[str, Screenshot] = OrderedDict()
+        self._sent: set[tuple[str, FrameSize]] = set()
+
+    def __len__(self) -> int:
+        return len(self._screenshots)
+
+    def add(self, base64_image: str) -> str:
+        """Keep a screenshot, evicting the oldest if full. Returns its hash."""
+        png = base64.b64decode(base64_image)
+        sha256 = hashlib.sha256(png).hexdigest()
+        if sha256 in self._screenshots:
+            self._screenshots.move_to_end(sha256)
+        else:
+            self._screenshots[sha256] = Screenshot(png)
+            while len(self._screenshots) > self.max_screenshots:
+                evicted, _ = self._screenshots.popitem(last=False)
+                self._sent -= {(evicted, "thumbnail"), (evicted, "full")}
+        return sha256
+
+    async def frame(
+        self, sha256: str, size: FrameSize = "thumbnail", *, resend: bool = False
+    ) -> bytes | None:
+        """
+        The binary frame for a stored screenshot, or None if the client already has
+        it (and not `resend`) or the screenshot is unknown. Without ImageMagick, the
+        thumbnail is the full image.
+        """
+        screenshot = self._screenshots.get(sha256)
+        if screenshot is None:
+            return None
+        if size == "thumbnail":
+            if screenshot.thumbnail is None:
+                screenshot.thumbnail = await make_thumbnail(screenshot.png) or b""
+            if not screenshot.thumbnail:
+                size = "full"
+        if (sha256, size) in self._sent and not resend:
+            metrics.SCREENSHOT_FRAMES.inc(sent="reference")
+            return None
+        self._sent.add((sha256, size))
+        metrics.SCREENSHOT_FRAMES.inc(sent=size)
+        image = screenshot.thumbnail if size == "thumbnail" else screenshot.png
+        return encode_frame(
+            {"sha256": sha256, "size": size, "mime_type": "image/png"}, image or b""
+        )
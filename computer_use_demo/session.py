@@ -0,0 +1,145 @@
+"""
+Conversation sessions that run their turns as background tasks.
+
+A `Session` owns an inbound message queue and a worker task that hands queued
+messages to its handler one at a time, each as its own task. The connection that
+feeds it stays free to receive further messages and can `stop()` the running turn at
+any point. Cancellation propagates into the tools, which kill their subprocesses, so
+a stopped session is idle again within milliseconds rather than when the current
+command would have finished.
+"""
+
+import asyncio
+import time
+from collections.abc import Awaitable, Callable, Iterator
+from typing import Any
+
+from . import metrics
+
+# messages are passed to the handler as submitted, usually a str or a dict
+MessageHandler = Callable[[Any], Awaitable[None]]
+ErrorHandler = Callable[[Exception], Awaitable[None]]
+
+
+class Session:
+    """A conversation whose messages are processed by a background worker."""
+
+    def __init__(
+        self,
+        session_id: str,
+        handler: MessageHandler,
+        on_error: ErrorHandler | None = None,
+    ):
+        self.session_id = session_id
+        self.handler = handler
+        self.on_error = on_error
+        self.inbox: asyncio.Queue[Any] = asyncio.Queue()
+        self._turn: asyncio.Task | None = None
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._worker = asyncio.create_task(self._work(), name=f"session-{session_id}")
+
+    @property
+    def busy(self) -> bool:
+        """Whether a turn is running or messages are waiting for one."""
+        return not self._idle.is_set() or not self.inbox.empty()
+
+    def submit(self, message: Any) -> int:
+        """
+        Queue `message` to run after the messages already submitted. Returns how
+        many messages are ahead of it, counting the running turn.
+        """
+        ahead = self.inbox.qsize() + (not self._idle.is_set())
+        self.inbox.put_nowait(message)
+        return ahead
+
+    async def stop(self) -> float:
+        """
+        Cancel the running turn and drop queued messages. Returns the seconds it took
+        for the session to become idle.
+        """
+        started = time.perf_counter()
+        while not self.inbox.empty():
+            self.inbox.get_nowait()
+        if self._turn and not self._turn.done():
+            self._turn.cancel()
+        await self._idle.wait()
+        elapsed = time.perf_counter() - started
+        metrics.STOP_SECONDS.observe(elapsed)
+        return elapsed
+
+    async def wait_idle(self) -> None:
+        """Wait until every submitted message has been handled."""
+        while self.busy:
+            await self._idle.wait()
+            await asyncio.sleep(0)
+
+    async def close(self) -> None:
+        """Stop the session and its worker."""
+        await self.stop()
+        self._worker.cancel()
+        await asyncio.gather(self._worker, return_exceptions=True)
+
+    async def _work(self) -> None:
+        while True:
+            message = await self.inbox.get()
+            self._idle.clear()
+            self._turn = asyncio.create_task(self.handler(message))
+            try:
+                # wait() rather than awaiting the task, so that a cancelled turn
+                # doesn't look like the worker itself being cancelled
+                await asyncio.wait({self._turn})
+                if not self._turn.cancelled() and (error := self._turn.exception()):
+                    await self._report(error)
+            except asyncio.CancelledError:
+                self._turn.cancel()
+                await asyncio.gather(self._turn, return_exceptions=True)
+                raise
+            finally:
+                self._turn = None
+                self._idle.set()
+
+    async def _report(self, error: BaseException) -> None:
+        if self.on_error is not None and isinstance(error, Exception):
+            await self.on_error(error)
+        else:
+            asyncio.get_running_loop().call_exception_handler(
+                {
+                    "message": f"Unhandled error in session {self.session_id}",
+                    "exception": error,
+                }
+            )
+
+
+class SessionManager:
+    """The live sessions of a server, by id."""
+
+    def __init__(self):
+        self._sessions: dict[str, Session] = {}
+
+    def open(
+        self,
+        session_id: str,
+        handler: MessageHandler,
+        on_error: ErrorHandler | None = None,
+    ) -> Session:
+        if session_id in self._sessions:
+            raise ValueError(f"Session {session_id} is already open")
+        session = self._sessions[session_id] = Session(session_id, handler, on_error)
+        return session
+
+    def get(self, session_id: str) -> Session | None:
+        return self._sessions.get(session_id)
+
+    async def close(self, session_id: str) -> None:
+        if session := self._sessions.pop(session_id, None):
+            await session.close()
+
+    async def close_all(self) -> None:
+        await asyncio.gather(*(self.close(session_id) for session_id in list(self)))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._sessions)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -25,6 +25,8 @@ from anthropic.types.beta import (
 from streamlit.delta_generator import DeltaGenerator
 
 from computer_use_demo.loop import (
+    INTERRUPT_TEXT,
+    INTERRUPT_TOOL_ERROR,
     PROVIDER_TO_DEFAULT_MODEL_NAME,
     APIProvider,
     sampling_loop,
@@ -52,8 +54,6 @@ STREAMLIT_STYLE = """
 """
 
 WARNING_TEXT = "⚠️ Security Alert: Never provide access to sensitive accounts or data, as malicious web content can hijack Claude's behavior"
-INTERRUPT_TEXT = "(user stopped or interrupted and wrote the following)"
-INTERRUPT_TOOL_ERROR = "human stopped or interrupted tool execution"
 
 
 class Sender(StrEnum):
@@ -8,15 +8,21 @@ through the terminal, without needing a web interface.
 
 Usage:
     ./terminal.py [--api-key KEY] [--provider PROVIDER] [--model MODEL] [--hide-images]
+                  [--base-url URL] [--trace FILE] [--no-stream]
     
 Example commands once running:
     - Normal text: Any text will be sent to Claude as a command
     - exit: Exit the program
     - clear: Clear the conversation history
+    - stop, or Ctrl+C: Interrupt the running task
+
+Input is read while Claude works, so you can type the next command right away; it
+runs once the current one is done. An interrupted task's unfinished tool calls are
+closed with error results, so the conversation can continue with the next command.
     
 The interface will display:
     - Your input prefixed with "You: "
-    - Claude's responses prefixed with "Assistant: "
+    - Claude's responses prefixed with "Assistant: ", printed as they are generated
     - Tool usage and results as they occur
     - Screenshots will be noted but not displayed in terminal mode
 """
@@ -25,18 +31,57 @@ import argparse
 import asyncio
 import json
 import os
+import signal
 import sys
+import threading
+from collections.abc import AsyncIterator
 from typing import Any, Optional, cast
 
 import httpx
 from anthropic.types.beta import BetaContentBlockParam, BetaMessageParam
 
+from computer_use_demo import tracing
+from computer_use_demo.events import TextDelta
 from computer_use_demo.loop import (
+    INTERRUPT_TOOL_ERROR,
     APIProvider,
     PROVIDER_TO_DEFAULT_MODEL_NAME,
+    heal_interrupted_messages,
     sampling_loop,
 )
-from computer_use_demo.tools import ToolResult
+from computer_use_demo.session import Session
+from computer_use_demo.tools import (
+    BashTool,
+    ComputerTool,
+    EditTool,
+    SearchTool,
+    ToolCollection,
+    ToolResult,
+)
+
+async def read_lines() -> AsyncIterator[str]:
+    """
+    Yield lines from stdin without blocking the event loop. They're read in a thread:
+    `connect_read_pipe` would make stdin non-blocking, and on a terminal stdout shares
+    that flag, so large prints could fail with BlockingIOError.
+    """
+    loop = asyncio.get_running_loop()
+    lines: asyncio.Queue[str] = asyncio.Queue()
+
+    def read() -> None:
+        while True:
+            line = sys.stdin.readline()
+            try:
+                loop.call_soon_threadsafe(lines.put_nowait, line)
+            except RuntimeError:
+                return  # the event loop is closed
+            if not line:
+                return
+
+    # a daemon, so a read still waiting for input doesn't keep the process alive
+    threading.Thread(target=read, name="stdin-reader", daemon=True).start()
+    while line := await lines.get():
+        yield line
 
 class TerminalInterface:
     def __init__(
@@ -45,25 +90,49 @@ class TerminalInterface:
         provider: str = "anthropic",
         model: Optional[str] = None,
         hide_images: bool = False,
+        base_url: Optional[str] = None,
+        stream: bool = True,
     ):
         self.api_key = api_key or os.getenv("ANTHROPIC_API_KEY", "")
         self.provider = cast(APIProvider, provider)
         self.model = model or PROVIDER_TO_DEFAULT_MODEL_NAME[self.provider]
         self.hide_images = hide_images
+        self.base_url = base_url
+        self.stream = stream
+        # content block whose streamed text is being printed
+        self.streaming_block: Optional[int] = None
         self.messages: list[BetaMessageParam] = []
         self.tools: dict[str, ToolResult] = {}
         self.responses: dict[str, tuple[httpx.Request, Any]] = {}
         self.only_n_most_recent_images = 3
         self.custom_system_prompt = ""
+        self.session: Optional[Session] = None
+        # kept across turns, so the bash shell and its warm spares are too
+        self.tool_collection: Optional[ToolCollection] = None
 
     def output_callback(self, message: BetaContentBlockParam) -> None:
         """Handle output from the model."""
         if isinstance(message, dict):
             if message["type"] == "text":
-                print("\nAssistant:", message["text"])
+                if self.stream:
+                    # already printed by text_delta_callback
+                    if self.streaming_block is not None:
+                        print()
+                        self.streaming_block = None
+                else:
+                    print("\nAssistant:", message["text"])
             elif message["type"] == "tool_use":
                 print(f'\nTool Use: {message["name"]}\nInput: {message["input"]}')
 
+    def text_delta_callback(self, delta: TextDelta) -> None:
+        """Print streamed text as it arrives."""
+        if delta.block != self.streaming_block:
+            if self.streaming_block is not None:
+                print()
+            print("\nAssistant: ", end="")
+            self.streaming_block = delta.block
+        print(delta.text, end="", flush=True)
+
     def tool_output_callback(self, tool_output: ToolResult, tool_id: str) -> None:
         """Handle output from tools."""
         self.tools[tool_id] = tool_output
@@ -84,51 +153,96 @@ class TerminalInterface:
         if error:
             print(f"\nAPI Error: {error}")
 
+    async def handle_message(self, user_input: str) -> None:
+        """Run one turn of the conversation."""
+        self.messages.append({
+            "role": "user",
+            "content": [{"type": "text", "text": user_input}],
+        })
+        if self.tool_collection is None:
+            self.tool_collection = ToolCollection(
+                ComputerTool(), BashTool(), EditTool(), SearchTool()
+            )
+        try:
+            self.messages = await sampling_loop(
+                model=self.model,
+                provider=self.provider,
+                system_prompt_suffix=self.custom_system_prompt,
+                messages=self.messages,
+                output_callback=self.output_callback,
+                tool_output_callback=self.tool_output_callback,
+                api_response_callback=self.api_response_callback,
+                api_key=self.api_key,
+                only_n_most_recent_images=self.only_n_most_recent_images,
+                base_url=self.base_url,
+                text_delta_callback=self.text_delta_callback if self.stream else None,
+                tool_collection=self.tool_collection,
+            )
+        except asyncio.CancelledError:
+            # sampling_loop extends self.messages in place, so the partial turn is
+            # there; close its tool calls so the next message can continue from it
+            for tool_id in heal_interrupted_messages(self.messages):
+                self.tools[tool_id] = ToolResult(error=INTERRUPT_TOOL_ERROR)
+            self.streaming_block = None
+            print("\n\nInterrupted.")
+            raise
+        finally:
+            self.prompt()
+
+    async def report_error(self, error: Exception) -> None:
+        print(f"\nError: {type(error).__name__}: {error}")
+
+    def prompt(self) -> None:
+        """Show the prompt, unless more queued commands are about to run."""
+        if self.session is None or self.session.inbox.empty():
+            print("\nYou: ", end="", flush=True)
+
+    def interrupt(self) -> None:
+        """Ctrl+C: stop the running task, or explain how to quit if there is none."""
+        if self.session and self.session.busy:
+            asyncio.ensure_future(self.session.stop())
+        else:
+            print("\nUse 'exit' to quit or continue with your next message.")
+            self.prompt()
+
     async def run(self):
         """Run the terminal interface."""
         print("Computer Control Terminal Interface")
-        print("Type 'exit' or press Ctrl+C to quit")
+        print("Type 'exit' to quit")
         print("Type 'clear' to clear the conversation")
+        print("Type 'stop' or press Ctrl+C to interrupt the running task")
         print("---------------------------------------")
 
+        loop = asyncio.get_running_loop()
+        # turns run in the session's task, so input keeps being read while they run
+        self.session = Session("terminal", self.handle_message, self.report_error)
+        loop.add_signal_handler(signal.SIGINT, self.interrupt)
+        self.prompt()
         try:
-            while True:
-                try:
-                    user_input = input("\nYou: ").strip()
-                    
-                    if user_input.lower() == 'exit':
-                        break
-                    elif user_input.lower() == 'clear':
-                        self.messages = []
-                        print("\nConversation cleared.")
-                        continue
-                    elif not user_input:
-                        continue
-
-                    self.messages.append({
-                        "role": "user",
-                        "content": [{"type": "text", "text": user_input}],
-                    })
-
-                    self.messages = await sampling_loop(
-                        model=self.model,
-                        provider=self.provider,
-                        system_prompt_suffix=self.custom_system_prompt,
-                        messages=self.messages,
-                        output_callback=self.output_callback,
-                        tool_output_callback=self.tool_output_callback,
-                        api_response_callback=self.api_response_callback,
-                        api_key=self.api_key,
-                        only_n_most_recent_images=self.only_n_most_recent_images,
-                    )
-
-                except KeyboardInterrupt:
-                    print("\nUse 'exit' to quit or continue with your next message.")
-                    continue
-
-        except KeyboardInterrupt:
-            print("\nGoodbye!")
-            sys.exit(0)
+            async for line in read_lines():
+                user_input = line.strip()
+                if user_input.lower() == 'exit':
+                    await self.session.stop()
+                    break
+                elif user_input.lower() == 'stop':
+                    await self.session.stop()
+                elif user_input.lower() == 'clear':
+                    await self.session.stop()
+                    self.messages = []
+                    print("\nConversation cleared.")
+                    self.prompt()
+                elif user_input:
+                    self.session.submit(user_input)
+                else:
+                    self.prompt()
+            # at the end of piped input, finish the commands it queued
+            await self.session.wait_idle()
+        finally:
+            loop.remove_signal_handler(signal.SIGINT)
+            await self.session.close()
+            if self.tool_collection:
+                await self.tool_collection.close()
+        print("\nGoodbye!")
 
 def main():
     parser = argparse.ArgumentParser(description="Terminal interface for computer control")
@@ -137,16 +251,29 @@ def main():
                         help="API provider (default: anthropic)")
     parser.add_argument("--model", help="Model to use (defaults to provider's default)")
     parser.add_argument("--hide-images", action="store_true", help="Don't notify about screenshots")
+    parser.add_argument("--base-url", help="Messages API base URL, e.g. a local replay server")
+    parser.add_argument("--trace", help="Write latency spans to FILE (.json for Chrome trace format)")
+    parser.add_argument("--no-stream", action="store_true", help="Print responses only once complete")
     args = parser.parse_args()
 
+    if args.trace:
+        tracing.configure(args.trace)
+
     interface = TerminalInterface(
         api_key=args.api_key,
         provider=args.provider,
         model=args.model,
         hide_images=args.hide_images,
+        base_url=args.base_url,
+        stream=not args.no_stream,
     )
 
     asyncio.run(interface.run())
 
+    if tracer := tracing.get_tracer():
+        print("\nLatency summary:")
+        print(tracing.format_summary(tracer.summary()))
+        tracer.close()
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
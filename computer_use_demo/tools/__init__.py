@@ -3,12 +3,14 @@ from .bash import BashTool
 from .collection import ToolCollection
 from .computer import ComputerTool
 from .edit import EditTool
+from .search import SearchTool
 
 __ALL__ = [
     BashTool,
     CLIResult,
     ComputerTool,
     EditTool,
+    SearchTool,
     ToolCollection,
     ToolResult,
 ]
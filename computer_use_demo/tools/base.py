@@ -19,6 +19,9 @@ class BaseAnthropicTool(metaclass=ABCMeta):
     ) -> BetaToolUnionParam:
         raise NotImplementedError
 
+    async def close(self) -> None:  # noqa: B027, most tools have nothing to stop
+        """Stops any processes the tool keeps running between calls."""
+
 
 @dataclass(kw_only=True, frozen=True)
 class ToolResult:
@@ -1,11 +1,17 @@
 import asyncio
 import os
+import signal
+from collections import deque
 from typing import ClassVar, Literal
 
 from anthropic.types.beta import BetaToolBash20241022Param
 
+from .. import tracing
 from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
 
+# shells kept started and ready by each BashTool, unless BASH_POOL_SIZE says otherwise
+DEFAULT_POOL_SIZE = 1
+
 
 class _BashSession:
     """A session of a bash shell."""
@@ -18,9 +24,10 @@ class _BashSession:
     _timeout: float = 120.0  # seconds
     _sentinel: str = "<<exit>>"
 
-    def __init__(self):
+    def __init__(self, env: dict[str, str] | None = None):
         self._started = False
         self._timed_out = False
+        self._env = env
 
     async def start(self):
         if self._started:
@@ -34,20 +41,61 @@ class _BashSession:
             stdin=asyncio.subprocess.PIPE,
             stdout=asyncio.subprocess.PIPE,
             stderr=asyncio.subprocess.PIPE,
+            env={**os.environ, **self._env} if self._env else None,
         )
 
         self._started = True
 
+    async def ready(self) -> bool:
+        """Start the shell and wait for it to answer. False if it exited instead."""
+        await self.start()
+        return isinstance(await self._run(":"), CLIResult)
+
+    @property
+    def alive(self) -> bool:
+        """Whether the shell can still run commands."""
+        return (
+            self._started and self._process.returncode is None and not self._timed_out
+        )
+
     def stop(self):
         """Terminate the bash shell."""
         if not self._started:
             raise ToolError("Session has not started.")
+        self._close_stdin()
         if self._process.returncode is not None:
             return
         self._process.terminate()
 
+    def kill(self):
+        """Kill the shell and everything it started."""
+        if not self._started:
+            return
+        self._close_stdin()
+        if self._process.returncode is not None:
+            return
+        try:
+            os.killpg(self._process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    async def wait(self):
+        """Wait for the shell to exit, e.g. after `kill`."""
+        if self._started:
+            await self._process.wait()
+
+    def _close_stdin(self):
+        # nothing more will be written, and the process transport only closes
+        # once all of its pipes are
+        assert self._process.stdin
+        self._process.stdin.close()
+
     async def run(self, command: str):
         """Execute a command in the bash shell."""
+        with tracing.span("bash.run"):
+            return await self._run(command)
+
+    async def _run(self, command: str):
         if not self._started:
             raise ToolError("Session has not started.")
         if self._process.returncode is not None:
@@ -72,16 +120,19 @@ class _BashSession:
         await self._process.stdin.drain()
 
         # read output from the process, until the sentinel is found
+        stdout, stderr = bytearray(), bytearray()
+        sentinel = self._sentinel.encode()
         try:
             async with asyncio.timeout(self._timeout):
                 while True:
                     await asyncio.sleep(self._output_delay)
-                    # if we read directly from stdout/stderr, it will wait forever for
-                    # EOF. use the StreamReader buffer directly instead.
-                    output = self._process.stdout._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
-                    if self._sentinel in output:
+                    searched = max(0, len(stdout) - len(sentinel) + 1)
+                    stdout += await _take_buffered(self._process.stdout)
+                    stderr += await _take_buffered(self._process.stderr)
+                    end = stdout.find(sentinel, searched)
+                    if end != -1:
                         # strip the sentinel and break
-                        output = output[: output.index(self._sentinel)]
+                        del stdout[end:]
                         break
         except asyncio.TimeoutError:
             self._timed_out = True
@@ -89,20 +140,35 @@ class _BashSession:
                 f"timed out: bash has not returned in {self._timeout} seconds and must be restarted",
             ) from None
 
+        output = stdout.decode()
         if output.endswith("\n"):
             output = output[:-1]
 
-        error = self._process.stderr._buffer.decode()  # pyright: ignore[reportAttributeAccessIssue]
+        error = stderr.decode()
         if error.endswith("\n"):
             error = error[:-1]
 
-        # clear the buffers so that the next output can be read correctly
-        self._process.stdout._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
-        self._process.stderr._buffer.clear()  # pyright: ignore[reportAttributeAccessIssue]
-
         return CLIResult(output=output, error=error)
 
 
+async def _take_buffered(reader: asyncio.StreamReader) -> bytes:
+    """
+    What `reader` has buffered, without waiting for EOF like reading it directly
+    would. Taking it out of the buffer, rather than only looking at it, lets the
+    reader resume reading the pipe once a large output has filled the buffer.
+    """
+    buffered = len(reader._buffer)  # pyright: ignore[reportAttributeAccessIssue]
+    return await reader.read(buffered) if buffered else b""
+
+
+def _discard(task: "asyncio.Task[_BashSession | None]") -> None:
+    """Stop a pooled shell, whether it's still warming or ready."""
+    if not task.done():
+        task.cancel()
+    elif not task.cancelled() and (session := task.result()):
+        session.kill()
+
+
 class BashTool(BaseAnthropicTool):
     """
     A tool that allows the agent to run bash commands.
@@ -113,8 +179,26 @@ class BashTool(BaseAnthropicTool):
     name: ClassVar[Literal["bash"]] = "bash"
     api_type: ClassVar[Literal["bash_20241022"]] = "bash_20241022"
 
-    def __init__(self):
+    def __init__(self, env: dict[str, str] | None = None, pool_size: int | None = None):
+        """
+        `env` is added to the environment the shells are started with. `pool_size`
+        shells, by default `BASH_POOL_SIZE` or 1, are kept started and ready in the
+        background, so neither the first command nor restarts wait for bash to
+        start. They warm from creation if an event loop is running, otherwise from
+        the first command. `close` stops them.
+        """
         self._session = None
+        self._env = env
+        if pool_size is None:
+            pool_size = int(os.getenv("BASH_POOL_SIZE") or DEFAULT_POOL_SIZE)
+        self._pool_size = pool_size
+        self._pool: deque[asyncio.Task[_BashSession | None]] = deque()
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            self._fill_pool()
         super().__init__()
 
     async def __call__(
@@ -123,20 +207,87 @@ class BashTool(BaseAnthropicTool):
         if restart:
             if self._session:
                 self._session.stop()
-            self._session = _BashSession()
-            await self._session.start()
+            self._session = await self._take_session()
 
             return ToolResult(system="tool has been restarted.")
 
         if self._session is None:
-            self._session = _BashSession()
-            await self._session.start()
+            self._session = await self._take_session()
 
         if command is not None:
-            return await self._session.run(command)
+            try:
+                return await self._session.run(command)
+            except asyncio.CancelledError:
+                # the command is still running and would interleave its output with
+                # the next one, so give up on this shell
+                session, self._session = self._session, None
+                session.kill()
+                await session.wait()
+                raise
 
         raise ToolError("no command provided.")
 
+    def stop(self):
+        """
+        Kill the shell, if one is running, and the ones kept ready. The next command
+        starts a new one.
+        """
+        if self._session:
+            self._session.kill()
+            self._session = None
+        while self._pool:
+            _discard(self._pool.popleft())
+
+    async def close(self):
+        """Stop the shells, like `stop`, and wait for them to exit."""
+        session, pool = self._session, list(self._pool)
+        self.stop()
+        # the cancelled ones wait for their shell themselves
+        warmed = await asyncio.gather(*pool, return_exceptions=True)
+        for stopped in (session, *warmed):
+            if isinstance(stopped, _BashSession):
+                await stopped.wait()
+
+    async def _take_session(self) -> _BashSession:
+        """A started shell: a ready one from the pool, unless none is left."""
+        # only those already warming: a shell that fails to start isn't retried forever
+        for _ in range(len(self._pool)):
+            task = self._pool.popleft()
+            self._fill_pool()
+            try:
+                session = await asyncio.shield(task)
+            except asyncio.CancelledError:
+                _discard(task)  # its replacement is already warming
+                raise
+            # it may have exited while it waited in the pool
+            if session is not None and session.alive:
+                return session
+            if session is not None:
+                session.kill()
+        self._fill_pool()
+        session = _BashSession(self._env)
+        await session.start()
+        return session
+
+    def _fill_pool(self) -> None:
+        while len(self._pool) < self._pool_size:
+            self._pool.append(asyncio.create_task(self._warm_session()))
+
+    async def _warm_session(self) -> _BashSession | None:
+        """A started shell that answered, or None if it failed to start."""
+        session = _BashSession(self._env)
+        try:
+            if await session.ready():
+                return session
+        except (OSError, ToolError):
+            pass
+        except asyncio.CancelledError:
+            session.kill()
+            await session.wait()
+            raise
+        session.kill()
+        return None
+
     def to_params(self) -> BetaToolBash20241022Param:
         return {
             "type": self.api_type,
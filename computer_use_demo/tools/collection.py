@@ -1,9 +1,12 @@
 """Collection classes for managing multiple tools."""
 
+import asyncio
+import re
 from typing import Any
 
 from anthropic.types.beta import BetaToolUnionParam
 
+from .. import metrics, tracing
 from .base import (
     BaseAnthropicTool,
     ToolError,
@@ -11,6 +14,22 @@ from .base import (
     ToolResult,
 )
 
+# what a tool call's action may look like as a metric label
+_ACTION_LABEL = re.compile(r"[a-z_]{1,32}")
+
+
+def _action_label(name: str, tool_input: dict[str, Any]) -> str:
+    """
+    A bounded label for what a tool call does. Bash's `command` is a whole shell
+    command, which would make a time series per command and show it on /metrics.
+    """
+    if name == "bash":
+        return "restart" if tool_input.get("restart") else "run"
+    action = tool_input.get("action") or tool_input.get("command") or ""
+    if not isinstance(action, str) or not _ACTION_LABEL.fullmatch(action):
+        return "other" if action else ""
+    return action
+
 
 class ToolCollection:
     """A collection of anthropic-defined tools."""
@@ -24,11 +43,26 @@ class ToolCollection:
     ) -> list[BetaToolUnionParam]:
         return [tool.to_params() for tool in self.tools]
 
+    async def close(self) -> None:
+        """Stop the tools' background processes, such as the bash shells."""
+        await asyncio.gather(*(tool.close() for tool in self.tools))
+
+    async def __aenter__(self) -> "ToolCollection":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        await self.close()
+
     async def run(self, *, name: str, tool_input: dict[str, Any]) -> ToolResult:
         tool = self.tool_map.get(name)
         if not tool:
             return ToolFailure(error=f"Tool {name} is invalid")
-        try:
-            return await tool(**tool_input)
-        except ToolError as e:
-            return ToolFailure(error=e.message)
+        action = _action_label(name, tool_input)
+        with (
+            tracing.span("tool.run", tool=name, action=action),
+            metrics.TOOL_SECONDS.time(tool=name, action=action),
+        ):
+            try:
+                return await tool(**tool_input)
+            except ToolError as e:
+                return ToolFailure(error=e.message)
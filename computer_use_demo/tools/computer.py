@@ -10,6 +10,8 @@ from uuid import uuid4
 
 from anthropic.types.beta import BetaToolComputerUse20241022Param
 
+from .. import metrics, tracing
+from . import forkserver
 from .base import BaseAnthropicTool, ToolError, ToolResult
 from .run import run
 
@@ -90,17 +92,24 @@ class ComputerTool(BaseAnthropicTool):
     def to_params(self) -> BetaToolComputerUse20241022Param:
         return {"name": self.name, "type": self.api_type, **self.options}
 
-    def __init__(self):
+    def __init__(
+        self,
+        display_num: int | None = None,
+        width: int | None = None,
+        height: int | None = None,
+    ):
+        """Settings not passed in are read from DISPLAY_NUM, WIDTH and HEIGHT."""
         super().__init__()
 
-        self.width = int(os.getenv("WIDTH") or 0)
-        self.height = int(os.getenv("HEIGHT") or 0)
+        self.width = width or int(os.getenv("WIDTH") or 0)
+        self.height = height or int(os.getenv("HEIGHT") or 0)
         assert self.width and self.height, "WIDTH, HEIGHT must be set"
-        if (display_num := os.getenv("DISPLAY_NUM")) is not None:
-            self.display_num = int(display_num)
+        if display_num is None and (env_display_num := os.getenv("DISPLAY_NUM")):
+            display_num = int(env_display_num)
+        self.display_num = display_num
+        if self.display_num is not None:
             self._display_prefix = f"DISPLAY=:{self.display_num} "
         else:
-            self.display_num = None
             self._display_prefix = ""
 
         self.xdotool = f"{self._display_prefix}xdotool"
@@ -207,33 +216,45 @@ class ComputerTool(BaseAnthropicTool):
             # Fall back to scrot if gnome-screenshot isn't available
             screenshot_cmd = f"{self._display_prefix}scrot -p {path}"
 
-        result = await self.shell(screenshot_cmd, take_screenshot=False)
+        with tracing.span("computer.capture"):
+            _, stdout, stderr = await self._run(screenshot_cmd)
+        result = ToolResult(output=stdout, error=stderr)
         if self._scaling_enabled:
             x, y = self.scale_coordinates(
                 ScalingSource.COMPUTER, self.width, self.height
             )
-            await self.shell(
-                f"convert {path} -resize {x}x{y}! {path}", take_screenshot=False
-            )
+            with tracing.span("computer.resize"):
+                await self._run(f"convert {path} -resize {x}x{y}! {path}")
 
         if path.exists():
-            return result.replace(
-                base64_image=base64.b64encode(path.read_bytes()).decode()
-            )
+            with tracing.span("computer.encode"):
+                image = path.read_bytes()
+                base64_image = base64.b64encode(image).decode()
+            metrics.SCREENSHOT_BYTES.observe(len(image))
+            return result.replace(base64_image=base64_image)
         raise ToolError(f"Failed to take screenshot: {result.error}")
 
     async def shell(self, command: str, take_screenshot=True) -> ToolResult:
         """Run a shell command and return the output, error, and optionally a screenshot."""
-        _, stdout, stderr = await run(command)
+        with tracing.span("computer.action"):
+            _, stdout, stderr = await self._run(command)
         base64_image = None
 
         if take_screenshot:
             # delay to let things settle before taking a screenshot
-            await asyncio.sleep(self._screenshot_delay)
+            with tracing.span("computer.settle"):
+                await asyncio.sleep(self._screenshot_delay)
             base64_image = (await self.screenshot()).base64_image
 
         return ToolResult(output=stdout, error=stderr, base64_image=base64_image)
 
+    async def _run(self, command: str) -> tuple[int, str, str]:
+        """Run a command on the fork server, or through a shell if it needs one."""
+        if (split := forkserver.split_command(command)) is None:
+            return await run(command)
+        env, argv = split
+        return await forkserver.shared().run(argv, env=env)
+
     def scale_coordinates(self, source: ScalingSource, x: int, y: int):
         """Scale coordinates to a target maximum resolution."""
         if not self._scaling_enabled:
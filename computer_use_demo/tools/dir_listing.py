@@ -0,0 +1,140 @@
+"""
+Directory listings for `EditTool.view`, without running `find`.
+
+`DirectoryLister` lists the non-hidden entries of a directory up to two levels
+deep, like ``find {path} -maxdepth 2 -not -path '*/\\.*'``, but in-process and
+bounded. It lists level by level and stops at `max_entries`, so a node_modules-sized
+tree costs as much as a small one. Subdirectories that aren't expanded, because
+they are too deep or the budget ran out, are shown with their number of entries:
+
+    /repo/node_modules/lodash [312 entries]
+
+Each directory's scan is cached until the directory's mtime changes. Scans of a
+directory modified within `RACY_SECONDS` aren't cached, because another change
+in the same mtime tick would go unnoticed. The cache holds up to
+`max_cached_entries` names, evicting the least recently used directories.
+"""
+
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from pathlib import Path
+
+DEFAULT_MAX_ENTRIES = 400
+DEFAULT_MAX_CACHED_ENTRIES = 100_000
+RACY_SECONDS = 1.0
+
+
+@dataclass
+class _Scan:
+    """The sorted non-hidden entries of a directory, as (name, is_dir)."""
+
+    mtime_ns: int
+    entries: list[tuple[str, bool]]
+    total: int  # more than `len(entries)` if it was cut to the budget
+
+
+class DirectoryLister:
+    """Bounded, cached listings of directory trees."""
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_cached_entries: int = DEFAULT_MAX_CACHED_ENTRIES,
+    ):
+        self.max_entries = max_entries
+        self.max_cached_entries = max_cached_entries
+        self._scans: OrderedDict[Path, _Scan] = OrderedDict()
+        self._cached_entries = 0
+
+    def listing(self, path: Path, depth: int = 2) -> str:
+        """
+        Full paths of the entries under `path` up to `depth` levels deep, in tree
+        order, starting with `path` itself. Raises OSError if `path` can't be read.
+        """
+        budget = self.max_entries
+        shown: dict[Path, tuple[_Scan, int]] = {}
+        pending = deque([(path, 1)])
+        # directories still pending when the budget runs out are shown collapsed
+        while pending and budget:
+            directory, level = pending.popleft()
+            try:
+                scan = self._scan(directory)
+            except OSError:
+                if directory == path:
+                    raise
+                continue
+            take = min(budget, len(scan.entries))
+            budget -= take
+            shown[directory] = scan, take
+            for name, is_dir in scan.entries[:take]:
+                if is_dir and level < depth:
+                    pending.append((directory / name, level + 1))
+
+        lines = [str(path)]
+        self._render(path, shown, lines)
+        return "\n".join(lines)
+
+    def _render(
+        self, directory: Path, shown: dict[Path, tuple[_Scan, int]], lines: list[str]
+    ) -> None:
+        """Append the lines of `directory`'s entries, each followed by its own."""
+        scan, take = shown[directory]
+        for name, is_dir in scan.entries[:take]:
+            child = directory / name
+            if child in shown:
+                lines.append(str(child))
+                self._render(child, shown, lines)
+            elif is_dir:
+                lines.append(f"{child} [{self._describe(child)}]")
+            else:
+                lines.append(str(child))
+        if take < scan.total:
+            lines.append(f"{directory / '...'} [{scan.total - take} more entries]")
+
+    def _describe(self, directory: Path) -> str:
+        """The number of entries of a directory that isn't expanded."""
+        try:
+            total = self._scan(directory).total
+        except OSError:
+            return "not readable"
+        return f"{total} entr{'y' if total == 1 else 'ies'}"
+
+    def _scan(self, directory: Path) -> _Scan:
+        now = time.time_ns()
+        mtime_ns = directory.stat().st_mtime_ns
+        scan = self._scans.get(directory)
+        if scan is not None and scan.mtime_ns == mtime_ns:
+            self._scans.move_to_end(directory)
+            return scan
+        entries = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    # like `find`, don't follow links to directories
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_dir = False
+                entries.append((entry.name, is_dir))
+        entries.sort()
+        scan = _Scan(mtime_ns, entries[: self.max_entries], len(entries))
+        self._forget(directory)
+        if now - mtime_ns > RACY_SECONDS * 1e9:
+            self._scans[directory] = scan
+            self._cached_entries += len(scan.entries)
+            while self._cached_entries > self.max_cached_entries:
+                _, evicted = self._scans.popitem(last=False)
+                self._cached_entries -= len(evicted.entries)
+        return scan
+
+    def _forget(self, directory: Path) -> None:
+        scan = self._scans.pop(directory, None)
+        if scan is not None:
+            self._cached_entries -= len(scan.entries)
+
+    def clear(self) -> None:
+        self._scans.clear()
+        self._cached_entries = 0
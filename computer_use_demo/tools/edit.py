@@ -1,11 +1,22 @@
-from collections import defaultdict
+import contextlib
+import locale
+import mmap
+import os
+import shutil
+import tempfile
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from itertools import chain
 from pathlib import Path
-from typing import Literal, get_args
+from typing import Any, Literal, get_args
 
 from anthropic.types.beta import BetaToolTextEditor20241022Param
 
 from .base import BaseAnthropicTool, CLIResult, ToolError, ToolResult
-from .run import maybe_truncate, run
+from .dir_listing import DirectoryLister
+from .edit_history import FileHistory
+from .file_cache import FileCache
+from .run import maybe_truncate
 
 Command = Literal[
     "view",
@@ -13,8 +24,31 @@ Command = Literal[
     "str_replace",
     "insert",
     "undo_edit",
+    "multi_edit",
 ]
 SNIPPET_LINES: int = 4
+# range views of files at least this large only read the range, see `line_index`
+LINE_INDEX_MIN_BYTES: int = 1024 * 1024
+# files at least this large are decoded from a memory map instead of read
+MAPPED_READ_MIN_BYTES: int = 1024 * 1024
+# edits of files at least this large are written piece by piece to a temporary file
+STREAMED_WRITE_MIN_CHARS: int = 1024 * 1024
+WRITE_CHUNK_CHARS: int = 1024 * 1024
+NEWLINE_SEARCH_CHARS: int = 1024 * 1024
+
+
+@dataclass
+class _Splice:
+    """One edit of a `multi_edit`: `[start:end]` of the file becomes `text`."""
+
+    start: int
+    end: int
+    text: str
+    number: int  # of the edit, counting from 1
+
+    @property
+    def added_chars(self) -> int:
+        return len(self.text) - (self.end - self.start)
 
 
 class EditTool(BaseAnthropicTool):
@@ -26,10 +60,19 @@ class EditTool(BaseAnthropicTool):
     api_type: Literal["text_editor_20241022"] = "text_editor_20241022"
     name: Literal["str_replace_editor"] = "str_replace_editor"
 
-    _file_history: dict[Path, list[str]]
+    _file_history: FileHistory
+    _file_cache: FileCache
+    _lister: DirectoryLister
 
-    def __init__(self):
-        self._file_history = defaultdict(list)
+    def __init__(
+        self,
+        history: FileHistory | None = None,
+        file_cache: FileCache | None = None,
+        lister: DirectoryLister | None = None,
+    ):
+        self._file_history = history or FileHistory()
+        self._file_cache = file_cache or FileCache()
+        self._lister = lister or DirectoryLister()
         super().__init__()
 
     def to_params(self) -> BetaToolTextEditor20241022Param:
@@ -48,6 +91,7 @@ class EditTool(BaseAnthropicTool):
         old_str: str | None = None,
         new_str: str | None = None,
         insert_line: int | None = None,
+        edits: list[dict[str, Any]] | None = None,
         **kwargs,
     ):
         _path = Path(path)
@@ -58,7 +102,8 @@ class EditTool(BaseAnthropicTool):
             if file_text is None:
                 raise ToolError("Parameter `file_text` is required for command: create")
             self.write_file(_path, file_text)
-            self._file_history[_path].append(file_text)
+            self._file_cache.update(_path, file_text)
+            self._file_history.push(_path, file_text)
             return ToolResult(output=f"File created successfully at: {_path}")
         elif command == "str_replace":
             if old_str is None:
@@ -76,6 +121,12 @@ class EditTool(BaseAnthropicTool):
             return self.insert(_path, insert_line, new_str)
         elif command == "undo_edit":
             return self.undo_edit(_path)
+        elif command == "multi_edit":
+            if not edits or not isinstance(edits, list):
+                raise ToolError(
+                    "Parameter `edits` is required for command: multi_edit, as a non-empty list"
+                )
+            return self.multi_edit(_path, edits)
         raise ToolError(
             f'Unrecognized command {command}. The allowed commands for the {self.name} tool are: {", ".join(get_args(Command))}'
         )
@@ -114,83 +165,120 @@ class EditTool(BaseAnthropicTool):
                     "The `view_range` parameter is not allowed when `path` points to a directory."
                 )
 
-            _, stdout, stderr = await run(
-                rf"find {path} -maxdepth 2 -not -path '*/\.*'"
+            try:
+                listing = self._lister.listing(path)
+            except OSError as e:
+                raise ToolError(f"Ran into {e} while trying to list {path}") from None
+            return CLIResult(
+                output=f"Here's the files and directories up to 2 levels deep in {path}, excluding hidden items:\n{maybe_truncate(listing)}\n"
             )
-            if not stderr:
-                stdout = f"Here's the files and directories up to 2 levels deep in {path}, excluding hidden items:\n{stdout}\n"
-            return CLIResult(output=stdout, error=stderr)
 
-        file_content = self.read_file(path)
+        if (
+            view_range
+            and self._file_size(path) >= LINE_INDEX_MIN_BYTES
+            and not self._file_cache.has_text(path)
+        ):
+            return CLIResult(output=self._view_indexed(path, view_range))
+
+        file_content = self._read(path)
         init_line = 1
         if view_range:
-            if len(view_range) != 2 or not all(isinstance(i, int) for i in view_range):
-                raise ToolError(
-                    "Invalid `view_range`. It should be a list of two integers."
-                )
-            file_lines = file_content.split("\n")
-            n_lines_file = len(file_lines)
+            self._validate_view_range_type(view_range)
             init_line, final_line = view_range
-            if init_line < 1 or init_line > n_lines_file:
-                raise ToolError(
-                    f"Invalid `view_range`: {view_range}. Its first element `{init_line}` should be within the range of lines of the file: {[1, n_lines_file]}"
-                )
-            if final_line > n_lines_file:
-                raise ToolError(
-                    f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be smaller than the number of lines in the file: `{n_lines_file}`"
-                )
-            if final_line != -1 and final_line < init_line:
-                raise ToolError(
-                    f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be larger or equal than its first `{init_line}`"
-                )
-
-            if final_line == -1:
-                file_content = "\n".join(file_lines[init_line - 1 :])
-            else:
-                file_content = "\n".join(file_lines[init_line - 1 : final_line])
+            offsets = _line_offsets(file_content, init_line, final_line)
+            if offsets is None:
+                # only count the lines to explain what's wrong with the range
+                self._validate_view_range(view_range, file_content.count("\n") + 1)
+                raise ToolError(f"Invalid `view_range`: {view_range}.")
+            start, end = offsets
+            file_content = file_content[start:end]
 
         return CLIResult(
             output=self._make_output(file_content, str(path), init_line=init_line)
         )
 
+    def _view_indexed(self, path: Path, view_range: list[int]) -> str:
+        """View a range of a large file, reading only that range."""
+        self._validate_view_range_type(view_range)
+        init_line, final_line = view_range
+        try:
+            index = self._file_cache.line_index(path)
+            if index.has_line(init_line) and (
+                final_line == -1 or index.has_line(final_line)
+            ):
+                # the lines exist, so a lower bound for the count will do
+                n_lines_file = max(init_line, final_line)
+            else:
+                n_lines_file = index.line_count()
+            self._validate_view_range(view_range, n_lines_file)
+            file_content = index.read_lines(init_line, final_line)
+        except (OSError, UnicodeDecodeError) as e:
+            raise ToolError(f"Ran into {e} while trying to read {path}") from None
+        return self._make_output(file_content, str(path), init_line=init_line)
+
+    def _validate_view_range_type(self, view_range: list[int]):
+        if len(view_range) != 2 or not all(isinstance(i, int) for i in view_range):
+            raise ToolError(
+                "Invalid `view_range`. It should be a list of two integers."
+            )
+
+    def _validate_view_range(self, view_range: list[int], n_lines_file: int):
+        self._validate_view_range_type(view_range)
+        init_line, final_line = view_range
+        if init_line < 1 or init_line > n_lines_file:
+            raise ToolError(
+                f"Invalid `view_range`: {view_range}. Its first element `{init_line}` should be within the range of lines of the file: {[1, n_lines_file]}"
+            )
+        if final_line > n_lines_file:
+            raise ToolError(
+                f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be smaller than the number of lines in the file: `{n_lines_file}`"
+            )
+        if final_line != -1 and final_line < init_line:
+            raise ToolError(
+                f"Invalid `view_range`: {view_range}. Its second element `{final_line}` should be larger or equal than its first `{init_line}`"
+            )
+
     def str_replace(self, path: Path, old_str: str, new_str: str | None):
         """Implement the str_replace command, which replaces old_str with new_str in the file content"""
         # Read the file content
-        file_content = self.read_file(path).expandtabs()
+        file_content = self._read(path, expand_tabs=True)
         old_str = old_str.expandtabs()
         new_str = new_str.expandtabs() if new_str is not None else ""
 
         # Check if old_str is unique in the file
-        occurrences = file_content.count(old_str)
-        if occurrences == 0:
+        start = file_content.find(old_str)
+        if start == -1:
             raise ToolError(
                 f"No replacement was performed, old_str `{old_str}` did not appear verbatim in {path}."
             )
-        elif occurrences > 1:
-            file_content_lines = file_content.split("\n")
-            lines = [
-                idx + 1
-                for idx, line in enumerate(file_content_lines)
-                if old_str in line
-            ]
+        end = start + len(old_str)
+        if file_content.find(old_str, max(end, start + 1)) != -1:
+            lines = self._occurrence_lines(file_content, old_str)
             raise ToolError(
                 f"No replacement was performed. Multiple occurrences of old_str `{old_str}` in lines {lines}. Please ensure it is unique"
             )
 
-        # Replace old_str with new_str
-        new_file_content = file_content.replace(old_str, new_str)
-
-        # Write the new content to the file
-        self.write_file(path, new_file_content)
+        # Write the file with old_str replaced by new_str
+        self._write_edit(
+            path,
+            chain(
+                _slices(file_content, 0, start),
+                [new_str],
+                _slices(file_content, end, len(file_content)),
+            ),
+            len(file_content) - len(old_str) + len(new_str),
+        )
 
         # Save the content to history
-        self._file_history[path].append(file_content)
-
-        # Create a snippet of the edited section
-        replacement_line = file_content.split(old_str)[0].count("\n")
-        start_line = max(0, replacement_line - SNIPPET_LINES)
-        end_line = replacement_line + SNIPPET_LINES + new_str.count("\n")
-        snippet = "\n".join(new_file_content.split("\n")[start_line : end_line + 1])
+        self._file_history.push(path, file_content)
+
+        # Create a snippet of the edited section from the lines around it
+        start_line = max(0, file_content.count("\n", 0, start) - SNIPPET_LINES)
+        snippet = (
+            file_content[_line_start(file_content, start, SNIPPET_LINES) : start]
+            + new_str
+            + file_content[end : _line_end(file_content, end, SNIPPET_LINES)]
+        )
 
         # Prepare the success message
         success_msg = f"The file {path} has been edited. "
@@ -201,35 +289,66 @@ class EditTool(BaseAnthropicTool):
 
         return CLIResult(output=success_msg)
 
+    def _occurrence_lines(self, file_content: str, old_str: str) -> list[int]:
+        """The lines on which occurrences of old_str start."""
+        lines: list[int] = []
+        line, counted = 1, 0
+        position = file_content.find(old_str)
+        while position != -1:
+            line += file_content.count("\n", counted, position)
+            counted = position
+            if not lines or lines[-1] != line:
+                lines.append(line)
+            position = file_content.find(
+                old_str, max(position + len(old_str), position + 1)
+            )
+        return lines
+
     def insert(self, path: Path, insert_line: int, new_str: str):
         """Implement the insert command, which inserts new_str at the specified line in the file content."""
-        file_text = self.read_file(path).expandtabs()
+        file_text = self._read(path, expand_tabs=True)
         new_str = new_str.expandtabs()
-        file_text_lines = file_text.split("\n")
-        n_lines_file = len(file_text_lines)
+        n_lines_file = file_text.count("\n") + 1
 
         if insert_line < 0 or insert_line > n_lines_file:
             raise ToolError(
                 f"Invalid `insert_line` parameter: {insert_line}. It should be within the range of lines of the file: {[0, n_lines_file]}"
             )
 
-        new_str_lines = new_str.split("\n")
-        new_file_text_lines = (
-            file_text_lines[:insert_line]
-            + new_str_lines
-            + file_text_lines[insert_line:]
-        )
-        snippet_lines = (
-            file_text_lines[max(0, insert_line - SNIPPET_LINES) : insert_line]
-            + new_str_lines
-            + file_text_lines[insert_line : insert_line + SNIPPET_LINES]
-        )
-
-        new_file_text = "\n".join(new_file_text_lines)
-        snippet = "\n".join(snippet_lines)
+        # new_str goes on its own lines, after line `insert_line`
+        size = len(file_text)
+        if insert_line == 0:
+            parts = chain([new_str, "\n"], _slices(file_text, 0, size))
+            snippet = (
+                new_str + "\n" + file_text[: _line_end(file_text, 0, SNIPPET_LINES - 1)]
+            )
+        elif insert_line == n_lines_file:
+            parts = chain(_slices(file_text, 0, size), ["\n", new_str])
+            snippet = (
+                file_text[_line_start(file_text, size, SNIPPET_LINES - 1) :]
+                + "\n"
+                + new_str
+            )
+        else:
+            newline = _nth_newline(file_text, insert_line)
+            parts = chain(
+                _slices(file_text, 0, newline + 1),
+                [new_str, "\n"],
+                _slices(file_text, newline + 1, size),
+            )
+            snippet = (
+                file_text[
+                    _line_start(file_text, newline, SNIPPET_LINES - 1) : newline + 1
+                ]
+                + new_str
+                + "\n"
+                + file_text[
+                    newline + 1 : _line_end(file_text, newline + 1, SNIPPET_LINES - 1)
+                ]
+            )
 
-        self.write_file(path, new_file_text)
-        self._file_history[path].append(file_text)
+        self._write_edit(path, parts, size + len(new_str) + 1)
+        self._file_history.push(path, file_text)
 
         success_msg = f"The file {path} has been edited. "
         success_msg += self._make_output(
@@ -240,25 +359,189 @@ class EditTool(BaseAnthropicTool):
         success_msg += "Review the changes and make sure they are as expected (correct indentation, no duplicate lines, etc). Edit the file again if necessary."
         return CLIResult(output=success_msg)
 
+    def multi_edit(self, path: Path, edits: list[dict[str, Any]]):
+        """
+        Implement the multi_edit command, which makes several `str_replace` and
+        `insert` edits at once. Every edit refers to the files as they were before the
+        command and is checked before any file is written. Each file is then written
+        once and gets one entry in the undo history.
+        """
+        # by resolved path, so edits that name one file differently share its text
+        planned: dict[Path, tuple[Path, str, list[_Splice]]] = {}
+        for number, edit in enumerate(edits, 1):
+            if not isinstance(edit, dict):
+                raise ToolError(
+                    f"No edits were performed. Edit {number} should be an object with `old_str` and `new_str`, or `insert_line` and `new_str`."
+                )
+            edit_path = Path(edit["path"]) if edit.get("path") else path
+            self.validate_path("multi_edit", edit_path)
+            if (key := edit_path.resolve()) not in planned:
+                planned[key] = edit_path, self._read(edit_path, expand_tabs=True), []
+            edit_path, file_content, splices = planned[key]
+            splices.append(self._locate(edit_path, file_content, edit, number))
+
+        for edit_path, _, splices in planned.values():
+            # inserts at the same place stay in the order they were given
+            splices.sort(key=lambda splice: (splice.start, splice.end))
+            for before, after in zip(splices, splices[1:], strict=False):
+                if after.start < before.end:
+                    raise ToolError(
+                        f"No edits were performed. Edits {before.number} and {after.number} overlap in {edit_path}."
+                    )
+
+        touched: list[tuple[Path, str]] = []
+        try:
+            for edit_path, file_content, splices in planned.values():
+                # before writing, as a failed write can leave the file half done
+                touched.append((edit_path, file_content))
+                self._write_edit(
+                    edit_path,
+                    _spliced(file_content, splices),
+                    len(file_content) + sum(splice.added_chars for splice in splices),
+                )
+        except ToolError as e:
+            # leave no file half done; each restore is tried even if another fails
+            unrestored = []
+            for edit_path, file_content in touched:
+                self._file_cache.discard(edit_path)
+                try:
+                    self.write_file(edit_path, file_content)
+                except ToolError:
+                    unrestored.append(str(edit_path))
+            if unrestored:
+                raise ToolError(
+                    f"{e.message} Restoring the files written before it also failed, so these may be partly edited: {', '.join(unrestored)}"
+                ) from None
+            raise
+        for edit_path, file_content, _ in planned.values():
+            self._file_history.push(edit_path, file_content)
+
+        success_msg = ""
+        for edit_path, file_content, splices in planned.values():
+            success_msg += f"The file {edit_path} has been edited. "
+            success_msg += self._make_snippets(edit_path, file_content, splices)
+        success_msg += "Review the changes and make sure they are as expected. Edit the file again if necessary."
+        return CLIResult(output=success_msg)
+
+    def _locate(
+        self, path: Path, file_content: str, edit: dict[str, Any], number: int
+    ) -> _Splice:
+        """Where one edit of a `multi_edit` goes in `file_content`."""
+        new_str = edit.get("new_str")
+        if edit.get("old_str") is not None:
+            old_str = str(edit["old_str"]).expandtabs()
+            new_str = str(new_str).expandtabs() if new_str is not None else ""
+            start = file_content.find(old_str)
+            if start == -1:
+                raise ToolError(
+                    f"No edits were performed. In edit {number}, old_str `{old_str}` did not appear verbatim in {path}."
+                )
+            end = start + len(old_str)
+            if file_content.find(old_str, max(end, start + 1)) != -1:
+                lines = self._occurrence_lines(file_content, old_str)
+                raise ToolError(
+                    f"No edits were performed. In edit {number}, multiple occurrences of old_str `{old_str}` in lines {lines}. Please ensure it is unique"
+                )
+            return _Splice(start, end, new_str, number)
+
+        insert_line = edit.get("insert_line")
+        if not isinstance(insert_line, int) or new_str is None:
+            raise ToolError(
+                f"No edits were performed. Edit {number} should have `old_str` and `new_str`, or `insert_line` and `new_str`."
+            )
+        new_str = str(new_str).expandtabs()
+        n_lines_file = file_content.count("\n") + 1
+        if insert_line < 0 or insert_line > n_lines_file:
+            raise ToolError(
+                f"No edits were performed. Invalid `insert_line` in edit {number}: {insert_line}. It should be within the range of lines of {path}: {[0, n_lines_file]}"
+            )
+        # like `insert`, new_str goes on its own lines, after line `insert_line`
+        if insert_line == 0:
+            return _Splice(0, 0, new_str + "\n", number)
+        if insert_line == n_lines_file:
+            size = len(file_content)
+            return _Splice(size, size, "\n" + new_str, number)
+        position = _nth_newline(file_content, insert_line) + 1
+        return _Splice(position, position, new_str + "\n", number)
+
+    def _make_snippets(
+        self, path: Path, file_content: str, splices: list[_Splice]
+    ) -> str:
+        """Snippets of the edited file around sorted `splices`, merged where they meet."""
+        windows: list[tuple[int, int, list[_Splice]]] = []
+        for splice in splices:
+            start = _line_start(file_content, splice.start, SNIPPET_LINES)
+            end = _line_end(file_content, splice.end, SNIPPET_LINES)
+            if windows and start <= windows[-1][1]:
+                previous_start, previous_end, merged = windows[-1]
+                merged.append(splice)
+                windows[-1] = (previous_start, max(end, previous_end), merged)
+            else:
+                windows.append((start, end, [splice]))
+
+        output = ""
+        line, counted = 1, 0  # the line of the original at `counted`
+        shift = 0  # lines added by the splices before `counted`
+        for start, end, merged in windows:
+            line += file_content.count("\n", counted, start)
+            counted = start
+            first_line = line + shift
+            pieces, position = [], start
+            for splice in merged:
+                pieces += [file_content[position : splice.start], splice.text]
+                shift += splice.text.count("\n") - file_content.count(
+                    "\n", splice.start, splice.end
+                )
+                position = splice.end
+            pieces.append(file_content[position:end])
+            output += self._make_output(
+                "".join(pieces), f"a snippet of {path}", first_line
+            )
+        return output
+
     def undo_edit(self, path: Path):
         """Implement the undo_edit command."""
-        if not self._file_history[path]:
+        old_text = self._file_history.pop(path)
+        if old_text is None:
             raise ToolError(f"No edit history found for {path}.")
-
-        old_text = self._file_history[path].pop()
         self.write_file(path, old_text)
+        self._file_cache.update(path, old_text)
 
         return CLIResult(
             output=f"Last edit to {path} undone successfully. {self._make_output(old_text, str(path))}"
         )
 
+    def _file_size(self, path: Path) -> int:
+        try:
+            return path.stat().st_size
+        except OSError:
+            return 0
+
+    def _read(self, path: Path, expand_tabs: bool = False) -> str:
+        """The content of a file, from the file cache if it hasn't changed."""
+        return self._file_cache.read(path, self.read_file, expand_tabs=expand_tabs)
+
     def read_file(self, path: Path):
         """Read the content of a file from a given path; raise a ToolError if an error occurs."""
         try:
+            if self._file_size(path) >= MAPPED_READ_MIN_BYTES:
+                return self._read_mapped(path)
             return path.read_text()
         except Exception as e:
             raise ToolError(f"Ran into {e} while trying to read {path}") from None
 
+    def _read_mapped(self, path: Path) -> str:
+        """Like `read_text`, but decoded straight from a memory map, without a copy of the bytes."""
+        with path.open("rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mm:
+            with memoryview(mm) as data:
+                text = str(data, locale.getpreferredencoding(False))
+        if "\r" in text:
+            # universal newlines, as in text mode
+            text = text.replace("\r\n", "\n").replace("\r", "\n")
+        return text
+
     def write_file(self, path: Path, file: str):
         """Write the content of a file to a given path; raise a ToolError if an error occurs."""
         try:
@@ -266,6 +549,45 @@ class EditTool(BaseAnthropicTool):
         except Exception as e:
             raise ToolError(f"Ran into {e} while trying to write to {path}") from None
 
+    def _write_edit(self, path: Path, parts: Iterable[str], length: int):
+        """Write an edit's new content, of `length` characters, and cache it if it fits."""
+        streamed = length >= STREAMED_WRITE_MIN_CHARS
+        if not self._file_cache.fits(length):
+            self._file_cache.discard(path)
+            self._write_parts(path, parts, streamed)
+            return
+        content = "".join(parts)
+        self._write_parts(path, [content], streamed)
+        self._file_cache.update(path, content)
+
+    def _write_parts(self, path: Path, parts: Iterable[str], streamed: bool = False):
+        """
+        Write the concatenation of `parts` to a file. If `streamed`, the parts are
+        written one by one to a temporary file that then replaces the original, so
+        the new content is never held in memory at once and a failed write leaves
+        the file as it was.
+        """
+        if not streamed:
+            self.write_file(path, "".join(parts))
+            return
+        target = path.resolve()
+        try:
+            fd, temp = tempfile.mkstemp(
+                dir=target.parent, prefix=f".{target.name}.", suffix=".tmp"
+            )
+            try:
+                with os.fdopen(fd, "w") as f:
+                    for part in parts:
+                        f.write(part)
+                shutil.copymode(target, temp)
+                os.replace(temp, target)
+            except BaseException:
+                with contextlib.suppress(OSError):
+                    os.unlink(temp)
+                raise
+        except Exception as e:
+            raise ToolError(f"Ran into {e} while trying to write to {path}") from None
+
     def _make_output(
         self,
         file_content: str,
@@ -288,3 +610,84 @@ class EditTool(BaseAnthropicTool):
             + file_content
             + "\n"
         )
+
+
+def _slices(text: str, start: int, end: int) -> Iterator[str]:
+    """`text[start:end]` in pieces of at most WRITE_CHUNK_CHARS."""
+    for position in range(start, end, WRITE_CHUNK_CHARS):
+        yield text[position : min(position + WRITE_CHUNK_CHARS, end)]
+
+
+def _spliced(text: str, splices: list[_Splice]) -> Iterator[str]:
+    """`text` with sorted, non-overlapping `splices` applied, in pieces."""
+    position = 0
+    for splice in splices:
+        yield from _slices(text, position, splice.start)
+        yield splice.text
+        position = splice.end
+    yield from _slices(text, position, len(text))
+
+
+def _line_start(text: str, position: int, lines_before: int) -> int:
+    """The start of the line `lines_before` lines above the one at `position`."""
+    for _ in range(lines_before + 1):
+        position = text.rfind("\n", 0, position)
+        if position == -1:
+            return 0
+    return position + 1
+
+
+def _line_end(text: str, position: int, lines_after: int) -> int:
+    """The end, before its newline, of the line `lines_after` lines below the one at `position`."""
+    position -= 1
+    for _ in range(lines_after + 1):
+        position = text.find("\n", position + 1)
+        if position == -1:
+            return len(text)
+    return position
+
+
+def _nth_newline(text: str, n: int, start: int = 0) -> int:
+    """The offset of the `n`th newline in `text[start:]`, counting from 1, or -1."""
+    position = start
+    chunk = NEWLINE_SEARCH_CHARS
+    # counting is much faster than finding each newline, so narrow down the chunk
+    # holding the newline by counting, halving it until a few finds will do
+    while chunk > 256:
+        count = text.count("\n", position, position + chunk)
+        if count >= n:
+            chunk //= 2
+        elif position + chunk >= len(text):
+            return -1
+        else:
+            n -= count
+            position += chunk
+    position -= 1
+    for _ in range(n):
+        position = text.find("\n", position + 1)
+        if position == -1:
+            return -1
+    return position
+
+
+def _line_offsets(text: str, init_line: int, final_line: int) -> tuple[int, int] | None:
+    """
+    The start and end of lines `init_line` to `final_line` (or the last line if -1)
+    in `text`, or None if the range isn't valid for it.
+    """
+    if init_line < 1 or (final_line != -1 and final_line < init_line):
+        return None
+    start = 0
+    if init_line > 1:
+        start = _nth_newline(text, init_line - 1) + 1
+        if not start:
+            return None
+    if final_line == -1:
+        return start, len(text)
+    end = _nth_newline(text, final_line - init_line + 1, start)
+    if end == -1:
+        # fine if `final_line` is the last line
+        if text.count("\n", start) < final_line - init_line:
+            return None
+        end = len(text)
+    return start, end
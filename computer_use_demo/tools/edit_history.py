@@ -0,0 +1,220 @@
+"""
+Undo history for `EditTool`, bounded in memory.
+
+Every edit saves the file's previous content. Only the most recent saved content of
+each file is kept in full. Older ones are kept as reverse splices, each turning
+the content saved after it back into the content saved before. Edits usually
+change a small part of a file, so a long history of a large file costs little more
+than one copy of it.
+
+`FileHistory` holds the histories of all files, up to about `max_bytes`. When it
+holds more, it makes room starting with the least recently edited file. It spills
+that file's full copy to `spill_dir` if one is set. If that's not enough, it drops
+the oldest splices, and then the whole history of that file. The most recent edit of the
+file being edited can always be undone. Spilled files are removed when they are
+no longer needed, and by `clear`.
+"""
+
+import contextlib
+import os
+import sys
+import tempfile
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+COMPARE_CHUNK_CHARS = 64 * 1024
+
+
+@dataclass
+class Splice:
+    """Turns a text into an older one by replacing `[start:end]` with `text`."""
+
+    start: int
+    end: int
+    text: str
+
+    @classmethod
+    def between(cls, newer: str, older: str) -> "Splice":
+        prefix = _common_prefix(newer, older)
+        suffix = _common_suffix(newer, older, min(len(newer), len(older)) - prefix)
+        return cls(prefix, len(newer) - suffix, older[prefix : len(older) - suffix])
+
+    def apply(self, newer: str) -> str:
+        return newer[: self.start] + self.text + newer[self.end :]
+
+    @property
+    def size(self) -> int:
+        return sys.getsizeof(self.text)
+
+
+@dataclass
+class _History:
+    """Saved contents of one file: the latest in full, older ones as splices."""
+
+    latest: str | None = None
+    spilled: Path | None = None
+    splices: list[Splice] = field(default_factory=list)  # newest last
+
+    @property
+    def size(self) -> int:
+        latest = sys.getsizeof(self.latest) if self.latest is not None else 0
+        return latest + sum(splice.size for splice in self.splices)
+
+    def __len__(self) -> int:
+        has_latest = self.latest is not None or self.spilled is not None
+        return has_latest + len(self.splices)
+
+    def load_latest(self) -> str:
+        if self.latest is not None:
+            return self.latest
+        assert self.spilled is not None
+        with self.spilled.open(
+            encoding="utf-8", errors="surrogatepass", newline=""
+        ) as f:
+            return f.read()
+
+    def spill(self, directory: Path) -> None:
+        assert self.latest is not None
+        fd, name = tempfile.mkstemp(dir=directory, prefix="edit-history-")
+        with os.fdopen(
+            fd, "w", encoding="utf-8", errors="surrogatepass", newline=""
+        ) as f:
+            f.write(self.latest)
+        self.spilled, self.latest = Path(name), None
+
+    def forget_spilled(self) -> None:
+        if self.spilled is not None:
+            self.spilled.unlink(missing_ok=True)
+            self.spilled = None
+
+
+class FileHistory:
+    """The saved contents of edited files, newest last for each file."""
+
+    def __init__(
+        self, max_bytes: int = DEFAULT_MAX_BYTES, spill_dir: Path | str | None = None
+    ):
+        self.max_bytes = max_bytes
+        self.spill_dir = Path(spill_dir) if spill_dir is not None else None
+        self._histories: OrderedDict[Path, _History] = OrderedDict()
+        self._bytes = 0
+
+    @property
+    def memory_bytes(self) -> int:
+        """Approximately how much memory the saved contents take."""
+        return self._bytes
+
+    def __contains__(self, path: Path) -> bool:
+        return path in self._histories
+
+    def __getitem__(self, path: Path) -> list[str]:
+        """Every saved content of `path` in full, oldest first."""
+        history = self._histories.get(path)
+        if history is None:
+            return []
+        texts = [history.load_latest()]
+        for splice in reversed(history.splices):
+            texts.append(splice.apply(texts[-1]))
+        return texts[::-1]
+
+    def push(self, path: Path, text: str) -> None:
+        """Save `text` as the latest content of `path`."""
+        history = self._histories.setdefault(path, _History())
+        self._histories.move_to_end(path)
+        self._bytes -= history.size
+        if len(history):
+            history.splices.append(Splice.between(text, history.load_latest()))
+            history.forget_spilled()
+        history.latest = text
+        self._bytes += history.size
+        self._make_room()
+
+    def pop(self, path: Path) -> str | None:
+        """Remove and return the latest saved content of `path`, if there is one."""
+        history = self._histories.get(path)
+        if history is None:
+            return None
+        self._bytes -= history.size
+        text = history.load_latest()
+        history.forget_spilled()
+        if history.splices:
+            history.latest = history.splices.pop().apply(text)
+            self._bytes += history.size
+            self._histories.move_to_end(path)
+            self._make_room()
+        else:
+            del self._histories[path]
+        return text
+
+    def clear(self) -> None:
+        for history in self._histories.values():
+            history.forget_spilled()
+        self._histories.clear()
+        self._bytes = 0
+
+    def _make_room(self) -> None:
+        newest = next(reversed(self._histories), None)
+        for path, history in list(self._histories.items()):
+            if self._bytes <= self.max_bytes:
+                return
+            self._bytes -= history.size
+            if self.spill_dir is not None and history.latest is not None:
+                history.spill(self.spill_dir)
+            while history.splices and self._bytes + history.size > self.max_bytes:
+                history.splices.pop(0)
+            if (
+                path != newest
+                and history.size
+                and self._bytes + history.size > self.max_bytes
+            ):
+                history.forget_spilled()
+                del self._histories[path]
+            else:
+                self._bytes += history.size
+
+    def __del__(self) -> None:
+        # spilled files are temporary; this may run at interpreter exit
+        with contextlib.suppress(Exception):
+            self.clear()
+
+
+def _common_prefix(a: str, b: str) -> int:
+    """The length of the longest common prefix, compared a chunk at a time."""
+    limit = min(len(a), len(b))
+    low = 0
+    while low < limit:
+        high = min(low + COMPARE_CHUNK_CHARS, limit)
+        if a[low:high] != b[low:high]:
+            # a[:low] == b[:low] and a[low:high] != b[low:high]
+            while high - low > 1:
+                middle = (low + high) // 2
+                if a[low:middle] == b[low:middle]:
+                    low = middle
+                else:
+                    high = middle
+            return low
+        low = high
+    return limit
+
+
+def _common_suffix(a: str, b: str, limit: int) -> int:
+    """The length of the longest common suffix, up to `limit`."""
+    low = 0
+    while low < limit:
+        high = min(low + COMPARE_CHUNK_CHARS, limit)
+        if a[len(a) - high : len(a) - low] != b[len(b) - high : len(b) - low]:
+            # the suffixes of length low are equal, those of length high aren't
+            while high - low > 1:
+                middle = (low + high) // 2
+                if (
+                    a[len(a) - middle : len(a) - low]
+                    == b[len(b) - middle : len(b) - low]
+                ):
+                    low = middle
+                else:
+                    high = middle
+            return low
+        low = high
+    return limit
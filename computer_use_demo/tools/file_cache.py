@@ -0,0 +1,165 @@
+"""
+Decoded file contents shared by the commands of one `EditTool`.
+
+A `view` followed by a `str_replace` and another `view` would otherwise read and
+decode the file three times, and expand its tabs twice. `FileCache` keeps the text
+of recently used files, their tab-expanded text and their line index. An entry is
+only used while the file's mtime, size and inode are unchanged, so edits made by
+other processes are always seen. After the tool writes a file itself, the cache
+takes the written text instead of reading it back.
+
+The cache holds up to about `max_bytes`, evicting the least recently used files.
+Files larger than `max_entry_bytes` aren't cached, except for their line index.
+"""
+
+import os
+import sys
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+from .. import metrics
+from .line_index import LineIndex
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_ENTRY_BYTES = 16 * 1024 * 1024
+
+FileKey = tuple[int, int, int]
+
+
+def _key(stat: os.stat_result) -> FileKey:
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+@dataclass
+class _Entry:
+    key: FileKey
+    text: str | None = None
+    expanded: str | None = None
+    line_index: LineIndex | None = None
+
+    @property
+    def size(self) -> int:
+        size = sys.getsizeof(self.text) if self.text is not None else 0
+        if self.expanded is not None and self.expanded is not self.text:
+            size += sys.getsizeof(self.expanded)
+        if self.line_index is not None:
+            size += self.line_index.memory_bytes
+        return size
+
+
+class FileCache:
+    """Recently used file contents, valid while the file is unchanged."""
+
+    def __init__(
+        self,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        max_entry_bytes: int = DEFAULT_MAX_ENTRY_BYTES,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Path, _Entry] = OrderedDict()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(entry.size for entry in self._entries.values())
+
+    def fits(self, length: int) -> bool:
+        """Whether a text of `length` characters would be cached."""
+        return length <= self.max_entry_bytes
+
+    def _record(self, hit: bool) -> None:
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        metrics.FILE_CACHE_LOOKUPS.inc(result="hit" if hit else "miss")
+
+    def _entry(self, path: Path, stat: os.stat_result) -> _Entry:
+        """The entry for the file as it is now, fresh if it changed."""
+        entry = self._entries.get(path)
+        if entry is None or entry.key != _key(stat):
+            entry = _Entry(_key(stat))
+        return entry
+
+    def has_text(self, path: Path) -> bool:
+        """Whether the current text of `path` is cached."""
+        try:
+            stat = path.stat()
+        except OSError:
+            return False
+        entry = self._entries.get(path)
+        return entry is not None and entry.key == _key(stat) and entry.text is not None
+
+    def read(
+        self, path: Path, load: Callable[[Path], str], expand_tabs: bool = False
+    ) -> str:
+        """The text of `path`, loaded with `load` unless it's cached."""
+        try:
+            stat = path.stat()
+        except OSError:
+            # let `load` report it
+            text = load(path)
+            return text.expandtabs() if expand_tabs else text
+        entry = self._entry(path, stat)
+        self._record(entry.text is not None)
+        if entry.text is None:
+            entry.text = load(path)
+        if expand_tabs and entry.expanded is None:
+            # finding a tab is much faster than expandtabs finding none
+            has_tabs = "\t" in entry.text
+            entry.expanded = entry.text.expandtabs() if has_tabs else entry.text
+        text = entry.expanded if expand_tabs else entry.text
+        assert text is not None
+        if not self.fits(len(entry.text)):
+            entry.text = entry.expanded = None
+            if entry.line_index is None:
+                self.discard(path)
+                return text
+        self._store(path, entry)
+        return text
+
+    def line_index(self, path: Path) -> LineIndex:
+        """The line index of `path`, made afresh if the file changed."""
+        stat = path.stat()
+        entry = self._entry(path, stat)
+        self._record(entry.line_index is not None)
+        if entry.line_index is None:
+            entry.line_index = LineIndex(path, stat)
+        self._store(path, entry)
+        return entry.line_index
+
+    def update(self, path: Path, text: str) -> None:
+        """`text` was just written to `path`; cache it without reading it back."""
+        if not self.fits(len(text)) or "\r" in text:
+            # too large, or reading it back would translate its line endings
+            self.discard(path)
+            return
+        try:
+            stat = path.stat()
+        except OSError:
+            self.discard(path)
+            return
+        self._store(path, _Entry(_key(stat), text))
+
+    def discard(self, path: Path) -> None:
+        self._entries.pop(path, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def _store(self, path: Path, entry: _Entry) -> None:
+        self._entries[path] = entry
+        self._entries.move_to_end(path)
+        size = self.memory_bytes
+        while size > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            size -= evicted.size
@@ -0,0 +1,236 @@
+"""
+Commands run without a shell by a long-lived helper process.
+
+Every `run` starts `/bin/sh`, which then starts the command, and asyncio sets up
+a child watcher and pipe transports for each one. That cost is paid on every
+xdotool action. A `ForkServer` starts `forkserver_helper.py` once. That is a small
+Python process with a copy of the environment, which is reused for every command.
+Argv-style commands are sent to it over a pipe. It spawns them directly, and
+sends back their return code and output. Commands can run concurrently, from any
+thread or event loop. `benchmarks/spawn_bench.py` measures the difference.
+
+`split_command` turns a simple shell command, like the ones `ComputerTool`
+builds, into its environment assignments and argv. Commands that need a shell
+still go through `run`.
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import re
+import shlex
+import subprocess
+import sys
+import threading
+from collections.abc import Mapping, Sequence
+from pathlib import Path
+from typing import Any
+
+from .run import MAX_RESPONSE_LEN, maybe_truncate
+
+HELPER = Path(__file__).with_name("forkserver_helper.py")
+
+# quoted strings without substitutions, which `shlex.split` reads like a shell
+_QUOTED = re.compile(r"""'[^']*'|"[^"$`\\]*\"""")
+# anything else but these characters may need a shell
+_NEEDS_SHELL = re.compile(r"[^\w \t!%+,\-./:=@^]")
+_ASSIGNMENT = re.compile(r"[A-Za-z_]\w*=")
+
+
+def split_command(command: str) -> tuple[dict[str, str], list[str]] | None:
+    """
+    The leading `NAME=value` assignments of a shell command, and its argv, or None
+    if it uses anything else a shell would interpret, such as pipes or `$`.
+    """
+    if _NEEDS_SHELL.search(_QUOTED.sub("", command)):
+        return None
+    words = shlex.split(command)
+    env = {}
+    while words and _ASSIGNMENT.match(words[0]):
+        name, _, value = words.pop(0).partition("=")
+        env[name] = value
+    if not words or words[0] == "!":
+        return None
+    return env, words
+
+
+class ForkServer:
+    """
+    A helper process that runs commands for this one, started on first use:
+
+        returncode, stdout, stderr = await server.run(["xdotool", "key", "Return"])
+
+    If the helper exits, the commands it was running fail with ConnectionError, and
+    the next command starts a new one.
+    """
+
+    def __init__(self, env: Mapping[str, str] | None = None):
+        self.env = dict(os.environ if env is None else env)
+        self._process: subprocess.Popen | None = None
+        self._pid = 0  # of the process that started the helper
+        # of the current helper, by request id
+        self._pending: dict[int, tuple[asyncio.AbstractEventLoop, asyncio.Future]] = {}
+        self._ids = itertools.count()
+        # for starting the helper and writing to it
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return (
+            self._process is not None
+            and self._process.poll() is None
+            # a forked copy of this object can't share the helper
+            and self._pid == os.getpid()
+        )
+
+    def start(self) -> None:
+        """Start the helper now, e.g. to have it warm for the first command."""
+        with self._lock:
+            self._start()
+
+    def _start(self) -> None:
+        if self.running:
+            return
+        self._process = subprocess.Popen(
+            # isolated and without site-packages: it only needs the standard library
+            [sys.executable, "-I", "-S", str(HELPER)],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=self.env,
+            # not interrupted by a ^C meant for this process
+            start_new_session=True,
+        )
+        self._pid = os.getpid()
+        self._pending = {}
+        threading.Thread(
+            target=self._read,
+            args=(self._process, self._pending),
+            name="forkserver-reader",
+            daemon=True,
+        ).start()
+
+    def close(self) -> None:
+        """Stop the helper, which kills the commands it is running."""
+        with self._lock:
+            if self.running:
+                assert self._process and self._process.stdin
+                self._process.stdin.close()
+            self._process = None
+
+    async def run(
+        self,
+        argv: Sequence[str],
+        env: Mapping[str, str] | None = None,
+        timeout: float | None = 120.0,  # seconds
+        truncate_after: int | None = MAX_RESPONSE_LEN,
+    ) -> tuple[int, str, str]:
+        """
+        Run `argv`, with `env` added to the environment, like `run` runs a shell
+        command: returns its return code and its stdout and stderr, each clipped to
+        `truncate_after` characters. A command that times out or is cancelled is
+        killed along with every process it started.
+        """
+        if not argv:
+            raise ValueError("argv can't be empty")
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        request_id = next(self._ids)
+        request = {
+            "id": request_id,
+            "argv": list(argv),
+            "env": dict(env or {}),
+            "timeout": timeout,
+            # enough UTF-8 for `truncate_after` characters
+            "max_bytes": 4 * (truncate_after + 1) if truncate_after else None,
+        }
+        with self._lock:
+            self._start()
+            pending = self._pending
+            pending[request_id] = loop, future
+            try:
+                self._send(request)
+            except OSError as e:
+                del pending[request_id]
+                raise ConnectionError("The fork server exited") from e
+        try:
+            response, stdout, stderr = await future
+        except asyncio.CancelledError:
+            if pending.pop(request_id, None):
+                self._kill(request_id)
+            raise
+        if response["timed_out"]:
+            raise TimeoutError(
+                f"Command '{shlex.join(argv)}' timed out after {timeout} seconds"
+            )
+        return (
+            response["returncode"],
+            maybe_truncate(stdout.decode(errors="replace"), truncate_after),
+            maybe_truncate(stderr.decode(errors="replace"), truncate_after),
+        )
+
+    def _send(self, message: dict[str, Any]) -> None:
+        assert self._process and self._process.stdin
+        self._process.stdin.write(json.dumps(message).encode() + b"\n")
+        self._process.stdin.flush()
+
+    def _kill(self, request_id: int) -> None:
+        with self._lock:
+            if self.running:
+                try:
+                    self._send({"kill": request_id})
+                except OSError:
+                    pass  # it exited, and took the command with it
+
+    def _read(
+        self,
+        process: subprocess.Popen,
+        pending: dict[int, tuple[asyncio.AbstractEventLoop, asyncio.Future]],
+    ) -> None:
+        """Hand the helper's responses to the commands waiting for them."""
+        assert process.stdout
+        try:
+            while header := process.stdout.readline():
+                response = json.loads(header)
+                stdout = process.stdout.read(response["stdout"])
+                stderr = process.stdout.read(response["stderr"])
+                waiting = pending.pop(response["id"], None)
+                if waiting is not None:
+                    _resolve(*waiting, result=(response, stdout, stderr))
+        finally:
+            process.stdout.close()
+            error = ConnectionError("The fork server exited")
+            while pending:
+                _, waiting = pending.popitem()
+                _resolve(*waiting, error=error)
+
+
+def _resolve(
+    loop: asyncio.AbstractEventLoop,
+    future: asyncio.Future,
+    result: Any = None,
+    error: BaseException | None = None,
+) -> None:
+    def resolve():
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    try:
+        loop.call_soon_threadsafe(resolve)
+    except RuntimeError:
+        pass  # its loop was closed
+
+
+_shared: ForkServer | None = None
+
+
+def shared() -> ForkServer:
+    """The fork server shared by all the tools of this process."""
+    global _shared
+    if _shared is None:
+        _shared = ForkServer()
+    return _shared
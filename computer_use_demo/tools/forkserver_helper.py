@@ -0,0 +1,241 @@
+"""
+The helper process of `forkserver.ForkServer`, run as a script.
+
+It reads one JSON request per line from stdin, and starts each command with
+`posix_spawn`, without a shell. One thread waits on everything at once: stdin,
+the commands' output pipes, their exits and their deadlines. When a command exits
+and its output is closed, the helper writes a JSON header line to stdout, followed
+by the command's stdout and stderr.
+
+It only imports the standard library, so it starts quickly and stays small. It
+exits when stdin is closed, killing the commands that are still running.
+"""
+
+import heapq
+import json
+import os
+import selectors
+import shutil
+import signal
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import BinaryIO
+
+READ_CHUNK_BYTES = 64 * 1024
+
+
+@dataclass
+class _Command:
+    id: int
+    pid: int
+    max_bytes: int | None
+    # output pipe -> what was kept of it
+    outputs: dict[int, bytearray]
+    open_pipes: set[int] = field(default_factory=set)
+    pidfd: int | None = None  # None once reaped, or if pidfds aren't supported
+    returncode: int | None = None
+    done: bool = False  # responded to, or killed
+
+
+class Helper:
+    def __init__(self, requests: BinaryIO, output: BinaryIO):
+        self.requests = requests.fileno()
+        self.output = output
+        self.env = dict(os.environ)
+        self.selector = selectors.DefaultSelector()
+        self.commands: dict[int, _Command] = {}
+        self.deadlines: list[tuple[float, int]] = []
+        self._buffer = b""
+
+    def serve(self) -> None:
+        os.set_blocking(self.requests, False)
+        self.selector.register(self.requests, selectors.EVENT_READ)
+        try:
+            while self._wait():
+                pass
+        finally:
+            for command in self.commands.values():
+                _killpg(command.pid)
+
+    def _wait(self) -> bool:
+        """Handle what's ready; False once stdin is closed."""
+        timeout = None
+        if self.deadlines:
+            timeout = max(0.0, self.deadlines[0][0] - time.monotonic())
+        for key, _ in self.selector.select(timeout):
+            if key.fd == self.requests:
+                if not self._read_requests():
+                    return False
+            elif self.selector.get_map().get(key.fd) is key:
+                # unless an earlier event closed it
+                key.data(key.fd)
+        now = time.monotonic()
+        while self.deadlines and self.deadlines[0][0] <= now:
+            _, request_id = heapq.heappop(self.deadlines)
+            command = self.commands.get(request_id)
+            if command is not None and not command.done:
+                self._stop(command)
+                self._respond(command, timed_out=True)
+        return True
+
+    def _read_requests(self) -> bool:
+        data = os.read(self.requests, READ_CHUNK_BYTES)
+        if not data:
+            return False
+        *lines, self._buffer = (self._buffer + data).split(b"\n")
+        for line in lines:
+            request = json.loads(line)
+            if "kill" in request:
+                command = self.commands.get(request["kill"])
+                if command is not None and not command.done:
+                    self._stop(command)
+            else:
+                self._spawn(request)
+        return True
+
+    def _spawn(self, request: dict) -> None:
+        argv = request["argv"]
+        env = {**self.env, **request["env"]}
+        # like a shell, look the program up in the command's own PATH
+        program = shutil.which(argv[0], path=env.get("PATH", os.defpath))
+        if program is None:
+            message = f"{argv[0]}: command not found\n".encode()
+            self._write(request["id"], 127, b"", message)
+            return
+        stdout_read, stdout_write = os.pipe2(os.O_CLOEXEC)
+        stderr_read, stderr_write = os.pipe2(os.O_CLOEXEC)
+        try:
+            pid = os.posix_spawn(
+                program,
+                argv,
+                env,
+                file_actions=[
+                    (os.POSIX_SPAWN_OPEN, 0, os.devnull, os.O_RDONLY, 0),
+                    (os.POSIX_SPAWN_DUP2, stdout_write, 1),
+                    (os.POSIX_SPAWN_DUP2, stderr_write, 2),
+                ],
+                # its own process group, so everything it starts can be killed
+                setsid=True,
+            )
+        except OSError as e:
+            os.close(stdout_read)
+            os.close(stderr_read)
+            message = f"{argv[0]}: {e.strerror}\n".encode()
+            self._write(request["id"], 126, b"", message)
+            return
+        finally:
+            os.close(stdout_write)
+            os.close(stderr_write)
+        command = _Command(
+            request["id"],
+            pid,
+            request["max_bytes"],
+            {stdout_read: bytearray(), stderr_read: bytearray()},
+            {stdout_read, stderr_read},
+        )
+        self.commands[command.id] = command
+        for pipe in command.outputs:
+            self.selector.register(
+                pipe, selectors.EVENT_READ, lambda fd, c=command: self._read(c, fd)
+            )
+        try:
+            command.pidfd = os.pidfd_open(pid)
+        except (AttributeError, OSError):
+            pass  # it's waited for once its output is closed
+        else:
+            self.selector.register(
+                command.pidfd, selectors.EVENT_READ, lambda _, c=command: self._reap(c)
+            )
+        if request["timeout"] is not None:
+            deadline = time.monotonic() + request["timeout"]
+            heapq.heappush(self.deadlines, (deadline, command.id))
+
+    def _read(self, command: _Command, pipe: int) -> None:
+        data = os.read(pipe, READ_CHUNK_BYTES)
+        if not data:
+            self._close(command, pipe)
+            self._maybe_finish(command)
+            return
+        buffer = command.outputs[pipe]
+        room = (
+            len(data) if command.max_bytes is None else command.max_bytes - len(buffer)
+        )
+        if room > 0:
+            buffer += data[:room]
+
+    def _close(self, command: _Command, pipe: int) -> None:
+        self.selector.unregister(pipe)
+        os.close(pipe)
+        command.open_pipes.remove(pipe)
+
+    def _reap(self, command: _Command) -> None:
+        if command.pidfd is not None:
+            self.selector.unregister(command.pidfd)
+            os.close(command.pidfd)
+            command.pidfd = None
+        _, status = os.waitpid(command.pid, 0)
+        command.returncode = os.waitstatus_to_exitcode(status)
+        self._maybe_finish(command)
+
+    def _maybe_finish(self, command: _Command) -> None:
+        if command.open_pipes:
+            return
+        if command.returncode is None:
+            if command.pidfd is not None:
+                return
+            # without a pidfd, it's waited for now, when it likely exited
+            self._reap(command)
+            return
+        del self.commands[command.id]
+        if not command.done:
+            self._respond(command)
+
+    def _stop(self, command: _Command) -> None:
+        """Kill a command and everything it started, and stop reading its output."""
+        _killpg(command.pid)
+        command.done = True
+        for pipe in list(command.open_pipes):
+            self._close(command, pipe)
+        self._maybe_finish(command)
+
+    def _respond(self, command: _Command, timed_out: bool = False) -> None:
+        command.done = True
+        stdout, stderr = command.outputs.values()
+        self._write(command.id, command.returncode, stdout, stderr, timed_out)
+
+    def _write(
+        self,
+        request_id: int,
+        returncode: int | None,
+        stdout: bytes,
+        stderr: bytes,
+        timed_out: bool = False,
+    ) -> None:
+        header = {
+            "id": request_id,
+            "returncode": returncode,
+            "timed_out": timed_out,
+            "stdout": len(stdout),
+            "stderr": len(stderr),
+        }
+        try:
+            self.output.write(json.dumps(header).encode() + b"\n" + stdout + stderr)
+            self.output.flush()
+        except BrokenPipeError:
+            pass  # the client is gone, and stdin is about to close
+
+
+def _killpg(pid: int) -> None:
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def main() -> None:
+    Helper(sys.stdin.buffer, sys.stdout.buffer).serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Line ranges of large files without reading the whole file.
+
+A `LineIndex` memory-maps a file and records the byte offset at which each line
+starts. Offsets are only found as far as a request needs them, so viewing lines
+10-20 of a 2 GB log scans a few hundred bytes, and a later view further down
+continues where the last one stopped. Only the requested range is decoded.
+
+An index is only valid while the file is unchanged; `EditTool` keeps them in its
+`FileCache`. Lines are split on "\\n", and "\\r\\n" line endings are read as "\\n".
+"""
+
+import mmap
+import os
+from array import array
+from collections.abc import Iterator
+from contextlib import contextmanager
+from functools import partial
+from itertools import accumulate, islice
+from operator import add
+from pathlib import Path
+
+from .run import MAX_RESPONSE_LEN
+
+SCAN_CHUNK_BYTES = 256 * 1024
+# enough UTF-8 for `maybe_truncate` to clip the decoded range the same way
+MAX_RANGE_BYTES = 4 * (MAX_RESPONSE_LEN + 1)
+
+
+class LineIndex:
+    """The start offsets of a file's lines, found as far as they have been needed."""
+
+    def __init__(self, path: Path, stat: os.stat_result):
+        self.path = path
+        self.size = stat.st_size
+        self._starts = array("Q", [0])
+        self._scanned = 0  # offsets before this have been indexed
+        self._line_count: int | None = None
+
+    @property
+    def memory_bytes(self) -> int:
+        return self._starts.itemsize * len(self._starts)
+
+    @contextmanager
+    def _map(self) -> Iterator[mmap.mmap | bytes]:
+        with self.path.open("rb") as f:
+            if not self.size:
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), self.size, access=mmap.ACCESS_READ) as mm:
+                yield mm
+
+    def _index_to(self, data: mmap.mmap | bytes, line: int) -> None:
+        """Find the start offsets up to `line`, a chunk at a time."""
+        starts = self._starts
+        while len(starts) < line and self._scanned < self.size:
+            chunk = data[self._scanned : self._scanned + SCAN_CHUNK_BYTES]
+            last_newline = chunk.rfind(b"\n")
+            if last_newline == -1:
+                # a line longer than a chunk, or the last line
+                newline = data.find(b"\n", self._scanned + len(chunk))
+                if newline == -1:
+                    self._scanned = self.size
+                    break
+                self._scanned = newline + 1
+                starts.append(self._scanned)
+                continue
+            # the start of every line after each newline in the chunk
+            lines = chunk[:last_newline].split(b"\n")
+            with_newline = map(partial(add, 1), map(len, lines))
+            ends = accumulate(with_newline, initial=self._scanned)
+            starts.extend(islice(ends, 1, None))
+            self._scanned += last_newline + 1
+        if self._scanned >= self.size:
+            self._line_count = len(starts)
+
+    def has_line(self, line: int) -> bool:
+        """Whether the file has a line number `line`, counting from 1."""
+        if line < 1:
+            return False
+        if line > len(self._starts) and self._line_count is None:
+            with self._map() as data:
+                self._index_to(data, line)
+        return line <= len(self._starts)
+
+    def line_count(self) -> int:
+        """The number of lines, like `len(text.split("\\n"))`."""
+        if self._line_count is None:
+            with self._map() as data:
+                self._index_to(data, self.size + 1)
+        assert self._line_count is not None
+        return self._line_count
+
+    def read_lines(self, first: int, last: int) -> str:
+        """
+        Lines `first` to `last` inclusive, or to the end of the file if `last` is -1,
+        which must exist. At most `MAX_RANGE_BYTES` are decoded.
+        """
+        with self._map() as data:
+            self._index_to(data, first if last == -1 else last + 1)
+            start = self._starts[first - 1]
+            at_newline = last != -1 and last < len(self._starts)
+            end = self._starts[last] - 1 if at_newline else self.size
+            if at_newline and end > start and data[end - 1] == ord("\r"):
+                end -= 1
+            if end - start > MAX_RANGE_BYTES:
+                end = start + MAX_RANGE_BYTES
+                # don't split a UTF-8 sequence
+                while end > start and data[end] & 0xC0 == 0x80:
+                    end -= 1
+            raw = data[start:end]
+        return raw.decode().replace("\r\n", "\n")
@@ -1,9 +1,27 @@
-"""Utility to run shell commands asynchronously with a timeout."""
+"""
+Utility to run shell commands asynchronously with a timeout.
+
+Output is read from the pipes as it comes, and only what will be shown is kept:
+`run` keeps the start of each stream, and optionally its end, and counts the bytes
+in between. A command printing gigabytes uses no more memory than one printing a
+screenful. `Command` gives callers that want live output the chunks as they
+arrive. Either way, a command that times out or is cancelled is killed along with
+every process it started.
+"""
 
 import asyncio
+import os
+import signal
+from collections.abc import AsyncIterator
+from typing import Literal
 
 TRUNCATED_MESSAGE: str = "<response clipped><NOTE>To save on context only part of this file has been shown to you. You should retry this tool after you have searched inside the file with `grep -n` in order to find the line numbers of what you are looking for.</NOTE>"
 MAX_RESPONSE_LEN: int = 16000
+READ_CHUNK_BYTES = 64 * 1024
+# chunks read ahead of the consumer, per command
+MAX_QUEUED_CHUNKS = 16
+
+StreamName = Literal["stdout", "stderr"]
 
 
 def maybe_truncate(content: str, truncate_after: int | None = MAX_RESPONSE_LEN):
@@ -15,28 +33,173 @@ def maybe_truncate(content: str, truncate_after: int | None = MAX_RESPONSE_LEN):
     )
 
 
+class BoundedOutput:
+    """
+    The first `head_bytes` of a stream, or all of it if None, and its last
+    `tail_bytes`. The bytes in between are only counted.
+    """
+
+    def __init__(self, head_bytes: int | None, tail_bytes: int = 0):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+        self.dropped = 0
+
+    def feed(self, data: bytes) -> None:
+        self.total += len(data)
+        if self.head_bytes is None:
+            self.head += data
+            return
+        room = self.head_bytes - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if not self.tail_bytes:
+            self.dropped += len(data)
+            return
+        self.tail += data
+        excess = len(self.tail) - self.tail_bytes
+        if excess > 0:
+            del self.tail[:excess]
+            self.dropped += excess
+
+    def text(
+        self, truncate_after: int | None = MAX_RESPONSE_LEN, keep_tail: int = 0
+    ) -> str:
+        """
+        The decoded output, clipped to `truncate_after` characters, followed by up
+        to `keep_tail` characters of its tail.
+        """
+        if not self.dropped:
+            # nothing was lost, so the head and tail are contiguous
+            text = (self.head + self.tail).decode(errors="replace")
+            if not keep_tail:
+                return maybe_truncate(text, truncate_after)
+            if not truncate_after or len(text) <= truncate_after + keep_tail:
+                return text
+            clipped, tail_text = text[:truncate_after], text[-keep_tail:]
+        else:
+            head = self.head.decode(errors="replace")
+            if not keep_tail:
+                return maybe_truncate(head, truncate_after)
+            clipped = head[:truncate_after]
+            tail = self.tail
+            # don't start in the middle of a UTF-8 sequence
+            while tail and tail[0] & 0xC0 == 0x80:
+                tail = tail[1:]
+            tail_text = tail.decode(errors="replace")[-keep_tail:]
+        omitted = self.total - len(clipped.encode()) - len(tail_text.encode())
+        return f"{clipped}\n<response clipped: {omitted} bytes omitted>\n{tail_text}"
+
+
+class Command:
+    """
+    A shell command whose output is read as it arrives:
+
+        async with Command("make") as command:
+            async for stream, chunk in command:
+                ...
+        print(command.returncode)
+
+    Leaving the block while the command is still running, e.g. on a timeout or
+    cancellation, kills its whole process group.
+    """
+
+    def __init__(self, cmd: str):
+        self.cmd = cmd
+        self.returncode: int | None = None
+        self._process: asyncio.subprocess.Process | None = None
+        self._chunks: asyncio.Queue[tuple[StreamName, bytes]] = asyncio.Queue(
+            MAX_QUEUED_CHUNKS
+        )
+        self._readers: list[asyncio.Task] = []
+        self._open_streams = 0
+
+    async def __aenter__(self) -> "Command":
+        self._process = await asyncio.create_subprocess_shell(
+            self.cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            # its own process group, so everything it starts can be killed
+            start_new_session=True,
+        )
+        assert self._process.stdout and self._process.stderr
+        self._readers = [
+            asyncio.create_task(self._read("stdout", self._process.stdout)),
+            asyncio.create_task(self._read("stderr", self._process.stderr)),
+        ]
+        self._open_streams = len(self._readers)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> None:
+        for reader in self._readers:
+            reader.cancel()
+        await asyncio.gather(*self._readers, return_exceptions=True)
+        process = self._process
+        if process is None:
+            return
+        if process.returncode is None:
+            self.kill()
+        # not cancellable, so the process is always reaped
+        self.returncode = await asyncio.shield(process.wait())
+
+    def kill(self) -> None:
+        """Kill the command and every process it started."""
+        if self._process is None or self._process.returncode is not None:
+            return
+        try:
+            os.killpg(self._process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    async def _read(self, name: StreamName, reader: asyncio.StreamReader) -> None:
+        while chunk := await reader.read(READ_CHUNK_BYTES):
+            await self._chunks.put((name, chunk))
+        await self._chunks.put((name, b""))
+
+    def __aiter__(self) -> AsyncIterator[tuple[StreamName, bytes]]:
+        return self
+
+    async def __anext__(self) -> tuple[StreamName, bytes]:
+        while self._open_streams:
+            name, chunk = await self._chunks.get()
+            if chunk:
+                return name, chunk
+            self._open_streams -= 1
+        assert self._process is not None
+        self.returncode = await self._process.wait()
+        raise StopAsyncIteration
+
+
 async def run(
     cmd: str,
     timeout: float | None = 120.0,  # seconds
     truncate_after: int | None = MAX_RESPONSE_LEN,
+    keep_tail: int = 0,
 ):
-    """Run a shell command asynchronously with a timeout."""
-    process = await asyncio.create_subprocess_shell(
-        cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
-    )
-
+    """
+    Run a shell command asynchronously with a timeout. Returns its return code and
+    its stdout and stderr, each clipped to `truncate_after` characters. With
+    `keep_tail`, the last `keep_tail` characters of each are also kept.
+    """
+    # enough UTF-8 for `truncate_after` characters
+    head_bytes = 4 * (truncate_after + 1) if truncate_after else None
+    outputs = {
+        "stdout": BoundedOutput(head_bytes, 4 * keep_tail),
+        "stderr": BoundedOutput(head_bytes, 4 * keep_tail),
+    }
     try:
-        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
-        return (
-            process.returncode or 0,
-            maybe_truncate(stdout.decode(), truncate_after=truncate_after),
-            maybe_truncate(stderr.decode(), truncate_after=truncate_after),
-        )
-    except asyncio.TimeoutError as exc:
-        try:
-            process.kill()
-        except ProcessLookupError:
-            pass
+        async with asyncio.timeout(timeout), Command(cmd) as command:
+            async for name, chunk in command:
+                outputs[name].feed(chunk)
+    except TimeoutError as exc:
         raise TimeoutError(
             f"Command '{cmd}' timed out after {timeout} seconds"
         ) from exc
+    return (
+        command.returncode or 0,
+        outputs["stdout"].text(truncate_after, keep_tail),
+        outputs["stderr"].text(truncate_after, keep_tail),
+    )
@@ -0,0 +1,432 @@
+"""
+Code search over a workspace, answered from a trigram index.
+
+`SearchTool` gives the agent a `search` tool, so it doesn't have to run `grep -rn`
+over the whole tree through the bash session for every query. A `TrigramIndex`
+records, for every three-byte sequence, which files of the workspace contain it.
+A query only reads the files that contain every trigram of the literal text the
+query requires, and checks them with the real pattern.
+
+Before each query the index is brought up to date: the workspace is walked, and
+files whose mtime or size changed are indexed again. The first query indexes the
+whole workspace. Later ones only index what changed since. Every `SearchTool` of a
+workspace shares its index, so a tool made for each turn doesn't start over.
+
+Hidden files and directories, `DEFAULT_EXCLUDED_DIRS`, binary files and files
+larger than `max_file_bytes` are not searched. File contents aren't kept, only
+their trigrams, as compact posting lists.
+"""
+
+import asyncio
+import os
+import re
+import threading
+from array import array
+from collections import defaultdict
+from collections.abc import Iterator
+from dataclasses import dataclass
+from functools import partial
+from pathlib import Path
+from stat import S_ISREG
+from typing import Any, Literal
+
+from anthropic.types.beta import BetaToolParam
+
+from .base import BaseAnthropicTool, CLIResult, ToolError
+from .run import MAX_RESPONSE_LEN
+
+DEFAULT_MAX_FILE_BYTES = 1024 * 1024
+DEFAULT_MAX_FILES = 100_000
+DEFAULT_EXCLUDED_DIRS = frozenset({"node_modules", "__pycache__"})
+MAX_LINE_CHARS = 500
+BINARY_SNIFF_BYTES = 8192
+
+_EMPTY = array("I")
+
+
+def _trigrams(data: bytes) -> set[int]:
+    """Every three-byte sequence of `data`, as an int."""
+    # Cast to 32-bit words, every word at offsets 0, 4, 8... holds one trigram and
+    # a fourth byte, which is zeroed. Offsets 1, 2 and 3 give the others.
+    padded = data + b"\0"
+    keys: set[int] = set()
+    for offset in range(4):
+        words = bytearray(padded[offset : offset + (len(padded) - offset) // 4 * 4])
+        words[3::4] = bytes(len(words) // 4)
+        keys.update(memoryview(words).cast("I"))
+    return keys
+
+
+def _required_literals(pattern: str) -> list[str]:
+    """
+    Literal strings every match of the regex `pattern` contains. Conservative:
+    anything it doesn't understand, such as alternations, groups or classes,
+    just isn't used to narrow the search.
+    """
+    if "|" in pattern:
+        return []
+    literals: list[str] = []
+    run = ""
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        i += 1
+        if c == "\\":
+            escaped = pattern[i : i + 1]
+            i += 1
+            if escaped and not escaped.isalnum():
+                run += escaped  # an escaped symbol matches itself
+                continue
+            # a class like \d, a reference or a code like \x41
+            while i < len(pattern) and pattern[i].isalnum():
+                i += 1
+            literals.append(run)
+            run = ""
+        elif c in "*?{":
+            # the character before may be missing
+            literals.append(run[:-1])
+            run = ""
+            if c == "{":
+                i = pattern.find("}", i) + 1 or len(pattern)
+        elif c in "([":
+            literals.append(run)
+            run = ""
+            i = _skip_group(pattern, i - 1)
+        elif c in "+.^$)]}":
+            literals.append(run)
+            run = ""
+        else:
+            run += c
+    literals.append(run)
+    return [literal for literal in literals if len(literal) >= 3]
+
+
+def _skip_group(pattern: str, i: int) -> int:
+    """The position after the group or class that starts at `pattern[i]`."""
+    if pattern[i] == "[":
+        i += 1
+        if pattern[i : i + 1] == "^":
+            i += 1
+        if pattern[i : i + 1] == "]":
+            i += 1  # a literal "]"
+        while i < len(pattern) and pattern[i] != "]":
+            i += 2 if pattern[i] == "\\" else 1
+        return i + 1
+    depth = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            i += 2
+            continue
+        if c == "[":
+            i = _skip_group(pattern, i)
+            continue
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+            if not depth:
+                return i + 1
+        i += 1
+    return i
+
+
+@dataclass
+class _File:
+    mtime_ns: int
+    size: int
+    id: int | None  # None if it isn't indexed, e.g. binary
+
+
+class TrigramIndex:
+    """
+    Which files under `root` contain each trigram, kept up to date by `refresh`. It
+    can be used from several threads.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        max_file_bytes: int = DEFAULT_MAX_FILE_BYTES,
+        max_files: int = DEFAULT_MAX_FILES,
+        excluded_dirs: frozenset[str] = DEFAULT_EXCLUDED_DIRS,
+    ):
+        self.root = root
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.excluded_dirs = excluded_dirs
+        # paths are kept as strings, which are much cheaper to make and hash
+        self._files: dict[str, _File] = {}
+        self._paths: dict[int, str] = {}  # of the indexed files
+        self._postings: defaultdict[int, array] = defaultdict(partial(array, "I"))
+        self._next_id = 0
+        self._stale_ids = 0  # ids of changed files, still in `_postings`
+        # whether the last refresh stopped at `max_files`
+        self.truncated = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    def refresh(self) -> None:
+        """Index new and changed files, and forget removed ones."""
+        with self._lock:
+            seen = set()
+            files = self._files
+            for path, stat in self._walk():
+                seen.add(path)
+                known = files.get(path)
+                if (
+                    known
+                    and known.mtime_ns == stat.st_mtime_ns
+                    and known.size == stat.st_size
+                ):
+                    continue
+                self._remove(path)
+                self._add(path, stat)
+            for path in self._files.keys() - seen:
+                self._remove(path)
+            if self._stale_ids > max(len(self._paths), 1024):
+                self._compact()
+
+    def candidates(self, literals: list[bytes]) -> list[str]:
+        """The files that may contain all of `literals`, which are ASCII lowercased."""
+        keys = set().union(*map(_trigrams, literals))
+        with self._lock:
+            if not keys:
+                return sorted(self._paths.values())
+            postings = sorted(
+                (self._postings.get(key, _EMPTY) for key in keys), key=len
+            )
+            ids = set(postings[0])
+            for posting in postings[1:]:
+                if not ids:
+                    break
+                ids.intersection_update(posting)
+            return sorted(self._paths[i] for i in ids if i in self._paths)
+
+    def _walk(self) -> Iterator[tuple[str, os.stat_result]]:
+        self.truncated = False
+        count = 0
+        pending = [str(self.root)]
+        while pending:
+            directory = pending.pop()
+            try:
+                with os.scandir(directory) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                name = entry.name
+                if name[0] == ".":
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if name not in self.excluded_dirs:
+                            pending.append(entry.path)
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if S_ISREG(stat.st_mode) and stat.st_size <= self.max_file_bytes:
+                    count += 1
+                    yield entry.path, stat
+                    if count >= self.max_files:
+                        self.truncated = True
+                        return
+
+    def _add(self, path: str, stat: os.stat_result) -> None:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return
+        if b"\0" in data[:BINARY_SNIFF_BYTES]:
+            self._files[path] = _File(stat.st_mtime_ns, stat.st_size, None)
+            return
+        file_id = self._next_id
+        self._next_id += 1
+        self._files[path] = _File(stat.st_mtime_ns, stat.st_size, file_id)
+        self._paths[file_id] = path
+        postings = self._postings
+        for key in _trigrams(data.lower()):
+            postings[key].append(file_id)
+
+    def _remove(self, path: str) -> None:
+        known = self._files.pop(path, None)
+        if known is not None and known.id is not None:
+            # its postings go at the next compaction
+            del self._paths[known.id]
+            self._stale_ids += 1
+
+    def _compact(self) -> None:
+        live = self._paths.keys()
+        for key, posting in list(self._postings.items()):
+            kept = array("I", filter(live.__contains__, posting))
+            if kept:
+                self._postings[key] = kept
+            else:
+                del self._postings[key]
+        self._stale_ids = 0
+
+
+_indexes: dict[Path, TrigramIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def shared_index(workspace: Path) -> TrigramIndex:
+    """The index of `workspace` shared by all the search tools of this process."""
+    with _indexes_lock:
+        if workspace not in _indexes:
+            _indexes[workspace] = TrigramIndex(workspace)
+        return _indexes[workspace]
+
+
+class SearchTool(BaseAnthropicTool):
+    """
+    A tool that allows the agent to search the text files of a workspace, with
+    line-numbered results like `grep -rn`.
+    """
+
+    name: Literal["search"] = "search"
+
+    def __init__(self, workspace: Path | str | None = None):
+        self.workspace = Path(
+            workspace or os.getenv("SEARCH_WORKSPACE") or Path.home()
+        ).resolve()
+        self._index = shared_index(self.workspace)
+        super().__init__()
+
+    def to_params(self) -> BetaToolParam:
+        return {
+            "name": self.name,
+            "description": (
+                f"Search the text files under {self.workspace} for a string or a "
+                "Python regular expression, like `grep -rn`. Much faster than "
+                "running grep with the bash tool. Results are `path:line:text`. "
+                "Hidden files, binary files and files over "
+                f"{self._index.max_file_bytes // 1024} KB are not searched."
+            ),
+            "input_schema": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "The text to search for.",
+                    },
+                    "regex": {
+                        "type": "boolean",
+                        "description": "Whether `query` is a regular expression.",
+                    },
+                    "ignore_case": {"type": "boolean"},
+                    "path": {
+                        "type": "string",
+                        "description": "Only search this absolute file or directory path.",
+                    },
+                },
+                "required": ["query"],
+            },
+        }
+
+    async def __call__(
+        self,
+        *,
+        query: str | None = None,
+        regex: bool = False,
+        ignore_case: bool = False,
+        path: str | None = None,
+        **kwargs: Any,
+    ):
+        if not query:
+            raise ToolError("Parameter `query` is required and can't be empty")
+        # indexing takes a while on the first query, so not on the event loop
+        return await asyncio.to_thread(self.search, query, regex, ignore_case, path)
+
+    def search(
+        self,
+        query: str,
+        regex: bool = False,
+        ignore_case: bool = False,
+        path: str | None = None,
+    ) -> CLIResult:
+        scope = self._scope(path)
+        try:
+            # like grep, `^` and `$` match at every line
+            pattern = re.compile(
+                query if regex else re.escape(query),
+                re.MULTILINE | (re.IGNORECASE if ignore_case else 0),
+            )
+        except re.error as e:
+            raise ToolError(f"Invalid regular expression `{query}`: {e}") from None
+        literals = _required_literals(query) if regex else [query]
+        if pattern.flags & re.VERBOSE:
+            literals = []
+        if pattern.flags & re.IGNORECASE:
+            # only ASCII letters are lowercased in the index, and i, k and s also
+            # match non-ASCII letters when ignoring case
+            literals = [
+                part
+                for literal in literals
+                for part in re.split(r"[^\x00-\x7f]|[iksIKS]", literal)
+            ]
+
+        self._index.refresh()
+        note = ""
+        if self._index.truncated:
+            note = f"\n<only the first {self._index.max_files} files of {self.workspace} are indexed, so others were not searched>"
+        matches: list[str] = []
+        size = 0
+        prefix = os.path.join(scope, "")
+        for file in self._index.candidates(
+            [literal.encode().lower() for literal in literals]
+        ):
+            if not (file.startswith(prefix) or file == str(scope)):
+                continue
+            for line, text in self._matching_lines(file, pattern):
+                matches.append(f"{file}:{line}:{text}")
+                size += len(matches[-1]) + 1
+                if size > MAX_RESPONSE_LEN:
+                    matches.append(
+                        f"<results clipped after {len(matches)} matches; search for something more specific, or pass a `path`>"
+                    )
+                    return CLIResult(output="\n".join(matches) + note)
+        if not matches:
+            return CLIResult(output=f"No matches for `{query}` in {scope}.{note}")
+        return CLIResult(output="\n".join(matches) + note)
+
+    def _scope(self, path: str | None) -> Path:
+        if not path:
+            return self.workspace
+        scope = Path(path)
+        if not scope.is_absolute():
+            raise ToolError(
+                f"The path {path} is not an absolute path, it should start with `/`."
+            )
+        scope = scope.resolve()
+        if not scope.is_relative_to(self.workspace):
+            raise ToolError(
+                f"The path {path} is outside of the searched workspace {self.workspace}."
+            )
+        return scope
+
+    def _matching_lines(
+        self, file: str, pattern: re.Pattern[str]
+    ) -> Iterator[tuple[int, str]]:
+        try:
+            with open(file, errors="replace") as f:
+                text = f.read()
+        except OSError:
+            return
+        line, counted, last_line = 1, 0, 0
+        for match in pattern.finditer(text):
+            line += text.count("\n", counted, match.start())
+            counted = match.start()
+            if line == last_line:
+                continue
+            last_line = line
+            start = text.rfind("\n", 0, match.start()) + 1
+            end = text.find("\n", match.start())
+            content = text[start : end if end != -1 else len(text)]
+            if len(content) > MAX_LINE_CHARS:
+                content = content[:MAX_LINE_CHARS] + "..."
+            yield line, content
@@ -0,0 +1,245 @@
+"""
+Span tracing for the sampling loop and tools.
+
+Tracing is off unless `configure()` is called or the `TRACE_FILE` environment
+variable is set. While off, `span()` hands back a shared no-op context manager, so
+instrumented hot paths pay a single global lookup.
+
+Spans are written as they finish, one JSON object per line, or as Chrome trace
+events (load them in chrome://tracing or https://ui.perfetto.dev) when the file name
+ends in `.json`. Per-session aggregates are kept in memory for `summary()`.
+
+    TRACE_FILE=/tmp/trace.json computer-control
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, TextIO
+
+DEFAULT_SESSION = "default"
+
+current_session: ContextVar[str] = ContextVar("trace_session", default=DEFAULT_SESSION)
+
+
+@dataclass(kw_only=True)
+class Span:
+    """A finished, timed section of work."""
+
+    name: str
+    session: str
+    start_ns: int
+    duration_ns: int
+    attrs: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class SpanStats:
+    """Aggregate timings of one span name within a session."""
+
+    count: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+
+    def add(self, duration_ms: float) -> None:
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+
+    @property
+    def mean_ms(self) -> float:
+        return self.total_ms / self.count if self.count else 0.0
+
+
+class Tracer:
+    """Collects spans, streams them to `path` and forwards them to `sink`."""
+
+    def __init__(
+        self,
+        path: str | Path | None = None,
+        *,
+        sink: Callable[[Span], None] | None = None,
+    ):
+        self.path = Path(path) if path else None
+        self.chrome = bool(self.path and self.path.suffix == ".json")
+        self.sink = sink
+        self._stats: dict[str, dict[str, SpanStats]] = defaultdict(
+            lambda: defaultdict(SpanStats)
+        )
+        self._lock = threading.Lock()
+        self._file: TextIO | None = None
+        if self.path:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self.path.open("w", buffering=1)
+            if self.chrome:
+                self._file.write("[\n")
+
+    def record(self, span: Span) -> None:
+        with self._lock:
+            self._stats[span.session][span.name].add(span.duration_ns / 1e6)
+            if self._file:
+                self._file.write(
+                    self._encode(span) + ("," if self.chrome else "") + "\n"
+                )
+        if self.sink:
+            self.sink(span)
+
+    def _encode(self, span: Span) -> str:
+        if not self.chrome:
+            return json.dumps(asdict(span), default=str)
+        return json.dumps(
+            {
+                "name": span.name,
+                "cat": span.name.split(".")[0],
+                "ph": "X",
+                "ts": span.start_ns / 1000,
+                "dur": span.duration_ns / 1000,
+                "pid": os.getpid(),
+                "tid": span.session,
+                "args": span.attrs,
+            },
+            default=str,
+        )
+
+    def summary(self, session: str | None = None) -> dict[str, dict[str, float]]:
+        """Per-span-name aggregates for one session, or for all sessions combined."""
+        with self._lock:
+            sessions = (
+                [self._stats.get(session, {})]
+                if session
+                else list(self._stats.values())
+            )
+            combined: dict[str, SpanStats] = defaultdict(SpanStats)
+            for stats in sessions:
+                for name, stat in stats.items():
+                    total = combined[name]
+                    total.count += stat.count
+                    total.total_ms += stat.total_ms
+                    total.max_ms = max(total.max_ms, stat.max_ms)
+        return {
+            name: {
+                "count": stat.count,
+                "total_ms": round(stat.total_ms, 3),
+                "mean_ms": round(stat.mean_ms, 3),
+                "max_ms": round(stat.max_ms, 3),
+            }
+            for name, stat in sorted(combined.items())
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+class _ActiveSpan:
+    __slots__ = ("_tracer", "_name", "_attrs", "_start")
+
+    def __init__(self, tracer: Tracer, name: str, attrs: dict[str, Any]):
+        self._tracer = tracer
+        self._name = name
+        self._attrs = attrs
+
+    def set(self, **attrs: Any) -> None:
+        self._attrs.update(attrs)
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter_ns() - self._start
+        if exc_type is not None:
+            self._attrs["error"] = exc_type.__name__
+        self._tracer.record(
+            Span(
+                name=self._name,
+                session=current_session.get(),
+                start_ns=time.time_ns() - duration,
+                duration_ns=duration,
+                attrs=self._attrs,
+            )
+        )
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def set(self, **attrs: Any) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+_tracer: Tracer | None = None
+
+
+def span(name: str, **attrs: Any) -> _ActiveSpan | _NullSpan:
+    """Time the enclosed block as `name` if tracing is enabled."""
+    if _tracer is None:
+        return NULL_SPAN
+    return _ActiveSpan(_tracer, name, attrs)
+
+
+def configure(
+    path: str | Path | None = None, *, sink: Callable[[Span], None] | None = None
+) -> Tracer:
+    """Enable tracing, replacing (and closing) any previously configured tracer."""
+    global _tracer
+    disable()
+    _tracer = Tracer(path, sink=sink)
+    return _tracer
+
+
+def disable() -> None:
+    global _tracer
+    if _tracer is not None:
+        _tracer.close()
+    _tracer = None
+
+
+def get_tracer() -> Tracer | None:
+    return _tracer
+
+
+@contextmanager
+def session(session_id: str) -> Iterator[None]:
+    """Attribute spans created in this context to `session_id`."""
+    token = current_session.set(session_id)
+    try:
+        yield
+    finally:
+        current_session.reset(token)
+
+
+def format_summary(summary: dict[str, dict[str, float]]) -> str:
+    """Render `Tracer.summary()` as an aligned text table."""
+    if not summary:
+        return "No spans recorded."
+    width = max(len(name) for name in summary)
+    lines = [
+        f"{'span':<{width}}  {'count':>6}  {'total ms':>10}  {'mean ms':>9}  {'max ms':>9}"
+    ]
+    for name, stat in summary.items():
+        lines.append(
+            f"{name:<{width}}  {stat['count']:>6}  {stat['total_ms']:>10.1f}  "
+            f"{stat['mean_ms']:>9.2f}  {stat['max_ms']:>9.2f}"
+        )
+    return "\n".join(lines)
+
+
+if trace_file := os.getenv("TRACE_FILE"):
+    configure(trace_file)
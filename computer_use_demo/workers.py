@@ -0,0 +1,292 @@
+"""
+Run sessions in worker processes, so that concurrent sessions use more than one core.
+
+The supervisor side, `WorkerPool`, starts `size` copies of a worker command. Each
+new session goes to the worker with the fewest sessions and sticks with it. Traffic
+is JSON lines over the workers' stdin and stdout:
+
+    supervisor -> worker: {"session": "ws-1", "op": "open" | "message" | "close", "data": {...}}
+    worker -> supervisor: {"session": "ws-1", "data": {...}}
+    worker -> supervisor: {"session": "ws-1", "binary": "<base64>"}
+
+If a worker dies it is restarted, and its sessions are reopened on the new process.
+Those clients get an error saying the conversation was lost. Sessions on the other
+workers are unaffected. `serve()` implements the worker side of the protocol.
+
+On both sides, each session's traffic is handled in order on a task of its own. A
+session waiting for a display, or a slow client, doesn't hold up the others.
+"""
+
+import asyncio
+import base64
+import json
+import os
+import sys
+from abc import ABCMeta, abstractmethod
+from collections import deque
+from collections.abc import Awaitable, Callable, Sequence
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any
+
+from . import metrics
+
+MAX_LINE_BYTES = 64 * 1024 * 1024
+WORKER_LOST_ERROR = (
+    "The worker running this session crashed and was restarted. "
+    "The conversation so far was lost."
+)
+
+Deliver = Callable[[str, dict[str, Any] | bytes], Awaitable[None]]
+
+
+class SessionLanes:
+    """
+    Runs the jobs submitted for each session one at a time, in order, on a task per
+    session with pending jobs. Failed jobs are reported to the event loop's
+    exception handler, and the session's later jobs still run.
+    """
+
+    def __init__(self, description: str):
+        self.description = description
+        self._jobs: dict[str, deque[Callable[[], Awaitable[None]]]] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def submit(self, session_id: str, job: Callable[[], Awaitable[None]]) -> None:
+        if session_id in self._jobs:
+            self._jobs[session_id].append(job)
+            return
+        self._jobs[session_id] = deque([job])
+        self._tasks[session_id] = asyncio.create_task(self._run(session_id))
+
+    async def _run(self, session_id: str) -> None:
+        jobs = self._jobs[session_id]
+        try:
+            while jobs:
+                try:
+                    await jobs.popleft()()
+                except Exception as e:
+                    asyncio.get_running_loop().call_exception_handler(
+                        {"message": f"Failed to {self.description}", "exception": e}
+                    )
+        finally:
+            # nothing is awaited between the last check and here, so no job is lost
+            del self._jobs[session_id]
+            del self._tasks[session_id]
+
+    async def join(self) -> None:
+        """Wait until every job submitted so far has run."""
+        while self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    async def cancel(self) -> None:
+        """Cancel every pending job, and wait for the running ones to stop."""
+        for task in self._tasks.values():
+            task.cancel()
+        await self.join()
+
+
+@dataclass
+class Worker:
+    """A worker process and the sessions routed to it."""
+
+    index: int
+    process: asyncio.subprocess.Process
+    sessions: set[str] = field(default_factory=set)
+    reader: asyncio.Task | None = None
+
+
+class WorkerPool:
+    """Starts worker processes and routes session traffic to them."""
+
+    def __init__(
+        self,
+        size: int,
+        command: Sequence[str],
+        deliver: Deliver,
+        env: dict[str, str] | None = None,
+    ):
+        self.size = size
+        self.command = list(command)
+        self.deliver = deliver
+        self.env = env or {}
+        self.workers: list[Worker] = []
+        self._routes: dict[str, Worker] = {}
+        self._deliveries = SessionLanes("deliver a worker message")
+        self._stopping = False
+
+    async def start(self) -> None:
+        self.workers = list(
+            await asyncio.gather(*(self._spawn(index) for index in range(self.size)))
+        )
+
+    async def _spawn(self, index: int) -> Worker:
+        process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            env={**os.environ, **self.env, "WORKER_INDEX": str(index)},
+            limit=MAX_LINE_BYTES,
+        )
+        worker = Worker(index, process)
+        worker.reader = asyncio.create_task(self._read(worker))
+        metrics.WORKER_SESSIONS.set(0, worker=str(index))
+        return worker
+
+    def worker_for(self, session_id: str) -> Worker | None:
+        return self._routes.get(session_id)
+
+    async def open(self, session_id: str) -> Worker:
+        """Assign `session_id` to the least busy worker."""
+        worker = min(self.workers, key=lambda worker: len(worker.sessions))
+        self._routes[session_id] = worker
+        worker.sessions.add(session_id)
+        metrics.WORKER_SESSIONS.set(len(worker.sessions), worker=str(worker.index))
+        await self._write(worker, session_id, "open")
+        return worker
+
+    async def send(self, session_id: str, data: dict[str, Any]) -> None:
+        await self._write(self._routes[session_id], session_id, "message", data)
+
+    async def close(self, session_id: str) -> None:
+        if worker := self._routes.pop(session_id, None):
+            worker.sessions.discard(session_id)
+            metrics.WORKER_SESSIONS.set(len(worker.sessions), worker=str(worker.index))
+            await self._write(worker, session_id, "close")
+
+    async def _write(
+        self,
+        worker: Worker,
+        session_id: str,
+        op: str,
+        data: dict[str, Any] | None = None,
+    ) -> None:
+        assert worker.process.stdin
+        line = json.dumps({"session": session_id, "op": op, "data": data})
+        worker.process.stdin.write(line.encode() + b"\n")
+        try:
+            await worker.process.stdin.drain()
+        except ConnectionError:
+            # the worker died; _read restarts it and reopens this session
+            pass
+
+    async def _read(self, worker: Worker) -> None:
+        assert worker.process.stdout
+        try:
+            while line := await worker.process.stdout.readline():
+                message = json.loads(line)
+                if "binary" in message:
+                    data = base64.b64decode(message["binary"])
+                else:
+                    data = message["data"]
+                self._deliveries.submit(
+                    message["session"], partial(self.deliver, message["session"], data)
+                )
+        except Exception as e:
+            # it can't be talked to any more, so it's treated like a crash
+            asyncio.get_running_loop().call_exception_handler(
+                {"message": "Unreadable output from a worker", "exception": e}
+            )
+            if worker.process.returncode is None:
+                worker.process.kill()
+        await worker.process.wait()
+        if not self._stopping:
+            await self._restart(worker)
+
+    async def _restart(self, crashed: Worker) -> None:
+        metrics.WORKER_RESTARTS.inc()
+        worker = await self._spawn(crashed.index)
+        self.workers[crashed.index] = worker
+        for session_id in crashed.sessions:
+            self._routes[session_id] = worker
+            worker.sessions.add(session_id)
+            await self._write(worker, session_id, "open")
+            self._deliveries.submit(
+                session_id,
+                partial(self.deliver, session_id, {"error": WORKER_LOST_ERROR}),
+            )
+        metrics.WORKER_SESSIONS.set(len(worker.sessions), worker=str(worker.index))
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for worker in self.workers:
+            if worker.process.stdin:
+                worker.process.stdin.close()
+        await asyncio.gather(
+            *(worker.reader for worker in self.workers if worker.reader),
+            return_exceptions=True,
+        )
+        await self._deliveries.join()
+
+
+class WorkerConnection:
+    """Stands in for a session's websocket inside a worker."""
+
+    def __init__(self, session_id: str, output: asyncio.StreamWriter):
+        self.session_id = session_id
+        self.closed = False
+        self._output = output
+
+    async def send_json(self, data: dict[str, Any]) -> None:
+        await self._send({"session": self.session_id, "data": data})
+
+    async def send_bytes(self, data: bytes) -> None:
+        binary = base64.b64encode(data).decode()
+        await self._send({"session": self.session_id, "binary": binary})
+
+    async def _send(self, message: dict[str, Any]) -> None:
+        if self.closed:
+            raise ConnectionResetError(f"Session {self.session_id} is closed")
+        self._output.write(json.dumps(message).encode() + b"\n")
+        await self._output.drain()
+
+
+class WorkerHandler(metaclass=ABCMeta):
+    """The sessions hosted by a worker process."""
+
+    @abstractmethod
+    async def open(self, session_id: str, connection: WorkerConnection) -> None: ...
+
+    @abstractmethod
+    async def message(self, session_id: str, data: dict[str, Any]) -> None: ...
+
+    @abstractmethod
+    async def close(self, session_id: str) -> None: ...
+
+
+async def serve(handler: WorkerHandler) -> None:
+    """Run the worker side of the protocol on stdin and stdout until stdin closes."""
+    loop = asyncio.get_running_loop()
+    # keep stray prints from corrupting the protocol by moving them to stderr
+    protocol_out = os.fdopen(os.dup(sys.stdout.fileno()), "wb")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    transport, protocol = await loop.connect_write_pipe(
+        asyncio.streams.FlowControlMixin, protocol_out
+    )
+    output = asyncio.StreamWriter(transport, protocol, None, loop)
+    reader = asyncio.StreamReader(limit=MAX_LINE_BYTES)
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), sys.stdin
+    )
+    connections: dict[str, WorkerConnection] = {}
+    # an open waiting for a display only holds up its own session
+    lanes = SessionLanes("handle a session message")
+    while line := await reader.readline():
+        message = json.loads(line)
+        session_id, op = message["session"], message["op"]
+        if op == "open":
+            connections[session_id] = WorkerConnection(session_id, output)
+            lanes.submit(
+                session_id, partial(handler.open, session_id, connections[session_id])
+            )
+        elif op == "message":
+            lanes.submit(
+                session_id, partial(handler.message, session_id, message["data"])
+            )
+        elif op == "close" and (connection := connections.pop(session_id, None)):
+            connection.closed = True
+            lanes.submit(session_id, partial(handler.close, session_id))
+    # the supervisor is gone, so nothing is waiting for the rest
+    await lanes.cancel()
+    for session_id in list(connections):
+        await handler.close(session_id)
@@ -1,18 +1,59 @@
 import os
+import sys
 import json
 import asyncio
+import secrets
+from functools import partial
+from typing import Any, Optional
 from aiohttp import web
 import httpx
 from anthropic.types.beta import BetaContentBlockParam, BetaMessageParam
-from computer_use_demo.loop import APIProvider, PROVIDER_TO_DEFAULT_MODEL_NAME, sampling_loop
-from computer_use_demo.tools import ToolResult
+from computer_use_demo import metrics, tracing
+from computer_use_demo.displays import FIRST_DISPLAY_NUM, Display, DisplayPool
+from computer_use_demo.events import EventQueue, TextDelta
+from computer_use_demo.loop import (
+    INTERRUPT_TOOL_ERROR,
+    APIProvider,
+    PROVIDER_TO_DEFAULT_MODEL_NAME,
+    heal_interrupted_messages,
+    sampling_loop,
+)
+from computer_use_demo.resumable import (
+    DEFAULT_IDLE_TIMEOUT,
+    DEFAULT_MAX_SESSIONS,
+    ResumableConnection,
+    SessionStore,
+    parse_ack,
+)
+from computer_use_demo.screenshots import ScreenshotStore
+from computer_use_demo.session import SessionManager
+from computer_use_demo.tools import ToolCollection, ToolResult
+from computer_use_demo.workers import WorkerConnection, WorkerHandler, WorkerPool, serve
 
-PORT = 8080
-connected_clients = set()
+PORT = int(os.getenv("PORT") or 8080)
+WORKERS = int(os.getenv("WORKERS") or 0)
+DISPLAY_POOL_SIZE = int(os.getenv("DISPLAY_POOL_SIZE") or 0)
+connected_clients: set[web.WebSocketResponse] = set()
+sessions: dict[str, "WebSocketInterface"] = {}
+session_manager = SessionManager()
+# with DISPLAY_POOL_SIZE set, each session gets a display of its own instead of
+# sharing DISPLAY_NUM
+display_pool: Optional[DisplayPool] = None
+# with WORKERS set, sessions run in that many worker processes and this process
+# only forwards websocket traffic
+worker_pool: Optional[WorkerPool] = None
 
 class WebSocketInterface:
-    def __init__(self, ws: web.WebSocketResponse):
+    def __init__(
+        self,
+        ws: ResumableConnection | WorkerConnection,
+        session_id: str,
+        transport: Optional[asyncio.BaseTransport] = None,
+        display: Optional[Display] = None,
+    ):
         self.ws = ws
+        self.session_id = session_id
+        self.transport = transport
         self.api_key = os.getenv("ANTHROPIC_API_KEY", "")
         self.provider = APIProvider.ANTHROPIC
         self.model = PROVIDER_TO_DEFAULT_MODEL_NAME[self.provider]
@@ -21,21 +62,34 @@ class WebSocketInterface:
         self.responses: dict[str, tuple[httpx.Request, Any]] = {}
         self.only_n_most_recent_images = 3
         self.custom_system_prompt = ""
+        # outlives turns, so a slow client skips screenshots rather than stalling tools
+        self.events = EventQueue(overflow="drop_screenshots")
+        self.display = display
+        self.tool_collection: Optional[ToolCollection] = display.tool_collection() if display else None
+        self.screenshots = ScreenshotStore()
+
+    async def send(self, data: dict, request_id: Optional[str] = None) -> None:
+        """Send `data`, tagged with the id of the client message it answers, if any."""
+        await self.ws.send_json(data if request_id is None else {**data, "id": request_id})
 
-    async def output_callback(self, message: BetaContentBlockParam) -> None:
+    async def output_callback(self, message: BetaContentBlockParam, request_id: Optional[str] = None) -> None:
         """Handle output from the model."""
         if isinstance(message, dict):
             if message["type"] == "text":
-                await self.ws.send_json({"response": message["text"]})
+                await self.send({"response": message["text"]}, request_id)
             elif message["type"] == "tool_use":
-                await self.ws.send_json({
+                await self.send({
                     "tool_use": {
                         "name": message["name"],
                         "input": message["input"]
                     }
-                })
+                }, request_id)
+
+    async def text_delta_callback(self, delta: TextDelta, request_id: Optional[str] = None) -> None:
+        """Forward streamed text; deltas that queued up behind a slow client arrive merged."""
+        await self.send({"delta": {"block": delta.block, "text": delta.text, "seq": delta.seq}}, request_id)
 
-    async def tool_output_callback(self, tool_output: ToolResult, tool_id: str) -> None:
+    async def tool_output_callback(self, tool_output: ToolResult, tool_id: str, request_id: Optional[str] = None) -> None:
         """Handle output from tools."""
         self.tools[tool_id] = tool_output
         response = {}
@@ -44,21 +98,53 @@ class WebSocketInterface:
         if tool_output.output:
             response["output"] = tool_output.output
         if tool_output.base64_image:
+            # the client gets each screenshot's thumbnail once, as a binary frame
+            # ahead of the message that refers to it by hash
+            sha256 = self.screenshots.add(tool_output.base64_image)
+            if frame := await self.screenshots.frame(sha256):
+                await self.ws.send_bytes(frame)
             response["output_image"] = True
+            response["image"] = sha256
         if response:
-            await self.ws.send_json({"function_results": response})
+            await self.send({"function_results": response}, request_id)
 
     async def api_response_callback(
         self,
         request: httpx.Request,
         response: Optional[Any],
         error: Optional[Exception],
+        request_id: Optional[str] = None,
     ) -> None:
         """Handle API responses."""
         if error:
-            await self.ws.send_json({"error": str(error)})
+            await self.send({"error": str(error)}, request_id)
+
+    async def send_error(self, error: Exception, request_id: Optional[str] = None) -> None:
+        """Report an exception raised by a turn."""
+        if not self.ws.closed:
+            await self.send({"error": f"{type(error).__name__}: {error}"}, request_id)
+
+    def send_queue_bytes(self) -> int:
+        """Bytes written to the websocket that the kernel has not accepted yet."""
+        if isinstance(self.transport, asyncio.WriteTransport) and not self.transport.is_closing():
+            return self.transport.get_write_buffer_size()
+        return 0
 
-    async def handle_message(self, message: str) -> None:
+    async def handle_request(self, data: dict) -> None:
+        """
+        Run a message the client queued. With an `id`, everything the turn sends
+        carries it, ending with a `done` message.
+        """
+        request_id = data.get("id")
+        try:
+            await self.handle_message(data["message"], request_id)
+        except Exception as e:
+            await self.send_error(e, request_id)
+        if request_id is not None:
+            # behind the turn's own events, which may still be queued
+            await self.events.publish(self.send, {"done": True}, request_id)
+
+    async def handle_message(self, message: str, request_id: Optional[str] = None) -> None:
         """Handle incoming messages from the client."""
         if message == "!clear":
             self.messages = []
@@ -69,52 +155,259 @@ class WebSocketInterface:
             "content": [{"type": "text", "text": message}],
         })
 
-        self.messages = await sampling_loop(
-            model=self.model,
-            provider=self.provider,
-            system_prompt_suffix=self.custom_system_prompt,
-            messages=self.messages,
-            output_callback=self.output_callback,
-            tool_output_callback=self.tool_output_callback,
-            api_response_callback=self.api_response_callback,
-            api_key=self.api_key,
-            only_n_most_recent_images=self.only_n_most_recent_images,
-        )
+        try:
+            self.messages = await sampling_loop(
+                model=self.model,
+                provider=self.provider,
+                system_prompt_suffix=self.custom_system_prompt,
+                messages=self.messages,
+                output_callback=partial(self.output_callback, request_id=request_id),
+                tool_output_callback=partial(self.tool_output_callback, request_id=request_id),
+                api_response_callback=partial(self.api_response_callback, request_id=request_id),
+                api_key=self.api_key,
+                only_n_most_recent_images=self.only_n_most_recent_images,
+                event_queue=self.events,
+                tool_collection=self.tool_collection,
+                text_delta_callback=partial(self.text_delta_callback, request_id=request_id),
+            )
+        except asyncio.CancelledError:
+            # sampling_loop extends self.messages in place, so the partial turn is
+            # there; close its tool calls so the next message can continue from it
+            for tool_id in heal_interrupted_messages(self.messages):
+                self.tools[tool_id] = ToolResult(error=INTERRUPT_TOOL_ERROR)
+            raise
+
+async def open_session(session_id: str, ws: Any, transport: Optional[asyncio.BaseTransport] = None) -> "WebSocketInterface":
+    """Start a conversation that talks to the client through `ws`."""
+    display = await display_pool.acquire() if display_pool else None
+    interface = WebSocketInterface(ws, session_id, transport, display)
+    sessions[session_id] = interface
+    # turns run in the session's own task, so the connection keeps receiving while
+    # one is in progress and can stop it
+    session_manager.open(session_id, interface.handle_request, interface.send_error)
+    return interface
+
+async def handle_client_data(interface: "WebSocketInterface", data: dict) -> None:
+    """Act on one decoded JSON message from the client."""
+    session = session_manager.get(interface.session_id)
+    assert session
+    if "screenshot" in data:
+        # the full resolution version of a screenshot the client has a thumbnail of
+        frame = await interface.screenshots.frame(data["screenshot"], "full", resend=True)
+        if frame:
+            await interface.ws.send_bytes(frame)
+        else:
+            await interface.ws.send_json({"error": f"Unknown screenshot {data['screenshot']}"})
+    elif "message" in data:
+        message = data["message"]
+        if message in ("!stop", "!clear"):
+            # also drops the queued messages, which get no `done`
+            await session.stop()
+            if message == "!clear":
+                await interface.handle_message(message)
+            await interface.send({"status": "stopped" if message == "!stop" else "cleared"}, data.get("id"))
+        else:
+            ahead = session.submit(data)
+            if "id" in data:
+                await interface.send({"queued": ahead}, data["id"])
+    else:
+        await interface.ws.send_json({"error": "Missing 'message' field in request"})
+
+async def close_session(session_id: str) -> None:
+    await session_manager.close(session_id)
+    if closed := sessions.pop(session_id, None):
+        await closed.events.aclose(drain=False)
+        if closed.tool_collection:
+            await closed.tool_collection.close()
+        if display_pool and closed.display:
+            display_pool.release(closed.display)
+    metrics.SESSION_MEMORY_BYTES.remove(session=session_id)
+    metrics.WEBSOCKET_SEND_QUEUE_BYTES.remove(session=session_id)
+
+async def end_session(session_id: str) -> None:
+    """Close a session evicted from the store, wherever it runs."""
+    if worker_pool:
+        await worker_pool.close(session_id)
+    else:
+        await close_session(session_id)
+
+# conversations outlive their websocket, so a client can reconnect and pick up
+# where it left off
+resumable_sessions = SessionStore(
+    end_session,
+    max_sessions=int(os.getenv("MAX_SESSIONS") or DEFAULT_MAX_SESSIONS),
+    idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT") or DEFAULT_IDLE_TIMEOUT),
+)
 
 async def websocket_handler(request):
+    try:
+        ack = parse_ack(request.query.get("ack"))
+    except ValueError as e:
+        return web.Response(status=400, text=str(e))
     ws = web.WebSocketResponse()
     await ws.prepare(request)
-    
+
+    # a reconnecting client passes its session token and the last seq it received
+    connection = resumable_sessions.find(request.query.get("token", ""))
+    if connection:
+        metrics.SESSION_RESUMES.inc()
+    else:
+        connection = ResumableConnection(f"ws-{secrets.token_hex(6)}")
+        await resumable_sessions.add(connection)
+        if worker_pool:
+            await worker_pool.open(connection.session_id)
+        else:
+            await open_session(connection.session_id, connection)
+    session_id = connection.session_id
+    if interface := sessions.get(session_id):
+        interface.transport = request.transport
+
+    session_token = tracing.current_session.set(session_id)
     try:
         connected_clients.add(ws)
+        metrics.ACTIVE_SESSIONS.set(len(connected_clients))
         print(f"Client connected. Total clients: {len(connected_clients)}")
-        
-        interface = WebSocketInterface(ws)
-        
+        await connection.attach(ws, ack=ack)
+
         async for msg in ws:
             if msg.type == web.WSMsgType.TEXT:
                 try:
                     data = json.loads(msg.data)
-                    if "message" in data:
-                        await interface.handle_message(data["message"])
-                    else:
-                        await ws.send_json({"error": "Missing 'message' field in request"})
                 except json.JSONDecodeError:
-                    await ws.send_json({"error": "Invalid JSON format"})
+                    await connection.send_json({"error": "Invalid JSON format"})
+                    continue
+                if isinstance(data.get("ack"), int):
+                    connection.ack(data["ack"])
+                elif data.get("end"):
+                    # the client is done; don't keep the conversation around
+                    await resumable_sessions.evict(session_id)
+                    break
+                elif worker_pool:
+                    await worker_pool.send(session_id, data)
+                else:
+                    await handle_client_data(sessions[session_id], data)
             elif msg.type == web.WSMsgType.ERROR:
                 print(f'WebSocket connection closed with exception {ws.exception()}')
     finally:
-        connected_clients.remove(ws)
+        connection.detach(ws)
+        connected_clients.discard(ws)
+        metrics.ACTIVE_SESSIONS.set(len(connected_clients))
         print(f"Client disconnected. Total clients: {len(connected_clients)}")
-        
+        if tracer := tracing.get_tracer():
+            print(tracing.format_summary(tracer.summary(tracing.current_session.get())))
+        tracing.current_session.reset(session_token)
+
     return ws
 
+async def deliver_from_worker(session_id: str, data: dict | bytes) -> None:
+    """Forward a message from a session's worker to its client."""
+    connection = resumable_sessions.get(session_id)
+    if connection is None:
+        return
+    if isinstance(data, bytes):
+        await connection.send_bytes(data)
+    else:
+        await connection.send_json(data)
+
+class SessionWorker(WorkerHandler):
+    """Hosts sessions inside a worker process started with --worker."""
+
+    async def open(self, session_id: str, connection: WorkerConnection) -> None:
+        await open_session(session_id, connection)
+
+    async def message(self, session_id: str, data: dict[str, Any]) -> None:
+        await handle_client_data(sessions[session_id], data)
+
+    async def close(self, session_id: str) -> None:
+        await close_session(session_id)
+
+async def run_worker():
+    # pooled displays of different workers must not share display numbers
+    index = int(os.getenv("WORKER_INDEX") or 0)
+    await start_display_pool(None, first_display_num=FIRST_DISPLAY_NUM + index * DISPLAY_POOL_SIZE)
+    try:
+        await serve(SessionWorker())
+    finally:
+        await session_manager.close_all()
+        await stop_display_pool(None)
+
+async def metrics_handler(request):
+    for session_id, interface in sessions.items():
+        metrics.SESSION_MEMORY_BYTES.set(
+            metrics.estimate_messages_bytes(interface.messages), session=session_id
+        )
+        metrics.WEBSOCKET_SEND_QUEUE_BYTES.set(interface.send_queue_bytes(), session=session_id)
+    return web.Response(
+        body=metrics.REGISTRY.expose().encode(),
+        headers={"Content-Type": metrics.REGISTRY.content_type},
+    )
+
+async def start_lag_monitor(app):
+    app["lag_monitor"] = asyncio.create_task(metrics.monitor_event_loop_lag())
+
+async def stop_lag_monitor(app):
+    app["lag_monitor"].cancel()
+
+async def close_sessions(app):
+    await resumable_sessions.close_all()
+    await session_manager.close_all()
+
+async def start_session_eviction(app):
+    app["session_eviction"] = asyncio.create_task(resumable_sessions.run_evictions())
+
+async def stop_session_eviction(app):
+    app["session_eviction"].cancel()
+
+async def start_display_pool(app, first_display_num: int = FIRST_DISPLAY_NUM):
+    global display_pool
+    if DISPLAY_POOL_SIZE:
+        display_pool = DisplayPool(
+            DISPLAY_POOL_SIZE,
+            int(os.getenv("WIDTH") or 1024),
+            int(os.getenv("HEIGHT") or 768),
+            first_display_num=first_display_num,
+        )
+        await display_pool.start()
+        print(f"Started {DISPLAY_POOL_SIZE} pooled displays")
+
+async def stop_display_pool(app):
+    if display_pool:
+        await display_pool.close()
+
+async def start_worker_pool(app):
+    global worker_pool
+    if WORKERS:
+        worker_pool = WorkerPool(
+            WORKERS,
+            [sys.executable, os.path.abspath(__file__), "--worker"],
+            deliver_from_worker,
+        )
+        await worker_pool.start()
+        print(f"Started {WORKERS} session workers")
+
+async def stop_worker_pool(app):
+    if worker_pool:
+        await worker_pool.stop()
+
 async def index_handler(request):
     return web.FileResponse(os.path.join(os.path.dirname(__file__), 'static_content', 'index.html'))
 
 def run_server():
     app = web.Application()
     app.router.add_get('/websocket', websocket_handler)  # Changed from /ws to /websocket
+    app.router.add_get('/metrics', metrics_handler)
+    app.on_startup.append(start_lag_monitor)
+    app.on_cleanup.append(stop_lag_monitor)
+    app.on_startup.append(start_session_eviction)
+    app.on_cleanup.append(stop_session_eviction)
+    app.on_shutdown.append(close_sessions)
+    if WORKERS:
+        # the workers lease the displays
+        app.on_startup.append(start_worker_pool)
+        app.on_cleanup.append(stop_worker_pool)
+    else:
+        app.on_startup.append(start_display_pool)
+        app.on_cleanup.append(stop_display_pool)
     app.router.add_get('/', index_handler)
     app.router.add_static('/', path=os.path.join(os.path.dirname(__file__), 'static_content'))
     
@@ -129,4 +422,7 @@ def run_server():
     web.run_app(app, host='0.0.0.0', port=PORT)
 
 if __name__ == "__main__":
-    run_server()
+    if "--worker" in sys.argv:
+        asyncio.run(run_worker())
+    else:
+        run_server()
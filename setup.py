@@ -13,6 +13,7 @@ setup(
         "console_scripts": [
             "computer-control-gui=computer_use_demo.streamlit:main",
             "computer-control=computer_use_demo.terminal:main",
+            "computer-control-batch=computer_use_demo.batch:main",
         ],
     },
 )
\ No newline at end of file
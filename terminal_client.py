@@ -1,147 +1,298 @@
 #!/usr/bin/env python3
 import sys
 import json
-import requests
-from websocket import create_connection
-import threading
-import queue
+import struct
+import asyncio
+import random
 import signal
+import threading
 import time
+from pathlib import Path
+from urllib.parse import urlencode
+
+import aiohttp
 
 # Configuration
 DOCKER_WS_URL = "ws://localhost:8080/websocket"
 DOCKER_HTTP_URL = "http://localhost:8080"
+SCREENSHOT_DIR = Path("screenshots")
+READY_TIMEOUT = 10  # seconds
+RECONNECT_MAX_DELAY = 30  # seconds
+ACK_EVERY = 20  # messages
 
-def check_server_ready():
-    """Check if the computer-control server is running and ready"""
-    max_attempts = 5
-    for attempt in range(max_attempts):
+async def wait_for_server(client, timeout=READY_TIMEOUT):
+    """Poll the server until it answers, backing off from 50ms to 1s."""
+    deadline = time.monotonic() + timeout
+    delay = 0.05
+    while True:
         try:
-            response = requests.get(DOCKER_HTTP_URL)
-            if response.status_code == 200:
-                return True
-        except requests.exceptions.RequestException:
-            if attempt < max_attempts - 1:
-                print(f"Server not ready, retrying in 2 seconds... (attempt {attempt + 1}/{max_attempts})")
-                time.sleep(2)
-            continue
-    return False
+            async with client.get(DOCKER_HTTP_URL, timeout=aiohttp.ClientTimeout(total=2)) as response:
+                if response.status == 200:
+                    return True
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        if time.monotonic() + delay > deadline:
+            return False
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 1.0)
 
 class TerminalClient:
-    def __init__(self):
+    """
+    Reads commands from stdin and events from the server on one event loop, so
+    commands can be typed, queued and stopped while earlier ones are still running.
+    Each command gets an id; the server tags everything it sends for that command
+    with it, and sends `done` when it's finished.
+    """
+
+    def __init__(self, client):
+        self.client = client
         self.ws = None
-        self.message_queue = queue.Queue()
         self.running = True
-        
-        # Set up signal handler for graceful shutdown
-        signal.signal(signal.SIGINT, self.signal_handler)
-        signal.signal(signal.SIGTERM, self.signal_handler)
+        self.closed = asyncio.Event()
+        # commands waiting to be sent, kept across reconnects
+        self.outbox = asyncio.Queue()
+        self.connected = asyncio.Event()
+        self.next_id = 1
+        # id -> command text, for commands the server hasn't finished
+        self.pending = {}
+        # screenshot hash -> saved file; the server sends each image only once
+        self.screenshots = {}
+        self.latest_screenshot = None
+        # content block whose streamed text is being printed, and for which command
+        self.streaming = None
+        # lets a reconnect resume the session and replay only what was missed
+        self.token = None
+        self.last_seq = 0
 
-    def signal_handler(self, signum, frame):
+    def shutdown(self):
         print("\nShutting down...")
         self.running = False
-        if self.ws:
-            self.ws.close()
-        sys.exit(0)
+        self.closed.set()
 
-    def connect(self):
+    async def connect(self):
+        url = DOCKER_WS_URL
+        if self.token:
+            url += "?" + urlencode({"token": self.token, "ack": self.last_seq})
         try:
-            # Add necessary headers for Streamlit WebSocket connection
-            headers = {
-                "User-Agent": "Mozilla/5.0",
-                "Accept": "*/*",
-                "Accept-Language": "en-US,en;q=0.5",
-                "Accept-Encoding": "gzip, deflate, br",
-                "Sec-WebSocket-Version": "13",
-                "Origin": "http://localhost:8080",
-                "Pragma": "no-cache",
-                "Cache-Control": "no-cache"
-            }
-            
-            self.ws = create_connection(DOCKER_WS_URL, header=headers)
-            print("Connected to computer-control server")
-            return True
-        except Exception as e:
+            self.ws = await self.client.ws_connect(url, heartbeat=30)
+        except aiohttp.ClientError as e:
             print(f"Failed to connect: {e}")
             return False
+        self.connected.set()
+        return True
 
-    def receive_messages(self):
+    async def reconnect(self):
+        """Reconnect with exponential backoff until it works or the client quits."""
+        self.connected.clear()
+        delay = 0.5
         while self.running:
-            try:
-                message = self.ws.recv()
-                response = json.loads(message)
-                if "error" in response:
-                    print(f"\nError: {response['error']}")
-                elif "response" in response:
-                    print(f"\nAssistant: {response['response']}")
-                elif "tool_use" in response:
-                    tool = response["tool_use"]
-                    print(f"\nTool Use: {tool['name']}")
-                    print(f"Input: {tool['input']}")
-                elif "function_results" in response:
-                    results = response["function_results"]
-                    if "error" in results:
-                        print(f"\nTool Error: {results['error']}")
-                    if "output" in results:
-                        print(f"\nTool Output: {results['output']}")
-                    if "output_image" in results:
-                        print("\nScreenshot taken")
-            except Exception as e:
-                if self.running:
-                    print(f"\nError receiving message: {e}")
-                break
+            print(f"\nConnection lost, reconnecting in {delay:.1f}s...")
+            await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+            if await self.connect():
+                return True
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        return False
 
-    def send_message(self, message):
-        try:
-            self.ws.send(json.dumps({"message": message}))
-        except Exception as e:
-            print(f"Error sending message: {e}")
+    def send(self, data):
+        """Queue `data` for sending; it goes out as soon as there's a connection."""
+        self.outbox.put_nowait(data)
+
+    def send_command(self, message):
+        request_id = str(self.next_id)
+        self.next_id += 1
+        self.pending[request_id] = message
+        self.send({"message": message, "id": request_id})
+
+    async def send_loop(self):
+        while True:
+            data = await self.outbox.get()
+            while True:
+                await self.connected.wait()
+                try:
+                    await self.ws.send_json(data)
+                    break
+                except (ConnectionError, aiohttp.ClientError):
+                    # receive_loop notices the drop and reconnects; send it again then
+                    self.connected.clear()
+
+    async def receive_loop(self):
+        while self.running:
+            msg = await self.ws.receive()
+            if msg.type == aiohttp.WSMsgType.BINARY:
+                self.save_frame(msg.data)
+            elif msg.type == aiohttp.WSMsgType.TEXT:
+                self.handle_event(json.loads(msg.data))
+            elif msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                if not (self.running and await self.reconnect()):
+                    break
+        self.closed.set()
+
+    def save_frame(self, frame):
+        """Save a binary screenshot frame: two lengths, a JSON header, then the PNG."""
+        header_len, image_len = struct.unpack_from("!II", frame)
+        header = json.loads(frame[8:8 + header_len])
+        SCREENSHOT_DIR.mkdir(exist_ok=True)
+        path = SCREENSHOT_DIR / f"{header['sha256'][:16]}-{header['size']}.png"
+        path.write_bytes(frame[8 + header_len:8 + header_len + image_len])
+        self.screenshots[header["sha256"]] = path
+        if header["size"] == "full":
+            self.print_event(None, f"Full screenshot saved to {path}")
+
+    def label(self, request_id):
+        """Output is labelled with its command while several are queued."""
+        return f"[{request_id}] " if request_id and len(self.pending) > 1 else ""
+
+    def print_event(self, request_id, text):
+        if self.streaming is not None:
+            print()
+            self.streaming = None
+        print(f"\n{self.label(request_id)}{text}")
+
+    def handle_event(self, event):
+        if "seq" in event:
+            self.last_seq = event["seq"]
+            if self.last_seq % ACK_EVERY == 0:
+                self.send({"ack": self.last_seq})
+        request_id = event.get("id")
+        if "session" in event:
+            session = event["session"]
+            self.token = session["token"]
+            if session["resumed"]:
+                self.print_event(None, "Reconnected to the conversation.")
+            if session["lost"]:
+                self.print_event(None, f"({session['lost']} messages were lost while disconnected)")
+        elif "queued" in event:
+            if event["queued"]:
+                self.print_event(request_id, f"Queued behind {event['queued']} command(s).")
+        elif "done" in event:
+            self.pending.pop(request_id, None)
+            if self.streaming is not None:
+                print()
+                self.streaming = None
+        elif "error" in event:
+            self.print_event(request_id, f"Error: {event['error']}")
+        elif "status" in event:
+            # stopping or clearing drops every queued command
+            self.pending.clear()
+            self.print_event(None, f"Conversation {event['status']}.")
+        elif "delta" in event:
+            delta = event["delta"]
+            if self.streaming != (request_id, delta["block"]):
+                if self.streaming is not None:
+                    print()
+                print(f"\n{self.label(request_id)}Assistant: ", end="")
+                self.streaming = (request_id, delta["block"])
+            print(delta["text"], end="", flush=True)
+        elif "response" in event:
+            if self.streaming is not None:
+                # already printed as it streamed in
+                print()
+                self.streaming = None
+            else:
+                self.print_event(request_id, f"Assistant: {event['response']}")
+        elif "tool_use" in event:
+            tool = event["tool_use"]
+            self.print_event(request_id, f"Tool Use: {tool['name']}\nInput: {tool['input']}")
+        elif "function_results" in event:
+            results = event["function_results"]
+            if "error" in results:
+                self.print_event(request_id, f"Tool Error: {results['error']}")
+            if "output" in results:
+                self.print_event(request_id, f"Tool Output: {results['output']}")
+            if "image" in results:
+                self.latest_screenshot = results["image"]
+                self.print_event(request_id, f"Screenshot: {self.screenshots.get(results['image'])}")
+            elif "output_image" in results:
+                self.print_event(request_id, "Screenshot taken")
+
+    async def input_loop(self):
+        """
+        Read commands from stdin without blocking the event loop. They're read in a
+        thread: `connect_read_pipe` would make stdin non-blocking, and on a terminal
+        stdout shares that flag, so large prints could fail with BlockingIOError.
+        """
+        loop = asyncio.get_running_loop()
+        lines = asyncio.Queue()
+
+        def read():
+            while True:
+                line = sys.stdin.readline()
+                try:
+                    loop.call_soon_threadsafe(lines.put_nowait, line)
+                except RuntimeError:
+                    return  # the event loop is closed
+                if not line:
+                    return
 
-    def run(self):
-        if not self.connect():
+        # a daemon, so a read still waiting for input doesn't keep the process alive
+        threading.Thread(target=read, name="stdin-reader", daemon=True).start()
+        while self.running:
+            line = await lines.get()
+            if not line:
+                break
+            message = line.strip()
+            if message.lower() == 'exit':
+                break
+            elif message.lower() == 'clear':
+                # Send a special message to clear the conversation
+                self.send({"message": "!clear"})
+            elif message.lower() == 'stop':
+                self.send({"message": "!stop"})
+            elif message.lower() == 'screenshot':
+                if self.latest_screenshot:
+                    self.send({"screenshot": self.latest_screenshot})
+                else:
+                    print("No screenshot yet.")
+            elif message:
+                self.send_command(message)
+        self.closed.set()
+
+    async def run(self):
+        if not await self.connect():
             return
 
-        # Start message receiving thread
-        receive_thread = threading.Thread(target=self.receive_messages)
-        receive_thread.daemon = True
-        receive_thread.start()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.shutdown)
 
+        print("Connected to computer-control server")
         print("\nComputer Control Terminal Interface")
         print("---------------------------------------")
         print("You can:")
         print("1. Type natural language commands for Claude")
         print("   Example: 'Open Firefox and go to google.com'")
-        print("2. Press Ctrl+C to quit")
+        print("   Commands typed while one is running are queued")
+        print("2. Press Ctrl+C or type 'exit' to quit")
         print("3. Type 'clear' to clear the conversation")
+        print("4. Type 'stop' to interrupt the current task and drop queued ones")
+        print("5. Type 'screenshot' to download the latest screenshot in full size")
         print("---------------------------------------")
 
+        tasks = [
+            asyncio.create_task(self.input_loop()),
+            asyncio.create_task(self.receive_loop()),
+            asyncio.create_task(self.send_loop()),
+        ]
         try:
-            while self.running:
-                message = input("\nYou: ").strip()
-                
-                if message.lower() == 'clear':
-                    # Send a special message to clear the conversation
-                    self.send_message("!clear")
-                    print("\nConversation cleared.")
-                    continue
-                elif message:
-                    self.send_message(message)
-        except KeyboardInterrupt:
-            pass
+            await self.closed.wait()
         finally:
             self.running = False
-            if self.ws:
-                self.ws.close()
-
-def main():
-    # Check if server is ready before starting the client
-    if not check_server_ready():
-        print("Error: Computer-control server is not running or not accessible.")
-        print("Make sure to run 'docker-compose up computer-control' first.")
-        sys.exit(1)
-        
-    client = TerminalClient()
-    client.run()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if self.ws and not self.ws.closed:
+                # the server can drop the conversation now
+                await self.ws.send_json({"end": True})
+                await self.ws.close()
+
+async def main():
+    async with aiohttp.ClientSession() as client:
+        # Check if server is ready before starting the client
+        if not await wait_for_server(client):
+            print("Error: Computer-control server is not running or not accessible.")
+            print("Make sure to run 'docker-compose up computer-control' first.")
+            sys.exit(1)
+        await TerminalClient(client).run()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
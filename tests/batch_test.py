@@ -0,0 +1,144 @@
+import json
+from contextlib import asynccontextmanager
+
+from computer_use_demo.batch import BatchRunner, Task, read_tasks
+from computer_use_demo.loop import APIProvider
+from computer_use_demo.replay import (
+    Cassette,
+    Exchange,
+    ReplayConfig,
+    request_key,
+    serve_in_thread,
+)
+from computer_use_demo.tools import ToolCollection
+
+
+def _exchange(prompt: str, text: str, output_tokens: int) -> Exchange:
+    user = {"role": "user", "content": [{"type": "text", "text": prompt}]}
+    return Exchange(
+        key=request_key([user]),
+        turn=1,
+        latency=0.0,
+        status=200,
+        response={
+            "id": "msg_1",
+            "type": "message",
+            "role": "assistant",
+            "model": "test-model",
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": 10, "output_tokens": output_tokens},
+        },
+    )
+
+
+def test_read_tasks_applies_defaults(tmp_path):
+    path = tmp_path / "tasks.jsonl"
+    path.write_text(
+        '{"id": "a", "prompt": "one", "max_tokens": 5}\n\n{"prompt": "two"}\n'
+    )
+    assert read_tasks(path, max_seconds=60, max_tokens=100) == [
+        Task("a", "one", max_seconds=60, max_tokens=5),
+        Task("3", "two", max_seconds=60, max_tokens=100),
+    ]
+
+
+async def test_runs_tasks_within_budgets(tmp_path, monkeypatch):
+    # tasks get a fresh collection each; the replayed model never calls tools
+    monkeypatch.setattr(
+        "computer_use_demo.batch.ToolCollection", lambda *tools: ToolCollection()
+    )
+    cassette = Cassette(tmp_path / "cassette.jsonl")
+    cassette.add(_exchange("Say hi", "Hi!", output_tokens=5))
+    cassette.add(_exchange("Write an essay", "It was...", output_tokens=500))
+    output = tmp_path / "results.jsonl"
+    with serve_in_thread(cassette, ReplayConfig()) as server:
+        runner = BatchRunner(
+            model="test-model",
+            provider=APIProvider.ANTHROPIC,
+            api_key="test-key",
+            output=output,
+            workers=2,
+            base_url=server.base_url,
+        )
+        summary = await runner.run(
+            [
+                Task("hi", "Say hi"),
+                Task("essay", "Write an essay", max_tokens=100),
+                Task("unknown", "Not recorded"),
+            ]
+        )
+
+    results = {
+        result["id"]: result
+        for result in map(json.loads, output.read_text().split("\n")[:-1])
+    }
+    assert results["hi"]["status"] == "completed"
+    assert results["hi"]["final_text"] == "Hi!"
+    assert results["hi"]["api_calls"] == 1
+    assert results["hi"]["usage"]["output_tokens"] == 5
+    assert results["essay"]["status"] == "token_budget"
+    assert results["essay"]["usage"]["output_tokens"] == 500
+    assert results["unknown"]["status"] == "error"
+    assert results["unknown"]["error"]
+    assert summary["tasks"] == 3
+    assert summary["statuses"] == {"completed": 1, "token_budget": 1, "error": 1}
+    assert summary["tasks_per_hour"] > 0
+
+
+class _Display:
+    def __init__(self, closed: list[str]):
+        self.closed = closed
+
+    def tool_collection(self) -> ToolCollection:
+        closed = self.closed
+
+        class Tools(ToolCollection):
+            async def close(self) -> None:
+                closed.append("tools")
+
+        return Tools()
+
+
+class _DisplayPool:
+    def __init__(self):
+        self.closed: list[str] = []
+        self.leases = 0
+
+    @asynccontextmanager
+    async def lease(self):
+        self.leases += 1
+        if self.leases == 1:
+            raise RuntimeError("no display")
+        yield _Display(self.closed)
+        self.closed.append("display")
+
+
+async def test_a_failed_task_does_not_stop_the_others(tmp_path):
+    cassette = Cassette(tmp_path / "cassette.jsonl")
+    cassette.add(_exchange("Say hi", "Hi!", output_tokens=5))
+    output = tmp_path / "results.jsonl"
+    display_pool = _DisplayPool()
+    with serve_in_thread(cassette, ReplayConfig()) as server:
+        runner = BatchRunner(
+            model="test-model",
+            provider=APIProvider.ANTHROPIC,
+            api_key="test-key",
+            output=output,
+            workers=1,
+            base_url=server.base_url,
+            display_pool=display_pool,  # type: ignore[arg-type]
+        )
+        summary = await runner.run([Task("first", "Say hi"), Task("hi", "Say hi")])
+
+    results = {
+        result["id"]: result
+        for result in map(json.loads, output.read_text().split("\n")[:-1])
+    }
+    assert results["first"]["status"] == "error"
+    assert results["first"]["error"] == "RuntimeError: no display"
+    assert results["hi"]["status"] == "completed"
+    assert summary["statuses"] == {"completed": 1, "error": 1}
+    # the tools are closed before the display goes back to the pool
+    assert display_pool.closed == ["tools", "display"]
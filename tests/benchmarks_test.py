@@ -0,0 +1,27 @@
+from benchmarks.common import Timings, compare, percentile, report, summarize
+
+
+def test_percentile():
+    samples = [float(i) for i in range(1, 101)]
+    assert percentile(samples, 50) == 50.0
+    assert percentile(samples, 99) == 99.0
+    assert percentile([], 50) == 0.0
+
+
+def test_summarize_reports_milliseconds():
+    summary = summarize([0.001, 0.002, 0.003])
+    assert summary["p50"] == 2.0
+    assert summary["n"] == 3
+
+
+def test_compare_flags_regressions():
+    timings = Timings()
+    timings.add("click", 0.010)
+    baseline = report("test", {"computer": timings.summary()})
+
+    slower = Timings()
+    slower.add("click", 0.015)
+    assert compare(report("test", {"computer": slower.summary()}), baseline) == [
+        "computer.click: p50 10.000ms -> 15.000ms (+50%)"
+    ]
+    assert compare(baseline, baseline) == []
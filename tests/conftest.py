@@ -6,7 +6,9 @@ import pytest
 
 @pytest.fixture(autouse=True)
 def mock_screen_dimensions():
+    # tools don't start warm bash shells unless a test asks for them
     with mock.patch.dict(
-        os.environ, {"HEIGHT": "768", "WIDTH": "1024", "DISPLAY_NUM": "1"}
+        os.environ,
+        {"HEIGHT": "768", "WIDTH": "1024", "DISPLAY_NUM": "1", "BASH_POOL_SIZE": "0"},
     ):
         yield
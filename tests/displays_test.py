@@ -0,0 +1,85 @@
+import asyncio
+import shutil
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from computer_use_demo.displays import Display, DisplayPool
+from computer_use_demo.tools import ComputerTool
+
+
+@pytest.fixture
+def pool():
+    pool = DisplayPool(2, 1280, 800, first_display_num=200)
+    with patch.object(
+        pool,
+        "_start_display",
+        side_effect=lambda n: Display(n, pool.width, pool.height),
+    ) as start_display:
+        pool.start_display = start_display
+        yield pool
+
+
+async def test_lease_and_recycle(pool):
+    with patch.object(pool, "_healthy", new_callable=AsyncMock, return_value=True):
+        await pool.start()
+        assert pool.start_display.call_count == 2
+
+        first = await pool.acquire()
+        second = await pool.acquire()
+        assert {first.display_num, second.display_num} == {200, 201}
+        with pytest.raises(TimeoutError):
+            async with asyncio.timeout(0.05):
+                await pool.acquire()
+
+        pool.release(first)
+        async with asyncio.timeout(1):
+            recycled = await pool.acquire()
+        assert recycled.display_num == first.display_num
+        assert recycled is not first
+        assert pool.start_display.call_count == 3
+    await pool.close()
+
+
+async def test_unhealthy_display_is_replaced(pool):
+    await pool.start()
+    with patch.object(
+        pool, "_healthy", new_callable=AsyncMock, side_effect=[False, True]
+    ):
+        async with asyncio.timeout(1):
+            display = await pool.acquire()
+    assert display.display_num == 201
+    await asyncio.sleep(0.01)
+    assert pool.start_display.call_count == 3
+    pool.release(display)
+    await pool.close()
+
+
+def test_display_tool_collection():
+    display = Display(7, 1280, 800)
+    tools = display.tool_collection()
+    computer = tools.tool_map["computer"]
+    assert isinstance(computer, ComputerTool)
+    assert computer.display_num == 7
+    assert computer.xdotool == "DISPLAY=:7 xdotool"
+    assert computer.to_params()["display_width_px"] == 1280
+    assert tools.tool_map["bash"]._env["DISPLAY"] == ":7"
+
+
+@pytest.mark.skipif(shutil.which("Xvfb") is None, reason="Xvfb is not installed")
+async def test_real_displays():
+    pool = DisplayPool(2, 640, 480, first_display_num=210, window_manager=False)
+    await pool.start()
+    try:
+        async with pool.lease() as one, pool.lease() as two:
+            assert one.display_num != two.display_num
+            for display in (one, two):
+                process = await asyncio.create_subprocess_exec(
+                    "xdpyinfo",
+                    env=display.env,
+                    stdout=asyncio.subprocess.PIPE,
+                )
+                stdout, _ = await process.communicate()
+                assert b"640x480" in stdout
+    finally:
+        await pool.close()
@@ -0,0 +1,299 @@
+import asyncio
+
+import pytest
+
+from computer_use_demo import metrics
+from computer_use_demo.events import EVENT_OVERHEAD_BYTES, EventQueue, TextDelta
+from computer_use_demo.loop import APIProvider, sampling_loop
+from computer_use_demo.replay import (
+    Cassette,
+    Exchange,
+    ReplayConfig,
+    request_key,
+    serve_in_thread,
+)
+from computer_use_demo.tools import ToolResult
+
+SCREENSHOT = "x" * 10_000
+
+
+async def test_sync_and_async_callbacks_in_order():
+    delivered = []
+
+    def sync_callback(value):
+        delivered.append(("sync", value))
+
+    async def async_callback(value):
+        await asyncio.sleep(0.01)
+        delivered.append(("async", value))
+
+    async with EventQueue() as events:
+        await events.publish(async_callback, 1)
+        await events.publish(sync_callback, 2)
+        await events.publish(async_callback, 3)
+    assert delivered == [("async", 1), ("sync", 2), ("async", 3)]
+
+
+async def test_slow_subscriber_does_not_block_publisher():
+    release = asyncio.Event()
+
+    async def slow_callback(value):
+        await release.wait()
+
+    events = EventQueue()
+    async with asyncio.timeout(1):
+        for value in range(100):
+            await events.publish(slow_callback, value)
+    release.set()
+    await events.aclose()
+
+
+async def test_drop_screenshots_keeps_messages():
+    release = asyncio.Event()
+    delivered: list[ToolResult] = []
+
+    async def tool_output_callback(result: ToolResult, tool_id: str):
+        await release.wait()
+        delivered.append(result)
+
+    dropped = metrics.EVENTS_DROPPED.value(dropped="screenshot")
+    events = EventQueue(max_bytes=3 * (len(SCREENSHOT) + EVENT_OVERHEAD_BYTES))
+    for index in range(6):
+        result = ToolResult(output=str(index), base64_image=SCREENSHOT)
+        await events.publish(tool_output_callback, result, str(index))
+    assert events.queued_bytes <= events.max_bytes
+    release.set()
+    await events.aclose()
+
+    assert [result.output for result in delivered] == [str(i) for i in range(6)]
+    assert delivered[-1].base64_image == SCREENSHOT
+    assert any(result.base64_image is None for result in delivered)
+    assert metrics.EVENTS_DROPPED.value(dropped="screenshot") > dropped
+
+
+async def test_drop_oldest():
+    release = asyncio.Event()
+    delivered = []
+
+    async def callback(value):
+        await release.wait()
+        delivered.append(value)
+
+    events = EventQueue(max_bytes=3 * EVENT_OVERHEAD_BYTES, overflow="drop_oldest")
+    for value in range(10):
+        await events.publish(callback, value)
+        await asyncio.sleep(0)
+    release.set()
+    await events.aclose()
+    assert delivered[0] == 0
+    assert delivered[-3:] == [7, 8, 9]
+    assert len(delivered) == 4
+
+
+async def test_block_waits_for_consumer():
+    release = asyncio.Event()
+
+    async def callback(value):
+        await release.wait()
+
+    events = EventQueue(max_bytes=2 * EVENT_OVERHEAD_BYTES, overflow="block")
+    for value in range(3):
+        await events.publish(callback, value)
+    with pytest.raises(TimeoutError):
+        async with asyncio.timeout(0.1):
+            await events.publish(callback, 3)
+    release.set()
+    async with asyncio.timeout(1):
+        await events.publish(callback, 4)
+    await events.aclose()
+
+
+async def test_text_deltas_coalesce_behind_slow_subscriber():
+    release = asyncio.Event()
+    delivered: list[TextDelta] = []
+
+    async def text_delta_callback(delta):
+        await release.wait()
+        delivered.append(delta)
+
+    async with EventQueue() as events:
+        for seq, text in enumerate("abcd", 1):
+            await events.publish(text_delta_callback, TextDelta(0, text, seq))
+            await asyncio.sleep(0)
+        await events.publish(text_delta_callback, TextDelta(1, "e", 5))
+        release.set()
+    # the first delta was already being delivered when the rest arrived
+    assert delivered == [
+        TextDelta(0, "a", 1),
+        TextDelta(0, "bcd", 4),
+        TextDelta(1, "e", 5),
+    ]
+
+
+async def test_failing_callback_does_not_stop_delivery():
+    delivered = []
+
+    def callback(value):
+        if value == 1:
+            raise ValueError("boom")
+        delivered.append(value)
+
+    loop = asyncio.get_running_loop()
+    errors = []
+    loop.set_exception_handler(lambda loop, context: errors.append(context))
+    try:
+        async with EventQueue() as events:
+            for value in range(3):
+                await events.publish(callback, value)
+    finally:
+        loop.set_exception_handler(None)
+    assert delivered == [0, 2]
+    assert isinstance(errors[0]["exception"], ValueError)
+
+
+async def test_sampling_loop_awaits_async_callbacks(tmp_path):
+    user = {"role": "user", "content": [{"type": "text", "text": "Hello"}]}
+    cassette = Cassette(tmp_path / "cassette.jsonl")
+    cassette.add(
+        Exchange(
+            key=request_key([user]),
+            turn=1,
+            latency=0.0,
+            status=200,
+            response={
+                "id": "msg_1",
+                "type": "message",
+                "role": "assistant",
+                "model": "test-model",
+                "content": [{"type": "text", "text": "Hi"}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": {"input_tokens": 1, "output_tokens": 1},
+            },
+        )
+    )
+    outputs = []
+    responses = []
+
+    async def output_callback(block):
+        await asyncio.sleep(0.01)
+        outputs.append(block)
+
+    async def api_response_callback(request, response, error):
+        responses.append(error)
+
+    with serve_in_thread(cassette) as server:
+        await sampling_loop(
+            model="test-model",
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix="",
+            messages=[user],
+            output_callback=output_callback,
+            tool_output_callback=lambda result, tool_id: None,
+            api_response_callback=api_response_callback,
+            api_key="test-key",
+            base_url=server.base_url,
+        )
+    assert outputs == [{"type": "text", "text": "Hi"}]
+    assert responses == [None]
+
+
+async def test_sampling_loop_streams_text(tmp_path):
+    user = {"role": "user", "content": [{"type": "text", "text": "Hello"}]}
+    text = "Hello there, streaming world!"
+    cassette = Cassette(tmp_path / "cassette.jsonl")
+    cassette.add(
+        Exchange(
+            key=request_key([user]),
+            turn=1,
+            latency=0.0,
+            status=200,
+            response={
+                "id": "msg_1",
+                "type": "message",
+                "role": "assistant",
+                "model": "test-model",
+                "content": [{"type": "text", "text": text}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": {"input_tokens": 1, "output_tokens": 1},
+            },
+        )
+    )
+    deltas: list[TextDelta] = []
+    outputs = []
+    first_tokens = metrics.TIME_TO_FIRST_TOKEN_SECONDS.count(provider="anthropic")
+
+    with serve_in_thread(cassette, ReplayConfig(chunk_size=4)) as server:
+        await sampling_loop(
+            model="test-model",
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix="",
+            messages=[user],
+            output_callback=outputs.append,
+            tool_output_callback=lambda result, tool_id: None,
+            api_response_callback=lambda request, response, error: None,
+            api_key="test-key",
+            base_url=server.base_url,
+            text_delta_callback=deltas.append,
+        )
+    assert "".join(delta.text for delta in deltas) == text
+    assert [delta.seq for delta in deltas] == sorted({delta.seq for delta in deltas})
+    assert outputs == [{"type": "text", "text": text}]
+    assert (
+        metrics.TIME_TO_FIRST_TOKEN_SECONDS.count(provider="anthropic")
+        == first_tokens + 1
+    )
+
+
+async def test_sampling_loop_publishes_to_an_empty_caller_queue(tmp_path):
+    user = {"role": "user", "content": [{"type": "text", "text": "Hello"}]}
+    cassette = Cassette(tmp_path / "cassette.jsonl")
+    cassette.add(
+        Exchange(
+            key=request_key([user]),
+            turn=1,
+            latency=0.0,
+            status=200,
+            response={
+                "id": "msg_1",
+                "type": "message",
+                "role": "assistant",
+                "model": "test-model",
+                "content": [{"type": "text", "text": "Hi"}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": {"input_tokens": 1, "output_tokens": 1},
+            },
+        )
+    )
+    delivered = asyncio.Event()
+    outputs = []
+
+    async def output_callback(block):
+        await delivered.wait()
+        outputs.append(block)
+
+    # empty, so falsy: it must still be used rather than replaced
+    events = EventQueue()
+    with serve_in_thread(cassette) as server:
+        # the loop doesn't wait for the caller's subscribers
+        await asyncio.wait_for(
+            sampling_loop(
+                model="test-model",
+                provider=APIProvider.ANTHROPIC,
+                system_prompt_suffix="",
+                messages=[user],
+                output_callback=output_callback,
+                tool_output_callback=lambda result, tool_id: None,
+                api_response_callback=lambda request, response, error: None,
+                api_key="test-key",
+                base_url=server.base_url,
+                event_queue=events,
+            ),
+            timeout=10,
+        )
+    assert outputs == []
+    delivered.set()
+    await events.aclose()
+    assert outputs == [{"type": "text", "text": "Hi"}]
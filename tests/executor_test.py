@@ -0,0 +1,222 @@
+import asyncio
+import base64
+import time
+
+import pytest
+
+from computer_use_demo.executor import (
+    FRAME_HEADER,
+    MAX_FRAME_BYTES,
+    ExecutorClient,
+    ExecutorServer,
+    RemoteToolCollection,
+    encode_frame,
+    read_frame,
+)
+from computer_use_demo.tools import BashTool, EditTool, ToolCollection, ToolResult
+from computer_use_demo.tools.base import BaseAnthropicTool
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 10
+
+
+class FakeScreenshotTool(BaseAnthropicTool):
+    async def __call__(self, **kwargs):
+        return ToolResult(output="shot", base64_image=base64.b64encode(PNG).decode())
+
+    def to_params(self):
+        return {"name": "screenshot", "type": "custom", "input_schema": {}}
+
+
+class BrokenTool(BaseAnthropicTool):
+    async def __call__(self, **kwargs):
+        raise KeyError("missing")
+
+    def to_params(self):
+        return {"name": "broken", "type": "custom", "input_schema": {}}
+
+
+@pytest.fixture
+async def executor():
+    server = ExecutorServer(
+        lambda: ToolCollection(
+            FakeScreenshotTool(), BashTool(), EditTool(), BrokenTool()
+        )
+    )
+    await server.start()
+    client = ExecutorClient(port=server.port, max_connections=2)
+    yield client
+    await client.close()
+    await server.stop()
+
+
+async def test_remote_tools(executor, tmp_path):
+    tools = await RemoteToolCollection.connect(executor, "s1")
+    assert [tool["name"] for tool in tools.to_params()] == [
+        "screenshot",
+        "bash",
+        "str_replace_editor",
+        "broken",
+    ]
+
+    result = await tools.run(name="screenshot", tool_input={})
+    assert result.output == "shot"
+    assert base64.b64decode(result.base64_image) == PNG
+
+    path = tmp_path / "notes.txt"
+    await tools.run(
+        name="str_replace_editor",
+        tool_input={"command": "create", "path": str(path), "file_text": "hello"},
+    )
+    assert path.read_text() == "hello"
+
+    result = await tools.run(name="nope", tool_input={})
+    assert result.error == "Tool nope is invalid"
+
+
+async def test_executor_errors_are_tool_failures(executor):
+    tools = await RemoteToolCollection.connect(executor, "s1")
+    result = await tools.run(name="broken", tool_input={})
+    assert result.error == "Tool executor failed: KeyError: 'missing'"
+
+
+async def test_malformed_requests_get_an_error():
+    server = ExecutorServer(lambda: ToolCollection(BashTool()))
+    await server.start()
+    reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+    try:
+        for request in (
+            [1, 2],
+            {"op": "describe", "session": "s1"},
+            {"id": 1, "op": "describe"},
+            {"id": 2, "op": "run", "session": "s1", "tool": "bash"},
+        ):
+            writer.write(encode_frame(request))  # type: ignore[arg-type]
+            response, _ = await read_frame(reader)
+            assert response["error"].startswith("ValueError: ")
+        assert not server._sessions
+
+        # the connection is still usable
+        writer.write(encode_frame({"id": 3, "op": "describe", "session": "s1"}))
+        response, _ = await read_frame(reader)
+        assert response["id"] == 3
+        assert [tool["name"] for tool in response["result"]["tools"]] == ["bash"]
+    finally:
+        writer.close()
+        await server.stop()
+
+
+async def test_sessions_have_their_own_shells(executor):
+    first = await RemoteToolCollection.connect(executor, "first")
+    second = await RemoteToolCollection.connect(executor, "second")
+    await first.run(name="bash", tool_input={"command": "export WHO=first"})
+    await second.run(name="bash", tool_input={"command": "export WHO=second"})
+    result = await first.run(name="bash", tool_input={"command": "echo $WHO"})
+    assert result.output == "first"
+
+    await first.close()
+    result = await first.run(name="bash", tool_input={"command": "echo ${WHO:-new}"})
+    assert result.output == "new"
+
+
+async def test_requests_are_pipelined(executor):
+    sessions = [await RemoteToolCollection.connect(executor, f"s{i}") for i in range(8)]
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            tools.run(name="bash", tool_input={"command": f"sleep 0.5; echo {i}"})
+            for i, tools in enumerate(sessions)
+        )
+    )
+    assert time.perf_counter() - started < 2.0
+    assert [result.output for result in results] == [str(i) for i in range(8)]
+    assert len(executor._connections) <= 2
+
+
+async def test_cancel_kills_remote_command(executor, tmp_path):
+    tools = await RemoteToolCollection.connect(executor, "s1")
+    marker = tmp_path / "marker"
+    run = asyncio.create_task(
+        tools.run(name="bash", tool_input={"command": f"sleep 1; touch {marker}"})
+    )
+    await asyncio.sleep(0.2)
+    run.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await run
+    await asyncio.sleep(1.2)
+    assert not marker.exists()
+    result = await tools.run(name="bash", tool_input={"command": "echo alive"})
+    assert result.output == "alive"
+
+
+async def test_executor_unavailable():
+    server = ExecutorServer()
+    await server.start()
+    port = server.port
+    await server.stop()
+    tools = RemoteToolCollection(ExecutorClient(port=port), "s1", [])
+    result = await tools.run(name="bash", tool_input={"command": "true"})
+    assert result.error and result.error.startswith("Tool executor is unavailable")
+
+
+async def test_token_is_required():
+    server = ExecutorServer(lambda: ToolCollection(BashTool()), token="secret")
+    await server.start()
+    try:
+        for token in (None, "wrong"):
+            client = ExecutorClient(port=server.port, token=token)
+            tools = RemoteToolCollection(client, "s1", [])
+            result = await tools.run(name="bash", tool_input={"command": "true"})
+            assert result.error and result.error.startswith(
+                "Tool executor is unavailable"
+            )
+            assert not server._sessions
+            await client.close()
+
+        client = ExecutorClient(port=server.port, token="secret")
+        tools = await RemoteToolCollection.connect(client, "s1")
+        result = await tools.run(name="bash", tool_input={"command": "echo ok"})
+        assert result.output == "ok"
+        await client.close()
+    finally:
+        await server.stop()
+
+
+async def test_unreadable_response_fails_pending_requests():
+    async def respond_with_oversized_frame(reader, writer):
+        await reader.read(1)
+        writer.write(FRAME_HEADER.pack(MAX_FRAME_BYTES, 1))
+        await writer.drain()
+
+    server = await asyncio.start_server(respond_with_oversized_frame, "127.0.0.1", 0)
+    client = ExecutorClient(port=server.sockets[0].getsockname()[1], token="")
+    try:
+        async with asyncio.timeout(5):
+            with pytest.raises(ConnectionError, match="too large"):
+                await client.request({"op": "describe", "session": "s1"})
+    finally:
+        await client.close()
+        server.close()
+
+
+async def test_abandoned_sessions_expire():
+    server = ExecutorServer(lambda: ToolCollection(BashTool()), session_grace=0.2)
+    await server.start()
+    try:
+        client = ExecutorClient(port=server.port)
+        tools = await RemoteToolCollection.connect(client, "s1")
+        await tools.run(name="bash", tool_input={"command": "true"})
+        bash = server._sessions["s1"].tool_map["bash"]
+        process = bash._session._process
+
+        # a client that reconnects within the grace period keeps its session
+        await client.close()
+        await asyncio.sleep(0.05)
+        await tools.run(name="bash", tool_input={"command": "export KEPT=1"})
+        assert "s1" in server._sessions
+
+        await client.close()
+        async with asyncio.timeout(5):
+            await process.wait()
+        assert "s1" not in server._sessions
+    finally:
+        await server.stop()
@@ -3,7 +3,14 @@ from unittest import mock
 from anthropic.types import TextBlock, ToolUseBlock
 from anthropic.types.beta import BetaMessage, BetaMessageParam, BetaTextBlockParam
 
-from computer_use_demo.loop import APIProvider, sampling_loop
+from computer_use_demo.loop import (
+    INTERRUPT_TEXT,
+    INTERRUPT_TOOL_ERROR,
+    APIProvider,
+    heal_interrupted_messages,
+    sampling_loop,
+)
+from computer_use_demo.tools import ComputerTool, ToolCollection
 
 
 async def test_loop():
@@ -23,6 +30,7 @@ async def test_loop():
     ]
 
     tool_collection = mock.AsyncMock()
+    tool_collection.to_params = mock.Mock(return_value=[])
     tool_collection.run.return_value = mock.Mock(
         output="Tool output", error=None, base64_image=None
     )
@@ -64,3 +72,67 @@ async def test_loop():
         assert output_callback.call_count == 3
         assert tool_output_callback.call_count == 1
         assert api_response_callback.call_count == 2
+
+
+async def test_system_prompt_names_the_tools_display():
+    client = mock.Mock()
+    client.beta.messages.with_raw_response.create.return_value.parse.return_value = (
+        mock.Mock(spec=BetaMessage, content=[TextBlock(type="text", text="Done")])
+    )
+    tools = ToolCollection(ComputerTool(display_num=10, width=1024, height=768))
+
+    with mock.patch("computer_use_demo.loop.Anthropic", return_value=client):
+        await sampling_loop(
+            model="test-model",
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix="",
+            messages=[{"role": "user", "content": "Open xterm"}],
+            output_callback=mock.Mock(),
+            tool_output_callback=mock.Mock(),
+            api_response_callback=mock.Mock(),
+            api_key="test-key",
+            tool_collection=tools,
+        )
+
+    (system,) = client.beta.messages.with_raw_response.create.call_args.kwargs["system"]
+    assert '"(DISPLAY=:10 xterm &)"' in system["text"]
+    assert "DISPLAY=:1 " not in system["text"]
+
+
+def test_heal_interrupted_messages():
+    messages: list[BetaMessageParam] = [
+        {"role": "user", "content": "Test message"},
+        {
+            "role": "assistant",
+            "content": [
+                {"type": "tool_use", "id": "1", "name": "computer", "input": {}},
+                {"type": "tool_use", "id": "2", "name": "bash", "input": {}},
+            ],
+        },
+    ]
+    assert heal_interrupted_messages(messages) == ["1", "2"]
+    assert messages[-1] == {
+        "role": "user",
+        "content": [
+            {
+                "type": "tool_result",
+                "tool_use_id": "1",
+                "content": INTERRUPT_TOOL_ERROR,
+                "is_error": True,
+            },
+            {
+                "type": "tool_result",
+                "tool_use_id": "2",
+                "content": INTERRUPT_TOOL_ERROR,
+                "is_error": True,
+            },
+            {"type": "text", "text": INTERRUPT_TEXT},
+        ],
+    }
+
+    messages = [{"role": "user", "content": "Test message"}]
+    assert heal_interrupted_messages(messages) == []
+    assert messages[-1]["content"] == [
+        {"type": "text", "text": "Test message"},
+        {"type": "text", "text": INTERRUPT_TEXT},
+    ]
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from computer_use_demo import metrics
+from computer_use_demo.metrics import Counter, Gauge, Histogram, Registry
+from computer_use_demo.tools import BashTool, EditTool, ToolCollection
+
+
+def test_exposition_format():
+    registry = Registry()
+    requests = registry.register(
+        Counter("requests_total", "Requests.", labels=("path",))
+    )
+    inflight = registry.register(Gauge("inflight", "In flight."))
+    latency = registry.register(
+        Histogram("latency_seconds", "Latency.", labels=("tool",), buckets=(0.1, 1))
+    )
+
+    requests.inc(path='/a"b')
+    inflight.inc()
+    latency.observe(0.05, tool="bash")
+    latency.observe(0.5, tool="bash")
+    latency.observe(5, tool="bash")
+
+    assert registry.expose() == (
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{path="/a\\"b"} 1\n'
+        "# HELP inflight In flight.\n"
+        "# TYPE inflight gauge\n"
+        "inflight 1\n"
+        "# HELP latency_seconds Latency.\n"
+        "# TYPE latency_seconds histogram\n"
+        'latency_seconds_bucket{tool="bash",le="0.1"} 1\n'
+        'latency_seconds_bucket{tool="bash",le="1"} 2\n'
+        'latency_seconds_bucket{tool="bash",le="+Inf"} 3\n'
+        'latency_seconds_sum{tool="bash"} 5.55\n'
+        'latency_seconds_count{tool="bash"} 3\n'
+    )
+
+    with pytest.raises(ValueError, match="already registered"):
+        registry.register(Gauge("inflight", "Duplicate."))
+    with pytest.raises(ValueError, match="expects labels"):
+        requests.inc(wrong="label")
+
+
+def test_gauge_tracking_and_removal():
+    gauge = Gauge("sessions", "Sessions.", labels=("session",))
+    with gauge.track_inprogress(session="a"):
+        assert gauge.value(session="a") == 1
+    assert gauge.value(session="a") == 0
+    gauge.remove(session="a")
+    assert "session=" not in gauge.expose()
+
+
+def test_estimate_messages_bytes():
+    messages = [
+        {"role": "user", "content": "hi"},
+        {
+            "role": "user",
+            "content": [{"type": "image", "source": {"data": "x" * 1000}}],
+        },
+    ]
+    assert metrics.estimate_messages_bytes(messages) >= 1002
+
+
+async def test_tool_latency_is_recorded(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("hello")
+    before = metrics.TOOL_SECONDS.count(tool="str_replace_editor", action="view")
+
+    await ToolCollection(EditTool()).run(
+        name="str_replace_editor", tool_input={"command": "view", "path": str(path)}
+    )
+
+    assert metrics.TOOL_SECONDS.count(tool="str_replace_editor", action="view") == (
+        before + 1
+    )
+
+
+async def test_bash_commands_stay_out_of_labels():
+    before = metrics.TOOL_SECONDS.count(tool="bash", action="run")
+
+    async with ToolCollection(BashTool()) as tools:
+        result = await tools.run(
+            name="bash", tool_input={"command": "echo secret-token-1234"}
+        )
+    assert result.output == "secret-token-1234"
+
+    assert metrics.TOOL_SECONDS.count(tool="bash", action="run") == before + 1
+    assert "secret-token-1234" not in metrics.REGISTRY.expose()
+
+
+async def test_monitor_event_loop_lag():
+    before = sum(metrics.EVENT_LOOP_LAG_SECONDS._counts.get((), []))
+    task = asyncio.create_task(metrics.monitor_event_loop_lag(interval=0.01))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    assert sum(metrics.EVENT_LOOP_LAG_SECONDS._counts.get((), [])) > before
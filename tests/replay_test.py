@@ -0,0 +1,200 @@
+import json
+
+import httpx
+import pytest
+from anthropic import Anthropic, AnthropicVertex
+
+from computer_use_demo.loop import APIProvider, sampling_loop
+from computer_use_demo.replay import (
+    Cassette,
+    Exchange,
+    ReplayConfig,
+    _aws_event_frame,
+    _parse_aws_events,
+    assemble_message,
+    message_events,
+    redact_images,
+    request_key,
+    serve_in_thread,
+)
+
+USER_MESSAGE = {"role": "user", "content": [{"type": "text", "text": "Hello"}]}
+RECORDED_MESSAGE = {
+    "id": "msg_1",
+    "type": "message",
+    "role": "assistant",
+    "model": "test-model",
+    "content": [{"type": "text", "text": "Hi there, how can I help?"}],
+    "stop_reason": "end_turn",
+    "stop_sequence": None,
+    "usage": {"input_tokens": 10, "output_tokens": 7},
+}
+
+
+@pytest.fixture
+def cassette(tmp_path):
+    cassette = Cassette(tmp_path / "cassette.jsonl")
+    cassette.add(
+        Exchange(
+            key=request_key([USER_MESSAGE]),
+            turn=1,
+            latency=0.0,
+            status=200,
+            response=RECORDED_MESSAGE,
+        )
+    )
+    return cassette
+
+
+def test_request_key_ignores_images_and_tool_output():
+    def conversation(image_data: str, output: str):
+        return [
+            USER_MESSAGE,
+            {
+                "role": "assistant",
+                "content": [
+                    {"type": "tool_use", "id": "t1", "name": "computer", "input": {}}
+                ],
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "tool_result",
+                        "tool_use_id": "t1",
+                        "content": [
+                            {"type": "text", "text": output},
+                            {
+                                "type": "image",
+                                "source": {"type": "base64", "data": image_data},
+                            },
+                        ],
+                    }
+                ],
+            },
+        ]
+
+    assert request_key(conversation("aaaa", "one")) == request_key(
+        conversation("bbbb", "two")
+    )
+    assert request_key([USER_MESSAGE]) != request_key(conversation("aaaa", "one"))
+
+
+def test_redact_images():
+    redacted = redact_images(
+        [{"type": "image", "source": {"type": "base64", "data": "abcd"}}]
+    )
+    assert "abcd" not in json.dumps(redacted)
+    assert len(redacted[0]["sha256"]) == 64
+
+
+def test_cassette_round_trip(tmp_path, cassette):
+    reloaded = Cassette(cassette.path)
+    exchange = reloaded.get(request_key([USER_MESSAGE]))
+    assert exchange is not None
+    assert exchange.response == RECORDED_MESSAGE
+
+    gzipped = Cassette(tmp_path / "cassette.jsonl.gz")
+    gzipped.add(exchange)
+    assert Cassette(gzipped.path).get(exchange.key) == exchange
+
+
+def test_message_events_reassemble():
+    message = {
+        **RECORDED_MESSAGE,
+        "content": [
+            *RECORDED_MESSAGE["content"],
+            {
+                "type": "tool_use",
+                "id": "t1",
+                "name": "bash",
+                "input": {"command": "ls"},
+            },
+        ],
+    }
+    events = [data for _, data in message_events(message, chunk_size=3)]
+    assert assemble_message(events) == message
+
+
+async def test_sampling_loop_replay(cassette):
+    with serve_in_thread(cassette) as server:
+        messages = await sampling_loop(
+            model="test-model",
+            provider=APIProvider.ANTHROPIC,
+            system_prompt_suffix="",
+            messages=[USER_MESSAGE],
+            output_callback=lambda block: None,
+            tool_output_callback=lambda result, tool_id: None,
+            api_response_callback=lambda request, response, error: None,
+            api_key="test-key",
+            base_url=server.base_url,
+        )
+    assert messages[-1] == {
+        "role": "assistant",
+        "content": [{"type": "text", "text": "Hi there, how can I help?"}],
+    }
+
+
+def test_streaming_and_rate_limits(cassette):
+    config = ReplayConfig(chunk_size=4, rate_limit_every=1, retry_after=0.01)
+    with serve_in_thread(cassette, config) as server:
+        client = Anthropic(api_key="test-key", base_url=server.base_url, max_retries=0)
+        with pytest.raises(Exception, match="rate"):
+            client.messages.create(
+                model="test-model", max_tokens=10, messages=[USER_MESSAGE]
+            )
+
+        config.rate_limit_every = 2
+        client = Anthropic(api_key="test-key", base_url=server.base_url, max_retries=2)
+        with client.messages.stream(
+            model="test-model", max_tokens=10, messages=[USER_MESSAGE]
+        ) as stream:
+            deltas = list(stream.text_stream)
+        assert len(deltas) > 1
+        assert "".join(deltas) == "Hi there, how can I help?"
+
+
+def test_vertex_routes(cassette):
+    with serve_in_thread(cassette) as server:
+        client = AnthropicVertex(
+            region="us-east5",
+            project_id="test-project",
+            access_token="test-token",
+            base_url=server.base_url,
+        )
+        message = client.messages.create(
+            model="test-model", max_tokens=10, messages=[USER_MESSAGE]
+        )
+    assert message.content[0].text == "Hi there, how can I help?"
+
+
+def test_records_bedrock_event_streams(cassette, tmp_path):
+    # boto3 isn't needed: the replay server stands in for Bedrock upstream, and its
+    # frames are what invoke-with-response-stream sends
+    recording = Cassette(tmp_path / "recording.jsonl")
+    path = "/model/test-model/invoke-with-response-stream"
+    body = {"anthropic_version": "bedrock-2023-05-31", "messages": [USER_MESSAGE]}
+    with (
+        serve_in_thread(cassette, ReplayConfig(chunk_size=4)) as bedrock,
+        serve_in_thread(recording, upstream=bedrock.base_url) as recorder,
+    ):
+        response = httpx.post(recorder.base_url + path, json=body)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/vnd.amazon.eventstream"
+    events = _parse_aws_events(response.content)
+    assert events[0]["type"] == "message_start"
+    assert assemble_message(events) == RECORDED_MESSAGE
+
+    exchange = Cassette(recording.path).get(request_key([USER_MESSAGE]))
+    assert exchange is not None
+    assert exchange.response == RECORDED_MESSAGE
+
+
+def test_parse_aws_events_rejects_corrupt_frames():
+    frame = _aws_event_frame({"type": "message_stop"})
+    assert _parse_aws_events(frame + frame) == [{"type": "message_stop"}] * 2
+    with pytest.raises(ValueError, match="Corrupt"):
+        _parse_aws_events(frame[:-1] + b"\x00")
+    with pytest.raises(ValueError, match="Truncated"):
+        _parse_aws_events(frame[:-8])
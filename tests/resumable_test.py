@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+from computer_use_demo import metrics
+from computer_use_demo.resumable import ResumableConnection, SessionStore, parse_ack
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.closed = False
+        self.sent: list[str | bytes] = []
+
+    async def send_str(self, data: str) -> None:
+        if self.closed:
+            raise ConnectionResetError("closed")
+        self.sent.append(data)
+
+    async def send_bytes(self, data: bytes) -> None:
+        if self.closed:
+            raise ConnectionResetError("closed")
+        self.sent.append(data)
+
+    def messages(self) -> list[dict | bytes]:
+        return [
+            data if isinstance(data, bytes) else json.loads(data) for data in self.sent
+        ]
+
+
+async def test_reconnect_replays_missed_messages():
+    connection = ResumableConnection("s1")
+    first = FakeWebSocket()
+    await connection.attach(first)
+    await connection.send_json({"response": "one"})
+    await connection.send_json({"response": "two"})
+    assert first.messages() == [
+        {"session": {"token": connection.token, "resumed": False, "seq": 0, "lost": 0}},
+        {"response": "one", "seq": 1},
+        {"response": "two", "seq": 2},
+    ]
+
+    # the connection drops; the session keeps producing
+    first.closed = True
+    await connection.send_bytes(b"frame")
+    await connection.send_json({"function_results": {"image": "abc"}})
+    assert not connection.attached
+    await connection.send_json({"response": "four"})
+
+    second = FakeWebSocket()
+    await connection.attach(second, ack=2)
+    assert second.messages() == [
+        {"session": {"token": connection.token, "resumed": True, "seq": 4, "lost": 0}},
+        b"frame",
+        {"function_results": {"image": "abc"}, "seq": 3},
+        {"response": "four", "seq": 4},
+    ]
+
+
+async def test_acked_and_overflowing_messages_leave_the_buffer():
+    connection = ResumableConnection("s1", max_buffer_bytes=100)
+    for index in range(10):
+        await connection.send_json({"response": str(index)})
+    connection.ack(3)
+
+    ws = FakeWebSocket()
+    await connection.attach(ws, ack=3)
+    greeting, *replayed = ws.messages()
+    assert replayed[-1] == {"response": "9", "seq": 10}
+    assert len(replayed) < 7
+    assert greeting["session"]["lost"] == 7 - len(replayed)
+
+
+async def test_store_evicts_idle_and_least_recently_used():
+    evicted = []
+
+    async def on_evict(session_id):
+        evicted.append(session_id)
+
+    store = SessionStore(on_evict, max_sessions=2, idle_timeout=60)
+    connections = [ResumableConnection(f"s{i}") for i in range(3)]
+    attached = FakeWebSocket()
+    await connections[0].attach(attached)
+    await store.add(connections[0])
+    await store.add(connections[1])
+    await store.add(connections[2])
+    # s0 is attached, so s1 goes even though s0 was used less recently
+    assert evicted == ["s1"]
+    assert connections[1].closed
+    assert store.find(connections[1].token) is None
+    assert store.find(connections[2].token) is connections[2]
+
+    idle = metrics.SESSION_EVICTIONS.value(reason="idle")
+    connections[2].last_active -= 120
+    await store.evict_idle()
+    assert evicted == ["s1", "s2"]
+    assert metrics.SESSION_EVICTIONS.value(reason="idle") == idle + 1
+    assert len(store) == 1
+
+
+def test_parse_ack():
+    assert parse_ack(None) == 0
+    assert parse_ack("") == 0
+    assert parse_ack("42") == 42
+    for value in ("abc", "-1", "1.5", " 1", "\u00b2"):
+        with pytest.raises(ValueError, match="non-negative integer"):
+            parse_ack(value)
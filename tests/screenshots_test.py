@@ -0,0 +1,62 @@
+import base64
+import hashlib
+import shutil
+
+import pytest
+
+from computer_use_demo import screenshots
+from computer_use_demo.executor import decode_frame
+from computer_use_demo.screenshots import ScreenshotStore
+
+# a 2x2 PNG
+PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAIAAAACCAIAAAD91JpzAAAAEElEQVR4nGP4z8AARAwQCgAf7gP9i18U1AAAAABJRU5ErkJggg=="
+)
+
+
+def b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+async def test_frames_are_sent_once(monkeypatch):
+    async def no_thumbnail(png):
+        return None
+
+    monkeypatch.setattr(screenshots, "make_thumbnail", no_thumbnail)
+    store = ScreenshotStore()
+    sha256 = store.add(b64(PNG))
+    assert sha256 == hashlib.sha256(PNG).hexdigest()
+
+    frame = await store.frame(sha256)
+    assert frame
+    header, image = decode_frame(frame)
+    # without a thumbnail the client gets the full image
+    assert header == {"sha256": sha256, "size": "full", "mime_type": "image/png"}
+    assert image == PNG
+
+    assert store.add(b64(PNG)) == sha256
+    assert await store.frame(sha256) is None
+    assert await store.frame(sha256, "full") is None
+    assert await store.frame(sha256, "full", resend=True)
+    assert await store.frame("unknown") is None
+
+
+async def test_eviction_forgets_sent_frames(monkeypatch):
+    async def thumbnail(png):
+        return b"thumb:" + png
+
+    monkeypatch.setattr(screenshots, "make_thumbnail", thumbnail)
+    store = ScreenshotStore(max_screenshots=2)
+    first = store.add(b64(b"first"))
+    assert decode_frame(await store.frame(first))[1] == b"thumb:first"
+    store.add(b64(b"second"))
+    store.add(b64(b"third"))
+    assert len(store) == 2
+    assert await store.frame(first) is None
+    first = store.add(b64(b"first"))
+    assert await store.frame(first)
+
+
+@pytest.mark.skipif(not shutil.which("convert"), reason="needs ImageMagick")
+async def test_make_thumbnail():
+    assert await screenshots.make_thumbnail(PNG, "1x1")
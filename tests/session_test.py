@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import pytest
+
+from computer_use_demo.session import Session, SessionManager
+from computer_use_demo.tools import BashTool
+
+
+async def test_messages_run_in_order():
+    handled = []
+
+    async def handler(message: str) -> None:
+        await asyncio.sleep(0.01)
+        handled.append(message)
+
+    session = Session("test", handler)
+    ahead = [session.submit(message) for message in ("one", "two", "three")]
+    assert ahead == [0, 1, 2]
+    assert session.busy
+    await session.wait_idle()
+    assert handled == ["one", "two", "three"]
+    await session.close()
+
+
+async def test_stop_cancels_turn_and_subprocess():
+    bash = BashTool()
+    started = asyncio.Event()
+    handled = []
+
+    async def handler(message: str) -> None:
+        started.set()
+        await bash(command=message)
+        handled.append(message)
+
+    session = Session("test", handler)
+    session.submit("sleep 30")
+    session.submit("echo queued")
+    await started.wait()
+    await asyncio.sleep(0.3)
+
+    began = time.perf_counter()
+    elapsed = await session.stop()
+    assert elapsed < 1
+    assert time.perf_counter() - began < 1
+    assert not session.busy
+    assert handled == []
+
+    session.submit("echo after")
+    await session.wait_idle()
+    assert handled == ["echo after"]
+    await session.close()
+
+
+async def test_errors_are_reported():
+    errors = []
+
+    async def handler(message: str) -> None:
+        raise ValueError(message)
+
+    async def on_error(error: Exception) -> None:
+        errors.append(error)
+
+    session = Session("test", handler, on_error)
+    session.submit("boom")
+    session.submit("again")
+    await session.wait_idle()
+    assert [str(error) for error in errors] == ["boom", "again"]
+    await session.close()
+
+
+async def test_session_manager():
+    async def handler(message: str) -> None:
+        await asyncio.sleep(30)
+
+    manager = SessionManager()
+    session = manager.open("a", handler)
+    manager.open("b", handler)
+    with pytest.raises(ValueError, match="already open"):
+        manager.open("a", handler)
+
+    session.submit("long")
+    await asyncio.sleep(0)
+    await manager.close("a")
+    assert not session.busy
+    assert list(manager) == ["b"]
+    await manager.close_all()
+    assert len(manager) == 0
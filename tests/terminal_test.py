@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+from computer_use_demo.loop import INTERRUPT_TEXT
+from computer_use_demo.replay import (
+    Cassette,
+    Exchange,
+    ReplayConfig,
+    request_key,
+    serve_in_thread,
+)
+from computer_use_demo.terminal import TerminalInterface
+
+
+async def test_interrupted_turn_heals_conversation(tmp_path, capsys):
+    user = {"role": "user", "content": [{"type": "text", "text": "Open Firefox"}]}
+    cassette = Cassette(tmp_path / "cassette.jsonl")
+    cassette.add(
+        Exchange(
+            key=request_key([user]),
+            turn=1,
+            latency=0.0,
+            status=200,
+            response={
+                "id": "msg_1",
+                "type": "message",
+                "role": "assistant",
+                "model": "test-model",
+                "content": [{"type": "text", "text": "Opening it."}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": {"input_tokens": 1, "output_tokens": 1},
+            },
+        )
+    )
+    with serve_in_thread(cassette, ReplayConfig(latency=1.5)) as server:
+        interface = TerminalInterface(api_key="test-key", base_url=server.base_url)
+        turn = asyncio.create_task(interface.handle_message("Open Firefox"))
+        await asyncio.sleep(0.3)
+        turn.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await turn
+
+    [message] = interface.messages
+    assert [block["text"] for block in message["content"]] == [
+        "Open Firefox",
+        INTERRUPT_TEXT,
+    ]
+    assert "Interrupted." in capsys.readouterr().out
@@ -1,11 +1,15 @@
+import asyncio
+
 import pytest
 
 from computer_use_demo.tools.bash import BashTool, ToolError
 
 
 @pytest.fixture
-def bash_tool():
-    return BashTool()
+async def bash_tool():
+    tool = BashTool(pool_size=1)
+    yield tool
+    await tool.close()
 
 
 @pytest.mark.asyncio
@@ -69,3 +73,117 @@ async def test_bash_tool_timeout(bash_tool):
         match="timed out: bash has not returned in 0.1 seconds and must be restarted",
     ):
         await bash_tool(command="sleep 1")
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_cancel_kills_command(bash_tool, tmp_path):
+    marker = tmp_path / "finished"
+    task = asyncio.create_task(bash_tool(command=f"sleep 2 && touch {marker}"))
+    await asyncio.sleep(0.5)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert bash_tool._session is None
+
+    result = await bash_tool(command="echo 'Fresh shell'")
+    assert result.output == "Fresh shell"
+    await asyncio.sleep(2)
+    assert not marker.exists()
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_env():
+    bash_tool = BashTool(env={"DISPLAY": ":42"}, pool_size=1)
+    result = await bash_tool(command="echo $DISPLAY")
+    assert result.output == ":42"
+    await bash_tool.close()
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_large_output(bash_tool):
+    # more than the pipe reader buffers before it stops reading
+    result = await asyncio.wait_for(bash_tool(command="seq 1 100000"), timeout=10)
+    assert result.output.startswith("1\n2\n")
+    assert result.output.endswith("\n100000")
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_takes_ready_shells_from_the_pool(bash_tool):
+    await bash_tool(command="export MARK=first")
+    assert len(bash_tool._pool) == 1
+    warm = await bash_tool._pool[0]
+    assert warm is not None and warm.alive
+
+    assert (await bash_tool(restart=True)).system == "tool has been restarted."
+    assert bash_tool._session is warm
+    result = await bash_tool(command="echo ${MARK:-fresh}")
+    assert result.output == "fresh"
+
+    # a pooled shell that died is replaced, not handed out
+    dead = await bash_tool._pool[0]
+    assert dead is not None
+    dead.kill()
+    await dead._process.wait()
+    await bash_tool(restart=True)
+    assert bash_tool._session is not dead
+    assert (await bash_tool(command="echo alive")).output == "alive"
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_without_pool():
+    bash_tool = BashTool(pool_size=0)
+    result = await bash_tool(command="echo 'No pool'")
+    assert result.output == "No pool"
+    assert not bash_tool._pool
+    await bash_tool.close()
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_first_command_uses_a_warm_shell(bash_tool):
+    assert len(bash_tool._pool) == 1
+    warm = await bash_tool._pool[0]
+    assert warm is not None and warm.alive
+
+    await bash_tool(command="true")
+    assert bash_tool._session is warm
+    assert len(bash_tool._pool) == 1
+
+
+def test_bash_tool_outside_a_loop_fills_the_pool_on_first_use():
+    bash_tool = BashTool(pool_size=1)
+    assert not bash_tool._pool
+
+    async def first_command():
+        await bash_tool(command="true")
+        assert len(bash_tool._pool) == 1
+        await bash_tool.close()
+
+    asyncio.run(first_command())
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_cancelled_restart_keeps_the_pool_size(bash_tool):
+    await bash_tool(command="true")
+    await bash_tool.close()
+    bash_tool._pool.append(asyncio.create_task(asyncio.sleep(10, None)))
+    warming = bash_tool._pool[0]
+
+    restart = asyncio.create_task(bash_tool(restart=True))
+    await asyncio.sleep(0.01)
+    restart.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await restart
+    assert len(bash_tool._pool) == 1
+    assert warming not in bash_tool._pool
+    assert warming.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_bash_tool_close_waits_for_the_shells(bash_tool):
+    await bash_tool(command="true")
+    session = bash_tool._session
+    warm = await bash_tool._pool[0]
+    await bash_tool.close()
+    assert session._process.returncode is not None
+    assert warm._process.returncode is not None
+    assert bash_tool._session is None and not bash_tool._pool
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from computer_use_demo.tools.dir_listing import DirectoryLister
+from computer_use_demo.tools.edit import EditTool
+
+
+def make_tree(root):
+    (root / "src" / "pkg").mkdir(parents=True)
+    (root / "src" / "pkg" / "mod.py").write_text("")
+    (root / "src" / "main.py").write_text("")
+    (root / ".git").mkdir()
+    (root / "README.md").write_text("")
+
+
+def age(path):
+    # listings of directories changed in the last second aren't cached
+    os.utime(path, ns=(0, path.stat().st_mtime_ns - 10**10))
+
+
+@pytest.mark.asyncio
+async def test_view_lists_two_levels_and_counts_collapsed_directories(tmp_path):
+    make_tree(tmp_path)
+    result = await EditTool()(command="view", path=str(tmp_path))
+    assert result.output == (
+        f"Here's the files and directories up to 2 levels deep in {tmp_path}, excluding hidden items:\n"
+        f"{tmp_path}\n"
+        f"{tmp_path}/README.md\n"
+        f"{tmp_path}/src\n"
+        f"{tmp_path}/src/main.py\n"
+        f"{tmp_path}/src/pkg [1 entry]\n"
+    )
+
+
+def test_stops_at_the_entry_budget(tmp_path):
+    for i in range(3):
+        (tmp_path / f"dir{i}").mkdir()
+        for j in range(5):
+            (tmp_path / f"dir{i}" / f"file{j}").write_text("")
+    listing = DirectoryLister(max_entries=5).listing(tmp_path).split("\n")
+    # the first level comes first, and every directory says what was left out
+    assert listing == [
+        str(tmp_path),
+        f"{tmp_path}/dir0",
+        f"{tmp_path}/dir0/file0",
+        f"{tmp_path}/dir0/file1",
+        f"{tmp_path}/dir0/... [3 more entries]",
+        f"{tmp_path}/dir1 [5 entries]",
+        f"{tmp_path}/dir2 [5 entries]",
+    ]
+
+
+def test_scans_are_cached_until_the_directory_changes(tmp_path):
+    make_tree(tmp_path)
+    for directory in (tmp_path, tmp_path / "src", tmp_path / "src" / "pkg"):
+        age(directory)
+    lister = DirectoryLister()
+    first = lister.listing(tmp_path)
+
+    # a file added without changing the directory's mtime isn't seen
+    mtime_ns = (tmp_path / "src").stat().st_mtime_ns
+    (tmp_path / "src" / "new.py").write_text("")
+    os.utime(tmp_path / "src", ns=(0, mtime_ns))
+    assert lister.listing(tmp_path) == first
+
+    os.utime(tmp_path / "src", ns=(0, mtime_ns + 1))
+    assert f"{tmp_path}/src/new.py" in lister.listing(tmp_path)
+
+
+def test_unreadable_root_is_an_error(tmp_path):
+    with pytest.raises(OSError):
+        DirectoryLister().listing(tmp_path / "missing")
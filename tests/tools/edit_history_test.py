@@ -0,0 +1,72 @@
+import random
+from pathlib import Path
+
+from computer_use_demo.tools.edit_history import FileHistory, Splice
+
+
+def test_splice_turns_newer_into_older():
+    for newer, older in [
+        ("", "abc"),
+        ("abc", ""),
+        ("abc", "abc"),
+        ("aXc", "aYYc"),
+        ("aaaa", "aa"),
+        ("ab" * 100_000, "ab" * 50_000 + "!" + "ab" * 50_000),
+    ]:
+        assert Splice.between(newer, older).apply(newer) == older
+
+
+def test_undo_restores_every_saved_content():
+    rng = random.Random(0)
+    history = FileHistory()
+    reference: dict[Path, list[str]] = {Path("/a"): [], Path("/b"): []}
+    for _ in range(500):
+        path = rng.choice(list(reference))
+        if reference[path] and rng.random() < 0.3:
+            assert history.pop(path) == reference[path].pop()
+        else:
+            text = "".join(rng.choice("ab\n") for _ in range(rng.randint(0, 30)))
+            history.push(path, text)
+            reference[path].append(text)
+        assert history[path] == reference[path]
+    for path, texts in reference.items():
+        while texts:
+            assert history.pop(path) == texts.pop()
+        assert history.pop(path) is None
+    assert history.memory_bytes == 0
+
+
+def test_large_file_history_is_stored_as_splices():
+    history = FileHistory()
+    text = "line\n" * 200_000
+    for edit in range(100):
+        text = text[: edit * 50] + f"edit {edit}\n" + text[edit * 50 :]
+        history.push(Path("/big"), text)
+    # about one copy, not a hundred
+    assert history.memory_bytes < 2 * len(text)
+    assert history.pop(Path("/big")) == text
+
+
+def test_memory_cap_evicts_least_recently_edited_files():
+    history = FileHistory(max_bytes=30_000)
+    history.push(Path("/old"), "o" * 10_000)
+    history.push(Path("/new"), "n" * 10_000)
+    history.push(Path("/new"), "N" * 15_000)
+    assert Path("/old") not in history
+    # the most recent edit can always be undone, even over the cap
+    assert history[Path("/new")] == ["n" * 10_000, "N" * 15_000]
+    history.push(Path("/new"), "x" * 40_000)
+    assert history[Path("/new")] == ["x" * 40_000]
+
+
+def test_spills_to_disk(tmp_path):
+    history = FileHistory(max_bytes=1_000, spill_dir=tmp_path)
+    history.push(Path("/a"), "a" * 5_000)
+    history.push(Path("/b"), "b" * 5_000 + "\r\n\ud800")
+    history.push(Path("/b"), "b" * 5_000)
+    assert history.memory_bytes <= 1_000
+    assert len(list(tmp_path.iterdir())) == 2
+    assert history.pop(Path("/b")) == "b" * 5_000
+    assert history.pop(Path("/b")) == "b" * 5_000 + "\r\n\ud800"
+    assert history.pop(Path("/a")) == "a" * 5_000
+    assert list(tmp_path.iterdir()) == []
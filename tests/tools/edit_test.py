@@ -1,5 +1,5 @@
 from pathlib import Path
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 
 import pytest
 
@@ -24,8 +24,10 @@ async def test_view_command():
     # Test viewing a directory
     with patch("pathlib.Path.exists", return_value=True), patch(
         "pathlib.Path.is_dir", return_value=True
-    ), patch("computer_use_demo.tools.edit.run") as mock_run:
-        mock_run.return_value = (None, "file1.txt\nfile2.txt", None)
+    ), patch(
+        "computer_use_demo.tools.dir_listing.DirectoryLister.listing"
+    ) as mock_list:
+        mock_list.return_value = "/test/dir\n/test/dir/file1.txt\n/test/dir/file2.txt"
         result = await edit_tool(command="view", path="/test/dir")
         assert isinstance(result, CLIResult)
         assert result.output
@@ -328,3 +330,161 @@ async def test_validate_path():
         "pathlib.Path.is_dir", return_value=True
     ):
         edit_tool.validate_path("view", Path("/directory/path"))
+
+
+@pytest.mark.asyncio
+async def test_large_file_edits_are_streamed(tmp_path, monkeypatch):
+    monkeypatch.setattr("computer_use_demo.tools.edit.MAPPED_READ_MIN_BYTES", 1)
+    monkeypatch.setattr("computer_use_demo.tools.edit.STREAMED_WRITE_MIN_CHARS", 1)
+    monkeypatch.setattr("computer_use_demo.tools.edit.WRITE_CHUNK_CHARS", 4)
+    path = tmp_path / "file.txt"
+    path.write_bytes(b"line 1\r\nline 2\nline 3\n\tline 4")
+    path.chmod(0o640)
+    edit_tool = EditTool()
+
+    result = await edit_tool(
+        command="str_replace", path=str(path), old_str="line 2", new_str="two"
+    )
+    assert "     2\ttwo\n" in result.output
+    await edit_tool(command="insert", path=str(path), insert_line=3, new_str="new")
+    assert path.read_text() == "line 1\ntwo\nline 3\nnew\n        line 4"
+    assert path.stat().st_mode & 0o777 == 0o640
+    assert [p.name for p in tmp_path.iterdir()] == ["file.txt"]
+
+    await edit_tool(command="undo_edit", path=str(path))
+    assert path.read_text() == "line 1\ntwo\nline 3\n        line 4"
+
+    # a failed write leaves the file as it was
+    monkeypatch.setattr("shutil.copymode", Mock(side_effect=OSError("no")))
+    with pytest.raises(ToolError, match="while trying to write"):
+        await edit_tool(
+            command="str_replace", path=str(path), old_str="two", new_str="2"
+        )
+    assert path.read_text() == "line 1\ntwo\nline 3\n        line 4"
+    assert [p.name for p in tmp_path.iterdir()] == ["file.txt"]
+
+
+@pytest.mark.asyncio
+async def test_multi_edit_command(tmp_path):
+    path = tmp_path / "file.txt"
+    other = tmp_path / "other.txt"
+    path.write_text("".join(f"line {i}\n" for i in range(1, 21)))
+    other.write_text("a\nb\n")
+    edit_tool = EditTool()
+
+    result = await edit_tool(
+        command="multi_edit",
+        path=str(path),
+        edits=[
+            {"old_str": "line 18\n", "new_str": ""},
+            {"old_str": "line 2\n", "new_str": "two\n2\n"},
+            {"insert_line": 0, "new_str": "start"},
+            {"insert_line": 3, "new_str": "after 3"},
+            {"path": str(other), "old_str": "b", "new_str": "B"},
+        ],
+    )
+    assert path.read_text() == (
+        "start\nline 1\ntwo\n2\nline 3\nafter 3\n"
+        + "".join(f"line {i}\n" for i in range(4, 21) if i != 18)
+    )
+    assert other.read_text() == "a\nB\n"
+    # the edits at the top share a snippet, numbered as in the edited file
+    assert result.output.count(f"a snippet of {path}") == 2
+    assert "     1\tstart\n     2\tline 1\n     3\ttwo\n" in result.output
+    assert "    20\tline 17\n    21\tline 19\n" in result.output
+
+    # one undo per file
+    await edit_tool(command="undo_edit", path=str(path))
+    assert path.read_text() == "".join(f"line {i}\n" for i in range(1, 21))
+
+    # nothing is written unless every edit is valid
+    for edits, error in [
+        ([{"old_str": "line 1", "new_str": "x"}], "Multiple occurrences|multiple"),
+        (
+            [
+                {"old_str": "line 5\n", "new_str": "x"},
+                {"old_str": "5\nline 6", "new_str": "y"},
+            ],
+            "Edits 1 and 2 overlap",
+        ),
+        ([{"insert_line": 30, "new_str": "x"}], "Invalid `insert_line` in edit 1"),
+        (
+            [
+                {"path": str(other), "old_str": "a", "new_str": "A"},
+                {"old_str": "missing", "new_str": "x"},
+            ],
+            "edit 2, old_str `missing` did not appear",
+        ),
+    ]:
+        with pytest.raises(ToolError, match=error):
+            await edit_tool(command="multi_edit", path=str(path), edits=edits)
+    assert path.read_text() == "".join(f"line {i}\n" for i in range(1, 21))
+    assert other.read_text() == "a\nB\n"
+
+
+@pytest.mark.asyncio
+async def test_multi_edit_plans_aliases_of_a_file_together(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("one\ntwo\nthree\n")
+    (tmp_path / "link.txt").symlink_to(path)
+    alias = tmp_path / "sub" / ".." / "file.txt"
+    (tmp_path / "sub").mkdir()
+    edit_tool = EditTool()
+
+    await edit_tool(
+        command="multi_edit",
+        path=str(path),
+        edits=[
+            {"old_str": "one", "new_str": "1"},
+            {"path": str(alias), "old_str": "two", "new_str": "2"},
+            {"path": str(tmp_path / "link.txt"), "old_str": "three", "new_str": "3"},
+        ],
+    )
+    assert path.read_text() == "1\n2\n3\n"
+
+    with pytest.raises(ToolError, match="Edits 1 and 2 overlap"):
+        await edit_tool(
+            command="multi_edit",
+            path=str(path),
+            edits=[
+                {"old_str": "1\n2", "new_str": "x"},
+                {"path": str(alias), "old_str": "2\n3", "new_str": "y"},
+            ],
+        )
+    assert path.read_text() == "1\n2\n3\n"
+
+
+@pytest.mark.asyncio
+async def test_multi_edit_rolls_back_every_file_it_can(tmp_path, monkeypatch):
+    paths = [tmp_path / name for name in ("a.txt", "b.txt", "c.txt")]
+    for path in paths:
+        path.write_text("old\n")
+    edit_tool = EditTool()
+    write_file = edit_tool.write_file
+    writes: dict[Path, int] = {}
+
+    def flaky_write_file(path, file):
+        writes[path] = writes.get(path, 0) + 1
+        # the edit of c fails, and so does restoring b
+        if (path, writes[path]) in ((paths[2], 1), (paths[1], 2)):
+            raise ToolError(f"Ran into a full disk while trying to write to {path}")
+        write_file(path, file)
+
+    monkeypatch.setattr(edit_tool, "write_file", flaky_write_file)
+    with pytest.raises(ToolError) as error:
+        await edit_tool(
+            command="multi_edit",
+            path=str(paths[0]),
+            edits=[
+                {"path": str(path), "old_str": "old", "new_str": "new"}
+                for path in paths
+            ],
+        )
+    assert error.value.message.startswith(
+        f"Ran into a full disk while trying to write to {paths[2]}"
+    )
+    assert error.value.message.endswith(f"may be partly edited: {paths[1]}")
+    assert paths[0].read_text() == "old\n"
+    assert paths[2].read_text() == "old\n"
+    with pytest.raises(ToolError, match="No edit history"):
+        await edit_tool(command="undo_edit", path=str(paths[0]))
@@ -0,0 +1,74 @@
+import os
+from unittest.mock import Mock
+
+from computer_use_demo import metrics
+from computer_use_demo.tools.edit import EditTool
+from computer_use_demo.tools.file_cache import FileCache
+
+
+def test_entries_are_valid_while_the_file_is_unchanged(tmp_path):
+    path = tmp_path / "file.txt"
+    path.write_text("a\tb\n")
+    cache = FileCache()
+    load = Mock(side_effect=lambda path: path.read_text())
+
+    assert cache.read(path, load) == "a\tb\n"
+    assert cache.read(path, load, expand_tabs=True) == "a       b\n"
+    assert load.call_count == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # same size, new mtime
+    path.write_text("c\td\n")
+    os.utime(path, ns=(0, path.stat().st_mtime_ns + 1))
+    assert cache.read(path, load) == "c\td\n"
+    assert load.call_count == 2
+
+    index = cache.line_index(path)
+    assert cache.line_index(path) is index
+    assert cache.read(path, load) == "c\td\n"
+    assert load.call_count == 2
+    assert cache.hit_rate == 3 / 6
+
+
+def test_evicts_least_recently_used_and_skips_large_files(tmp_path):
+    cache = FileCache(max_bytes=3_000, max_entry_bytes=1_500)
+    paths = []
+    for name in "abc":
+        path = tmp_path / name
+        path.write_text(name * 1_000)
+        paths.append(path)
+        cache.read(path, lambda path: path.read_text())
+    assert len(cache._entries) == 2
+    assert paths[0] not in cache._entries
+    assert cache.memory_bytes <= 3_000
+
+    large = tmp_path / "large"
+    large.write_text("x" * 2_000)
+    cache.read(large, lambda path: path.read_text())
+    assert large not in cache._entries
+
+
+async def test_edits_reuse_the_cached_text(tmp_path, monkeypatch):
+    path = tmp_path / "file.py"
+    path.write_text("def f():\n\treturn 1\n")
+    tool = EditTool()
+    read_file = Mock(wraps=tool.read_file)
+    monkeypatch.setattr(tool, "read_file", read_file)
+    hits = metrics.FILE_CACHE_LOOKUPS.value(result="hit")
+
+    await tool(command="view", path=str(path))
+    await tool(command="str_replace", path=str(path), old_str="1", new_str="2")
+    result = await tool(command="view", path=str(path))
+    await tool(command="insert", path=str(path), insert_line=2, new_str="# end")
+    assert read_file.call_count == 1
+    assert "     2\t        return 2\n" in result.output
+    assert path.read_text() == "def f():\n        return 2\n# end\n"
+    assert (await tool(command="view", path=str(path))).output.endswith(
+        "# end\n     4\t\n"
+    )
+    assert metrics.FILE_CACHE_LOOKUPS.value(result="hit") == hits + 4
+
+    # changes by others are seen
+    path.write_text("changed\n")
+    assert "changed" in (await tool(command="view", path=str(path))).output
+    assert read_file.call_count == 2
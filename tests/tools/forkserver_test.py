@@ -0,0 +1,105 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from computer_use_demo.tools.forkserver import ForkServer, split_command
+from computer_use_demo.tools.run import TRUNCATED_MESSAGE
+
+
+def is_running(pid: int) -> bool:
+    try:
+        state = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()[0]
+    except FileNotFoundError:
+        return False
+    return state != "Z"
+
+
+@pytest.fixture
+def server():
+    server = ForkServer()
+    yield server
+    server.close()
+
+
+def test_split_command():
+    assert split_command("DISPLAY=:1 xdotool mousemove --sync 10 20") == (
+        {"DISPLAY": ":1"},
+        ["xdotool", "mousemove", "--sync", "10", "20"],
+    )
+    assert split_command("xdotool type -- 'it'\"'\"'s; $HOME'") == (
+        {},
+        ["xdotool", "type", "--", "it's; $HOME"],
+    )
+    assert split_command("convert a.png -resize 10x10! a.png") == (
+        {},
+        ["convert", "a.png", "-resize", "10x10!", "a.png"],
+    )
+    for command in ("ls | wc", "echo $HOME", "a\nb", 'echo "$x"', "ls *", "X=1"):
+        assert split_command(command) is None
+
+
+@pytest.mark.asyncio
+async def test_run_returns_clipped_output(server):
+    assert await server.run(
+        ["sh", "-c", "echo $OUT; echo err >&2; exit 3"], env={"OUT": "out"}
+    ) == (3, "out\n", "err\n")
+
+    _, stdout, _ = await server.run(["seq", "1", "100000"], truncate_after=10)
+    assert stdout == "1\n2\n3\n4\n5\n" + TRUNCATED_MESSAGE
+
+    assert await server.run(["no-such-command"]) == (
+        127,
+        "",
+        "no-such-command: command not found\n",
+    )
+
+
+@pytest.mark.asyncio
+async def test_runs_commands_concurrently(server):
+    results = await asyncio.wait_for(
+        asyncio.gather(
+            *(server.run(["sh", "-c", f"sleep 0.5; echo {i}"]) for i in range(10))
+        ),
+        timeout=3,
+    )
+    assert results == [(0, f"{i}\n", "") for i in range(10)]
+
+
+@pytest.mark.asyncio
+async def test_timeout_and_cancellation_kill_the_process_group(server, tmp_path):
+    pids = []
+    for i, timeout in enumerate((0.5, None)):
+        pid_file = tmp_path / f"pid{i}"
+        command = server.run(
+            ["sh", "-c", f"sleep 30 & echo $! > {pid_file}; wait"], timeout=timeout
+        )
+        if timeout:
+            with pytest.raises(TimeoutError, match="timed out after 0.5 seconds"):
+                await command
+        else:
+            task = asyncio.create_task(command)
+            for _ in range(100):
+                if pid_file.exists() and pid_file.read_text():
+                    break
+                await asyncio.sleep(0.02)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        pids.append(int(pid_file.read_text()))
+    for _ in range(50):
+        if not any(map(is_running, pids)):
+            break
+        await asyncio.sleep(0.02)
+    assert not any(map(is_running, pids))
+    # the helper is still serving
+    assert await server.run(["echo", "ok"]) == (0, "ok\n", "")
+
+
+@pytest.mark.asyncio
+async def test_restarts_after_the_helper_exits(server):
+    await server.run(["true"])
+    assert server._process
+    server._process.kill()
+    server._process.wait()
+    assert await server.run(["echo", "again"]) == (0, "again\n", "")
@@ -0,0 +1,49 @@
+import pytest
+
+from computer_use_demo.tools import edit
+from computer_use_demo.tools.base import ToolError
+from computer_use_demo.tools.edit import EditTool
+from computer_use_demo.tools.line_index import LineIndex
+
+
+@pytest.mark.parametrize(
+    "text",
+    ["", "one", "one\n", "one\ntwo\n\nfour", "é\r\nü\r\n\ttab\n"],
+)
+def test_reads_ranges_like_split(tmp_path, text):
+    path = tmp_path / "file.txt"
+    path.write_bytes(text.encode())
+    lines = text.replace("\r\n", "\n").split("\n")
+    index = LineIndex(path, path.stat())
+    assert index.line_count() == len(lines)
+    for first in range(1, len(lines) + 1):
+        assert index.read_lines(first, -1) == "\n".join(lines[first - 1 :])
+        for last in range(first, len(lines) + 1):
+            assert index.read_lines(first, last) == "\n".join(lines[first - 1 : last])
+    assert not index.has_line(len(lines) + 1)
+
+
+async def test_view_range_of_large_file(tmp_path, monkeypatch):
+    path = tmp_path / "big.log"
+    lines = [f"line {i}\twith a tab" for i in range(1, 10_001)]
+    path.write_text("\n".join(lines))
+    tool = EditTool()
+    expected = await tool(command="view", path=str(path), view_range=[5000, 5002])
+
+    monkeypatch.setattr(edit, "LINE_INDEX_MIN_BYTES", 1)
+    monkeypatch.setattr(
+        EditTool, "read_file", lambda self, path: pytest.fail("read the whole file")
+    )
+    result = await tool(command="view", path=str(path), view_range=[5000, 5002])
+    assert result.output == expected.output
+    assert "  5001\tline 5001       with a tab\n" in result.output
+    assert (await tool(command="view", path=str(path), view_range=[9999, -1])).output
+
+    with pytest.raises(
+        ToolError, match=r"within the range of lines of the file: \[1, 10000\]"
+    ):
+        await tool(command="view", path=str(path), view_range=[10_001, -1])
+    with pytest.raises(ToolError, match="number of lines in the file: `10000`"):
+        await tool(command="view", path=str(path), view_range=[1, 10_001])
+    with pytest.raises(ToolError, match="larger or equal than its first"):
+        await tool(command="view", path=str(path), view_range=[3, 2])
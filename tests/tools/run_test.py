@@ -0,0 +1,85 @@
+import asyncio
+import tracemalloc
+from pathlib import Path
+
+import pytest
+
+from computer_use_demo.tools.run import (
+    TRUNCATED_MESSAGE,
+    BoundedOutput,
+    Command,
+    run,
+)
+
+
+def is_running(pid: int) -> bool:
+    try:
+        state = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()[0]
+    except FileNotFoundError:
+        return False
+    return state != "Z"
+
+
+@pytest.mark.asyncio
+async def test_run_returns_clipped_output():
+    assert await run("echo out; echo err >&2; exit 3") == (3, "out\n", "err\n")
+
+    _, stdout, _ = await run("seq 1 100000", truncate_after=10)
+    assert stdout == "1\n2\n3\n4\n5\n" + TRUNCATED_MESSAGE
+
+    _, stdout, _ = await run("seq 1 100000", truncate_after=10, keep_tail=13)
+    omitted = len("".join(f"{i}\n" for i in range(1, 100001))) - 10 - 13
+    assert stdout == (
+        f"1\n2\n3\n4\n5\n\n<response clipped: {omitted} bytes omitted>\n"
+        "99999\n100000\n"
+    )
+
+
+@pytest.mark.asyncio
+async def test_run_keeps_memory_bounded():
+    tracemalloc.start()
+    try:
+        _, stdout, _ = await run("head -c 50000000 /dev/zero | tr '\\0' x")
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert stdout.startswith("x" * 16000 + "<response clipped>")
+    assert peak < 5_000_000
+
+
+@pytest.mark.asyncio
+async def test_timeout_kills_the_process_group(tmp_path):
+    pid_file = tmp_path / "pid"
+    with pytest.raises(TimeoutError, match="timed out after 0.5 seconds"):
+        await run(f"sleep 30 & echo $! > {pid_file}; wait", timeout=0.5)
+    pid = int(pid_file.read_text())
+    for _ in range(50):
+        if not is_running(pid):
+            break
+        await asyncio.sleep(0.02)
+    assert not is_running(pid)
+
+
+@pytest.mark.asyncio
+async def test_command_yields_output_as_it_arrives():
+    chunks = []
+    async with Command("echo one; sleep 0.2; echo two >&2") as command:
+        async for stream, chunk in command:
+            chunks.append((stream, chunk, asyncio.get_running_loop().time()))
+    assert [(stream, chunk) for stream, chunk, _ in chunks] == [
+        ("stdout", b"one\n"),
+        ("stderr", b"two\n"),
+    ]
+    assert chunks[1][2] - chunks[0][2] >= 0.15
+    assert command.returncode == 0
+
+
+def test_bounded_output_counts_what_it_drops():
+    output = BoundedOutput(head_bytes=4, tail_bytes=3)
+    for data in (b"ab", b"cdef", b"ghij"):
+        output.feed(data)
+    assert (bytes(output.head), bytes(output.tail)) == (b"abcd", b"hij")
+    assert (output.total, output.dropped) == (10, 3)
+    assert output.text(truncate_after=2, keep_tail=3) == (
+        "ab\n<response clipped: 5 bytes omitted>\nhij"
+    )
@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+from computer_use_demo.tools.base import ToolError
+from computer_use_demo.tools.search import (
+    SearchTool,
+    TrigramIndex,
+    _required_literals,
+    shared_index,
+)
+
+
+def make_workspace(root):
+    (root / "src").mkdir()
+    (root / "src" / "app.py").write_text("import os\n\ndef main():\n    run_app()\n")
+    (root / "src" / "util.py").write_text("def run_app():\n    return 'Héllo'\n")
+    (root / "notes.md").write_text("Call run_app to start.\n")
+    (root / "image.bin").write_bytes(b"\0run_app")
+    (root / ".git").mkdir()
+    (root / ".git" / "config").write_text("run_app")
+
+
+@pytest.mark.asyncio
+async def test_search_returns_numbered_lines(tmp_path):
+    make_workspace(tmp_path)
+    tool = SearchTool(workspace=tmp_path)
+
+    result = await tool(query="run_app")
+    assert result.output == "\n".join(
+        [
+            f"{tmp_path}/notes.md:1:Call run_app to start.",
+            f"{tmp_path}/src/app.py:4:    run_app()",
+            f"{tmp_path}/src/util.py:1:def run_app():",
+        ]
+    )
+
+    result = await tool(query=r"def m\w+\(\)", regex=True, path=str(tmp_path / "src"))
+    assert result.output == f"{tmp_path}/src/app.py:3:def main():"
+
+    result = await tool(query="HÉLLO", ignore_case=True)
+    assert result.output == f"{tmp_path}/src/util.py:2:    return 'Héllo'"
+
+    result = await tool(query="missing")
+    assert result.output == f"No matches for `missing` in {tmp_path}."
+
+    with pytest.raises(ToolError, match="outside of the searched workspace"):
+        await tool(query="run_app", path="/")
+    with pytest.raises(ToolError, match="Invalid regular expression"):
+        await tool(query="(", regex=True)
+
+
+@pytest.mark.asyncio
+async def test_anchors_match_at_every_line(tmp_path):
+    make_workspace(tmp_path)
+    tool = SearchTool(workspace=tmp_path)
+
+    result = await tool(query="^def", regex=True)
+    assert result.output == "\n".join(
+        [
+            f"{tmp_path}/src/app.py:3:def main():",
+            f"{tmp_path}/src/util.py:1:def run_app():",
+        ]
+    )
+    result = await tool(query=r"\):$", regex=True)
+    assert result.output == "\n".join(
+        [
+            f"{tmp_path}/src/app.py:3:def main():",
+            f"{tmp_path}/src/util.py:1:def run_app():",
+        ]
+    )
+
+
+@pytest.mark.asyncio
+async def test_tools_share_the_index_and_report_truncation(tmp_path):
+    make_workspace(tmp_path)
+    tool = SearchTool(workspace=tmp_path)
+    assert SearchTool(workspace=str(tmp_path / "src" / ".."))._index is tool._index
+    assert shared_index(tmp_path) is tool._index
+
+    tool._index.max_files = 1
+    result = await tool(query="missing")
+    assert result.output == (
+        f"No matches for `missing` in {tmp_path}.\n"
+        f"<only the first 1 files of {tmp_path} are indexed, so others were not searched>"
+    )
+
+
+def test_index_narrows_candidates_and_follows_changes(tmp_path):
+    make_workspace(tmp_path)
+    index = TrigramIndex(tmp_path)
+    index.refresh()
+    # the binary and hidden files aren't indexed
+    assert len(index) == 3
+    assert index.candidates([b"import os"]) == [str(tmp_path / "src" / "app.py")]
+
+    app = tmp_path / "src" / "app.py"
+    app.write_text("import sys\n")
+    os.utime(app, ns=(0, app.stat().st_mtime_ns + 1))
+    (tmp_path / "notes.md").unlink()
+    (tmp_path / "new.py").write_text("import os\n")
+    index.refresh()
+    assert index.candidates([b"import os"]) == [str(tmp_path / "new.py")]
+    assert index.candidates([b"ok"]) == [
+        str(tmp_path / "new.py"),
+        str(tmp_path / "src" / "app.py"),
+        str(tmp_path / "src" / "util.py"),
+    ]
+
+
+def test_required_literals():
+    assert _required_literals(r"foo\.bar") == ["foo.bar"]
+    assert _required_literals(r"class\s+Foo\d{2,3}xyz") == ["class", "Foo", "xyz"]
+    assert _required_literals(r"abcd?e") == ["abc"]
+    assert _required_literals(r"[]abc]xyz(def)?") == ["xyz"]
+    assert _required_literals(r"\x41bcd") == []
+    assert _required_literals(r"foo|bar") == []
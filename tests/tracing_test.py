@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+from computer_use_demo import tracing
+from computer_use_demo.tools import EditTool, ToolCollection
+
+
+@pytest.fixture(autouse=True)
+def reset_tracing():
+    yield
+    tracing.disable()
+
+
+def test_disabled_span_is_shared_noop():
+    assert tracing.span("anything") is tracing.NULL_SPAN
+    with tracing.span("anything") as span:
+        span.set(ignored=True)
+
+
+def test_jsonl_export_and_session_summary(tmp_path):
+    tracer = tracing.configure(tmp_path / "trace.jsonl")
+    with tracing.session("a"):
+        with tracing.span("phase", step=1):
+            pass
+        with tracing.span("phase"):
+            pass
+    with tracing.session("b"), tracing.span("other"):
+        pass
+    tracer.close()
+
+    lines = [
+        json.loads(line) for line in (tmp_path / "trace.jsonl").read_text().splitlines()
+    ]
+    assert [line["name"] for line in lines] == ["phase", "phase", "other"]
+    assert lines[0]["session"] == "a"
+    assert lines[0]["attrs"] == {"step": 1}
+    assert tracer.summary("a")["phase"]["count"] == 2
+    assert set(tracer.summary("b")) == {"other"}
+    assert set(tracer.summary()) == {"phase", "other"}
+    assert "phase" in tracing.format_summary(tracer.summary())
+
+
+def test_chrome_export_records_errors(tmp_path):
+    tracer = tracing.configure(tmp_path / "trace.json")
+    with pytest.raises(ValueError), tracing.span("loop.api_call"):
+        raise ValueError
+    tracer.close()
+
+    events = json.loads((tmp_path / "trace.json").read_text().rstrip(",\n") + "]")
+    assert events[0]["ph"] == "X"
+    assert events[0]["cat"] == "loop"
+    assert events[0]["args"] == {"error": "ValueError"}
+
+
+async def test_tool_collection_emits_spans(tmp_path):
+    spans: list[tracing.Span] = []
+    tracing.configure(sink=spans.append)
+    path = tmp_path / "file.txt"
+    path.write_text("hello")
+
+    await ToolCollection(EditTool()).run(
+        name="str_replace_editor", tool_input={"command": "view", "path": str(path)}
+    )
+
+    assert spans[0].name == "tool.run"
+    assert spans[0].attrs == {"tool": "str_replace_editor", "action": "view"}
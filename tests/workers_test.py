@@ -0,0 +1,145 @@
+import asyncio
+import os
+import sys
+from collections import defaultdict
+from pathlib import Path
+
+import pytest
+
+from computer_use_demo.workers import WORKER_LOST_ERROR, WorkerPool
+
+ECHO_WORKER = """
+import asyncio
+import os
+
+from computer_use_demo.workers import WorkerHandler, serve
+
+
+class Echo(WorkerHandler):
+    def __init__(self):
+        self.connections = {}
+
+    async def open(self, session_id, connection):
+        print("stray output must not break the protocol")
+        if session_id.startswith("stuck"):
+            await asyncio.Event().wait()  # like waiting for a free display
+        self.connections[session_id] = connection
+
+    async def message(self, session_id, data):
+        if data.get("crash"):
+            os._exit(1)
+        if data.get("garble"):
+            self.connections[session_id]._output.write(b"not json\\n")
+            return
+        if "bytes" in data:
+            await self.connections[session_id].send_bytes(data["bytes"].encode())
+            return
+        await self.connections[session_id].send_json({"echo": data, "pid": os.getpid()})
+
+    async def close(self, session_id):
+        del self.connections[session_id]
+
+
+asyncio.run(serve(Echo()))
+"""
+
+
+@pytest.fixture
+async def pool():
+    received: dict[str, asyncio.Queue] = defaultdict(asyncio.Queue)
+    # deliveries to these sessions wait until the event is set
+    gates: dict[str, asyncio.Event] = {}
+
+    async def deliver(session_id, data):
+        if session_id in gates:
+            await gates[session_id].wait()
+        await received[session_id].put(data)
+
+    pool = WorkerPool(
+        2,
+        [sys.executable, "-c", ECHO_WORKER],
+        deliver,
+        env={"PYTHONPATH": str(Path(__file__).parent.parent)},
+    )
+    pool.received = received
+    pool.gates = gates
+    await pool.start()
+    yield pool
+    await pool.stop()
+
+
+async def roundtrip(pool, session_id, data):
+    await pool.send(session_id, data)
+    async with asyncio.timeout(10):
+        return await pool.received[session_id].get()
+
+
+async def test_sticky_routing(pool):
+    for session_id in "abcd":
+        await pool.open(session_id)
+    assert [len(worker.sessions) for worker in pool.workers] == [2, 2]
+
+    pids = {}
+    for _ in range(3):
+        for session_id in "abcd":
+            reply = await roundtrip(pool, session_id, {"message": session_id})
+            assert reply["echo"] == {"message": session_id}
+            assert pids.setdefault(session_id, reply["pid"]) == reply["pid"]
+    assert len(set(pids.values())) == 2
+
+    await pool.close("a")
+    assert pool.worker_for("a") is None
+    assert sum(len(worker.sessions) for worker in pool.workers) == 3
+
+
+async def test_crashed_worker_is_restarted(pool):
+    await pool.open("a")
+    await pool.open("b")
+    survivor_pid = (await roundtrip(pool, "b", {}))["pid"]
+    crashed_pid = (await roundtrip(pool, "a", {}))["pid"]
+
+    assert await roundtrip(pool, "a", {"crash": True}) == {"error": WORKER_LOST_ERROR}
+    reply = await roundtrip(pool, "a", {"message": "again"})
+    assert reply["pid"] not in (crashed_pid, os.getpid())
+    assert (await roundtrip(pool, "b", {}))["pid"] == survivor_pid
+
+
+async def test_binary_messages(pool):
+    await pool.open("a")
+    assert await roundtrip(pool, "a", {"bytes": "\x00frame"}) == b"\x00frame"
+
+
+async def test_unreadable_output_restarts_the_worker(pool):
+    await pool.open("a")
+    pid = (await roundtrip(pool, "a", {}))["pid"]
+
+    assert await roundtrip(pool, "a", {"garble": True}) == {"error": WORKER_LOST_ERROR}
+    assert (await roundtrip(pool, "a", {}))["pid"] != pid
+
+
+async def test_a_waiting_open_only_holds_up_its_session(pool):
+    await pool.open("stuck")
+    await pool.open("other-worker")
+    await pool.open("a")
+    assert pool.worker_for("a") is pool.worker_for("stuck")
+
+    assert (await roundtrip(pool, "a", {"message": "a"}))["echo"] == {"message": "a"}
+    await pool.close("stuck")
+
+
+async def test_a_slow_delivery_only_holds_up_its_session(pool):
+    await pool.open("slow")
+    await pool.open("other-worker")
+    await pool.open("a")
+    assert pool.worker_for("a") is pool.worker_for("slow")
+    pool.gates["slow"] = asyncio.Event()
+
+    await pool.send("slow", {"message": 1})
+    await pool.send("slow", {"message": 2})
+    assert (await roundtrip(pool, "a", {"message": "a"}))["echo"] == {"message": "a"}
+    assert pool.received["slow"].empty()
+
+    pool.gates["slow"].set()
+    async with asyncio.timeout(10):
+        replies = [await pool.received["slow"].get() for _ in range(2)]
+    assert [reply["echo"] for reply in replies] == [{"message": 1}, {"message": 2}]